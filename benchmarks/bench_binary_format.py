@@ -0,0 +1,89 @@
+"""
+Size and throughput comparison of the binary log format against the JSON lines format
+
+Usage: python -m benchmarks.bench_binary_format [--events N]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import loccer
+from loccer.integrations.platform_context import PlatformIntegration
+from loccer.outputs.binary import BinaryFileOutput, iter_records
+from loccer.outputs.file_stream import JSONFileOutput
+from loccer.outputs.misc import InMemoryOutput
+
+
+def _fail(depth: int, payload: dict):
+    if depth:
+        return _fail(depth - 1, payload)
+    raise RuntimeError("benchmark exception")
+
+
+def capture_events(count: int) -> list:
+    mem_out = InMemoryOutput()
+    lc = loccer.Loccer(output_handlers=(mem_out,), integrations=(PlatformIntegration(),), suppress_exception=True)
+    payload = {"user": "someone", "items": list(range(10))}
+
+    for x in range(count):
+        with lc:
+            _fail(x % 20, payload)
+
+    return mem_out.logs
+
+
+def bench_output(output, events: list) -> float:
+    start = time.perf_counter()
+    for data in events:
+        output.output(_Frozen(data))
+    output.close()
+    return time.perf_counter() - start
+
+
+class _Frozen(loccer.bases.LoccerOutput):
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+
+    def as_json(self):
+        return self.data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000)
+    args = parser.parse_args()
+
+    events = capture_events(args.events)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = os.path.join(tmp_dir, "errors.log")
+        bin_path = os.path.join(tmp_dir, "errors.bin")
+
+        json_write = bench_output(JSONFileOutput(json_path, max_size=0, persistent=True, flush_interval=None), events)
+        bin_write = bench_output(BinaryFileOutput(bin_path, max_size=0), events)
+
+        start = time.perf_counter()
+        with open(json_path) as fd:
+            json_count = sum(1 for line in fd if json.loads(line))
+        json_read = time.perf_counter() - start
+
+        start = time.perf_counter()
+        bin_count = sum(1 for _ in iter_records(bin_path))
+        bin_read = time.perf_counter() - start
+
+        assert json_count == bin_count == len(events)
+        results = {
+            "events": len(events),
+            "json": {"size": os.path.getsize(json_path), "write_per_s": len(events) / json_write, "read_per_s": len(events) / json_read},
+            "binary": {"size": os.path.getsize(bin_path), "write_per_s": len(events) / bin_write, "read_per_s": len(events) / bin_read},
+        }
+
+    results["size_ratio"] = results["binary"]["size"] / results["json"]["size"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
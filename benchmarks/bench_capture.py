@@ -0,0 +1,246 @@
+"""
+Benchmarks of the exception capture hot path
+
+Measures the latency and throughput of the loccer exception hook across the stack depth, size of locals,
+number of integrations and the built-in output handlers, throughput of `log_metadata` and the peak memory
+of a single capture via tracemalloc. Results can be written as JSON and compared between versions.
+
+Usage:
+    python -m benchmarks.bench_capture --output results.json
+    python -m benchmarks.bench_capture --compare baseline.json --output results.json
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing as t
+
+import loccer
+from loccer.bases import Integration, LoccerOutput
+from loccer.integrations.platform_context import PlatformIntegration
+from loccer.outputs.file_stream import JSONFileOutput, JSONStreamOutput, wait_for_rotation
+from loccer.outputs.misc import InMemoryOutput, NullOutput
+
+
+class StaticIntegration(Integration):
+    NAME = "static"
+
+    def __init__(self, idx: int = 0):
+        self.NAME = f"static_{idx}"
+
+    def gather(self, context: LoccerOutput) -> dict:
+        return {"key": "value", "number": 42}
+
+
+def _fail(depth: int, locals_size: int):
+    # Alternates with `_fail_alternate` so the frames are not collapsed as a recursion
+    if depth > 1:
+        return _fail_alternate(depth - 1, locals_size)
+
+    payload = {f"key_{x}": x for x in range(locals_size)}
+    raise RuntimeError("benchmark exception")
+
+
+def _fail_alternate(depth: int, locals_size: int):
+    if depth > 1:
+        return _fail(depth - 1, locals_size)
+
+    payload = {f"key_{x}": x for x in range(locals_size)}
+    raise RuntimeError("benchmark exception")
+
+
+def _fail_recursive(depth: int, locals_size: int):
+    if depth > 1:
+        return _fail_recursive(depth - 1, locals_size)
+
+    payload = {f"key_{x}": x for x in range(locals_size)}
+    raise RuntimeError("benchmark exception")
+
+
+class Scenario:
+    def __init__(
+        self,
+        name: str,
+        depth: int = 10,
+        locals_size: int = 10,
+        integrations: t.Callable[[], t.Sequence[Integration]] = tuple,
+        output: t.Callable[[str], loccer.bases.OutputBase] = lambda tmp_dir: NullOutput(),
+        metadata: bool = False,
+        recursive: bool = False,
+    ):
+        """
+        :param recursive: Raise from identical recursive frames, these are collapsed into a single frame record
+        """
+        self.name = name
+        self.depth = depth
+        self.locals_size = locals_size
+        self.integrations = integrations
+        self.output = output
+        self.metadata = metadata
+        self.recursive = recursive
+
+    def setup(self, tmp_dir: str) -> t.Tuple[t.Callable[[], None], loccer.bases.OutputBase]:
+        out = self.output(tmp_dir)
+        lc = loccer.Loccer(output_handlers=(out,), integrations=self.integrations(), suppress_exception=True)
+
+        if self.metadata:
+            def run():
+                lc.log_metadata({"msg": "benchmark metadata", "value": 42})
+        else:
+            fail = _fail_recursive if self.recursive else _fail
+
+            def run():
+                with lc:
+                    fail(self.depth, self.locals_size)
+
+        return run, out
+
+
+class _ClearingInMemoryOutput(InMemoryOutput):
+    # Keep the memory flat during the long benchmark runs
+    def output(self, exc: LoccerOutput) -> None:
+        super().output(exc)
+        if len(self.logs) > 100:
+            self.logs.clear()
+
+
+SCENARIOS = [
+    *(Scenario(f"depth_{x}", depth=x) for x in (1, 10, 100)),
+    # Measures the collapse of the recursive frames, not the capture of the deep stack
+    *(Scenario(f"recursion_collapse_{x}", depth=x, recursive=True) for x in (100, 500)),
+    *(Scenario(f"locals_{x}", locals_size=x) for x in (0, 100, 10000)),
+    Scenario("integrations_0"),
+    Scenario("integrations_platform", integrations=lambda: (PlatformIntegration(),)),
+    Scenario("integrations_5", integrations=lambda: tuple(StaticIntegration(x) for x in range(5))),
+    Scenario("output_null"),
+    Scenario("output_in_memory", output=lambda tmp_dir: _ClearingInMemoryOutput()),
+    Scenario("output_json_stream", output=lambda tmp_dir: JSONStreamOutput(io.StringIO())),
+    Scenario("output_json_file", output=lambda tmp_dir: JSONFileOutput(os.path.join(tmp_dir, "errors.log"), max_size=0)),
+    Scenario(
+        "output_json_file_persistent",
+        output=lambda tmp_dir: JSONFileOutput(os.path.join(tmp_dir, "errors.log"), max_size=0, persistent=True)
+    ),
+    Scenario(
+        "output_json_file_rotation",
+        output=lambda tmp_dir: JSONFileOutput(os.path.join(tmp_dir, "errors.log"), max_size=2**16, max_files=3)
+    ),
+    Scenario("log_metadata", metadata=True),
+    Scenario("log_metadata_platform", metadata=True, integrations=lambda: (PlatformIntegration(),)),
+]
+
+
+def run_scenario(scenario: Scenario, iterations: int, warmup: int) -> t.Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run, out = scenario.setup(tmp_dir)
+
+        for _ in range(warmup):
+            run()
+
+        timings = []
+        start = time.perf_counter()
+        for _ in range(iterations):
+            it_start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - it_start)
+        total = time.perf_counter() - start
+
+        tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        out.close()
+        wait_for_rotation()
+
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "mean_us": statistics.fmean(timings) * 1e6,
+        "p50_us": timings[len(timings) // 2] * 1e6,
+        "p95_us": timings[int(len(timings) * 0.95)] * 1e6,
+        "max_us": timings[-1] * 1e6,
+        "throughput_per_s": iterations / total,
+        "peak_memory_bytes": peak,
+    }
+
+
+def compare(results: t.Dict[str, t.Any], baseline: t.Dict[str, t.Any], threshold: float) -> t.List[str]:
+    """
+    Compare the mean latency of the scenarios with the baseline results
+
+    :return: Names of the scenarios that regressed by more than the threshold
+    """
+    regressions = []
+    print(f"{'scenario':<32} {'baseline us':>12} {'current us':>12} {'ratio':>8}")
+
+    for name, current in results["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            print(f"{name:<32} {'-':>12} {current['mean_us']:>12.1f} {'-':>8}")
+            continue
+
+        ratio = current["mean_us"] / previous["mean_us"]
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print(f"{name:<32} {previous['mean_us']:>12.1f} {current['mean_us']:>12.1f} {ratio:>8.2f}{flag}")
+
+    return regressions
+
+
+def main(argv: t.Optional[t.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=500, help="Measured iterations per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="Warmup iterations per scenario")
+    parser.add_argument("--filter", help="Run only scenarios containing this substring")
+    parser.add_argument("--output", help="Write machine readable results into this JSON file")
+    parser.add_argument("--compare", help="Compare the results with a previously written JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    results = {
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "results": {},
+    }
+
+    for scenario in SCENARIOS:
+        if args.filter and args.filter not in scenario.name:
+            continue
+
+        data = run_scenario(scenario, args.iterations, args.warmup)
+        results["results"][scenario.name] = data
+        print(
+            f"{scenario.name:<32} mean={data['mean_us']:>10.1f}us p95={data['p95_us']:>10.1f}us "
+            f"{data['throughput_per_s']:>10.0f}/s peak={data['peak_memory_bytes'] / 1024:>8.1f}KiB",
+            file=sys.stderr
+        )
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+        if compare(results, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@ import loccer
 from loccer.integrations.platform_context import PlatformIntegration
 from loccer.integrations.quart_context import QuartContextIntegration
 from loccer.integrations.asyncio_context import AsyncioContextIntegration
+from loccer.outputs.asyncio_output import AsyncioDispatcher
 from loccer.outputs.file_stream import JSONFileOutput
 
 
@@ -22,13 +23,22 @@ async def index_error():
 
 
 
+# Serialization and disk writes are offloaded from the event loop
+dispatcher = AsyncioDispatcher((JSONFileOutput(
+    filename="errors.log",
+    max_files=3,
+    max_size=(1024**2) * 10,  # 10MB
+    compressed=True,
+),))
+
+
+@app.after_serving
+async def flush_errors():
+    await dispatcher.aclose()
+
+
 loccer.install(
-    output_handlers=(JSONFileOutput(
-        filename="errors.log",
-        max_files=3,
-        max_size=(1024**2) * 10,  # 10MB
-        compressed=True,
-    ),),
+    output_handlers=(dispatcher,),
     integrations=(
         PlatformIntegration(),
         asyncio_ctx,
@@ -1,17 +1,26 @@
 from __future__ import annotations
 
+import atexit
 import os
 import sys
+import threading
 import traceback as tb_module
 import typing as t
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from functools import partial, wraps
-from unittest.mock import patch
 
 from . import bases
 from .outputs.misc import NullOutput
 from .outputs.stderr import StderrOutput
 from .integrations.platform_context import PlatformIntegration
 from .ltypes import T_exc_val, T_exc_type, T_exc_tb, T_exc_hook, JSONType
+from .safe_repr import SafeRepr
+from .source import DEFAULT_SOURCE_CACHE
+from .budget import Budget, CaptureBudget, BudgetExceeded
+from .dedup import Deduplicator
+from .fingerprint import compute_fingerprint
+from .ratelimit import RateLimiter
+from .stats import PipelineStats, timed
 
 
 DEFAULT_OUTPUT = (
@@ -20,6 +29,13 @@ DEFAULT_OUTPUT = (
 DEFAULT_INTEGRATIONS = (
     PlatformIntegration(),
 )
+BUDGET_MARKER = "loccer_budget"  #: Key in the `integrations_data` holding the integrations that exceeded their time budget
+INTEGRATION_WORKERS = 4  #: Size of the shared thread pool running the `THREAD_SAFE` integrations concurrently
+
+_EXECUTOR: t.Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+#: Integrations whose call timed out and still occupies a worker of the pool, skipped until the call finishes
+_HUNG_INTEGRATIONS: t.Dict[bases.Integration, Future] = {}
 
 
 class HybridContext:
@@ -46,6 +62,9 @@ class HybridContext:
     def log_metadata(self, data: JSONType):
         pass
 
+    def flush(self) -> None:
+        pass
+
     def from_exception(self, exc: BaseException) -> None:
         self.exc_handler(type(exc), exc, exc.__traceback__)
 
@@ -67,9 +86,19 @@ class Loccer(HybridContext):
         self,
         output_handlers: t.Sequence[bases.OutputBase] = DEFAULT_OUTPUT,
         integrations: t.Sequence[bases.Integration] = DEFAULT_INTEGRATIONS,
-        exc_hook=None, **kwargs
+        exc_hook=None,
+        repr_engine: t.Optional[SafeRepr] = None,
+        dedup: t.Optional[Deduplicator] = None,
+        rate_limiter: t.Optional[RateLimiter] = None,
+        globals_capture: str = "all",
+        source_lines: bool = True,
+        stats: t.Optional[PipelineStats] = None,
+        budget: t.Optional[CaptureBudget] = None,
+        concurrent_integrations: bool = False,
+        **kwargs
     ):
         super().__init__(**kwargs)
+        bases.validate_globals_capture(globals_capture)
 
         if exc_hook is None:
             exc_hook = excepthook
@@ -77,9 +106,21 @@ class Loccer(HybridContext):
         self.exc_hook = exc_hook
         self.output_handlers = output_handlers
         self.integrations = integrations
+        self.repr_engine = repr_engine
+        self.dedup = dedup
+        self.rate_limiter = rate_limiter
+        self.globals_capture = globals_capture
+        self.source_lines = source_lines
+        self.pipeline_stats = stats
+        self.budget = budget
+        self.concurrent_integrations = concurrent_integrations
         for x in integrations:
             x.activate(self)
 
+        if dedup is not None or rate_limiter is not None:
+            # Summaries still pending at the interpreter shutdown would be lost otherwise
+            atexit.register(self.flush)
+
     @property
     def exc_handler(self) -> T_exc_hook:
         kwargs = {}
@@ -89,19 +130,72 @@ class Loccer(HybridContext):
         if self.output_handlers:
             kwargs["output_handlers"] = self.output_handlers
 
+        if self.repr_engine is not None:
+            kwargs["repr_engine"] = self.repr_engine
+
+        if self.dedup is not None:
+            kwargs["dedup"] = self.dedup
+
+        if self.rate_limiter is not None:
+            kwargs["rate_limiter"] = self.rate_limiter
+
+        if self.globals_capture != "all":
+            kwargs["globals_capture"] = self.globals_capture
+
+        if not self.source_lines:
+            kwargs["source_lines"] = self.source_lines
+
+        if self.pipeline_stats is not None:
+            kwargs["stats"] = self.pipeline_stats
+
+        if self.budget is not None:
+            kwargs["budget"] = self.budget
+
+        if self.concurrent_integrations:
+            kwargs["concurrent_integrations"] = self.concurrent_integrations
+
         if kwargs:
             return partial(self.exc_hook, **kwargs)
         else:
             return self.exc_hook
 
     def log_metadata(self, data: JSONType):
+        stats = self.pipeline_stats
         log = bases.MetadataLog(data)
 
         for x in self.integrations:
-            log.integrations_data[x.NAME] = x.gather(log)
+            with timed(stats, "integration", x.NAME):
+                log.integrations_data[x.NAME] = x.gather(log)
+
+        _output(log, self.output_handlers, stats)
+
+        if stats is not None:
+            stats.increment("metadata_events")
+            _emit_stats(stats, self.output_handlers)
+
+    def stats(self) -> t.Optional[t.Dict[str, t.Any]]:
+        """
+        Per stage timings and counters of the pipeline, None if the instrumentation is not enabled
+        """
+        if self.pipeline_stats is None:
+            return None
+
+        return self.pipeline_stats.snapshot(self.output_handlers)
+
+    def flush(self) -> None:
+        """
+        Emit pending summaries and flush all output handlers
+        """
+        for stage in (self.dedup, self.rate_limiter):
+            if stage is not None:
+                for summary in stage.pop_summaries(force=True):
+                    _output(bases.MetadataLog(summary), self.output_handlers)
+
+        if self.pipeline_stats is not None:
+            _emit_stats(self.pipeline_stats, self.output_handlers, force=True)
 
         for out_handler in self.output_handlers:
-            out_handler.output(log)
+            out_handler.flush()
 
 
 capture_exception = HybridContext()
@@ -113,38 +207,273 @@ def excepthook(
         traceback: bases.T_exc_tb,
         output_handlers:  t.Sequence[bases.OutputBase] = (),
         integrations: t.Sequence[bases.Integration] = (),
-        previous_hook: t.Optional[T_exc_hook]=None
+        previous_hook: t.Optional[T_exc_hook]=None,
+        repr_engine: t.Optional[SafeRepr]=None,
+        dedup: t.Optional[Deduplicator]=None,
+        rate_limiter: t.Optional[RateLimiter]=None,
+        globals_capture: str="all",
+        source_lines: bool=True,
+        stats: t.Optional[PipelineStats]=None,
+        budget: t.Optional[CaptureBudget]=None,
+        concurrent_integrations: bool=False
     ):
 
-    with patch("traceback.repr", new=_repr_mock):
-        exc_data = bases.ExceptionData.from_exception(value, capture_locals=True)
+    if stats is not None:
+        stats.increment("events")
+
+    total_budget = budget.start() if budget is not None else None
+
+    fingerprint = None
+    if dedup is not None or rate_limiter is not None:
+        # Decide before the `TracebackException` is constructed so the rejected exceptions are cheap
+        with timed(stats, "filter"):
+            fingerprint = compute_fingerprint(type, traceback)
+        emit = True
+
+        if dedup is not None:
+            emit = dedup.register(fingerprint, type.__name__)
+            for summary in dedup.pop_summaries():
+                _output(bases.MetadataLog(summary), output_handlers)
+
+        if emit and rate_limiter is not None:
+            emit = rate_limiter.allow(fingerprint, type.__name__)
+
+        if rate_limiter is not None:
+            for summary in rate_limiter.pop_summaries():
+                _output(bases.MetadataLog(summary), output_handlers)
+
+        if not emit:
+            if stats is not None:
+                stats.increment("filtered")
+            if previous_hook:
+                previous_hook(type, value, traceback)
+            return
+
+    # Frames are captured by `_gather` so they can overlap with the concurrently running integrations
+    exc_data = bases.ExceptionData.from_exception(
+        value,
+        capture_locals=True,
+        repr_engine=repr_engine,
+        fingerprint=fingerprint,
+        globals_capture=globals_capture,
+        lookup_lines=source_lines,
+        defer_capture=True
+    )
 
     exc_data.traceback = traceback
+    _gather(
+        exc_data,
+        integrations,
+        stats,
+        budget,
+        total_budget,
+        concurrent_integrations=concurrent_integrations,
+        capture=exc_data.capture_deferred
+    )
 
-    for x in integrations:
-        try:
-            exc_data.integrations_data[x.NAME] = x.gather(exc_data)
-        except Exception as exc:
-            desc = ["CRITICAL: error while calling the integration to gather data: "] + list(tb_module.format_exception(exc))
-            exc_data.integrations_data[x.NAME] = os.linesep.join(desc)
+    _output(exc_data, output_handlers, stats)
 
-    if output_handlers:
-        for out_handler in output_handlers:
-            out_handler.output(exc_data)
+    if stats is not None:
+        _emit_stats(stats, output_handlers)
 
     if previous_hook:
         previous_hook(type, value, traceback)
 
 
-def _repr_mock(obj: t.Any) -> str:
+def _gather(
+        log: bases.LoccerOutput,
+        integrations: t.Sequence[bases.Integration],
+        stats: t.Optional[PipelineStats] = None,
+        budget: t.Optional[CaptureBudget] = None,
+        total_budget: t.Optional[Budget] = None,
+        concurrent_integrations: bool = False,
+        capture: t.Optional[t.Callable[[], None]] = None
+    ) -> None:
+    """
+    Gather the data from integrations into the log
+
+    With `concurrent_integrations`, the `THREAD_SAFE` integrations are submitted to the shared thread pool first
+    and the rest runs inline on the calling thread after the `capture` callable. Results are merged
+    in the order of the integrations regardless of which one finished first. Integrations whose previous call
+    timed out and is still running are skipped so they can't starve the pool for the other integrations.
+    """
+    markers: t.Dict[str, JSONType] = {}
+    handled: t.Set[str] = set()
+    pending: t.Dict[str, t.Tuple[bases.Integration, Future, t.Optional[Budget]]] = {}
+
+    if concurrent_integrations:
+        for x in integrations:
+            if not x.THREAD_SAFE:
+                continue
+            elif not _can_start(log, x.NAME, budget, total_budget, markers):
+                handled.add(x.NAME)
+                continue
+            elif x in _HUNG_INTEGRATIONS:
+                log.integrations_data[x.NAME] = "SKIPPED: previous call of the integration is still running"
+                handled.add(x.NAME)
+                continue
+
+            int_budget = budget.for_integration(x.NAME, total_budget) if budget is not None else None
+            try:
+                future = _get_executor().submit(_call_integration, log, x, stats, int_budget)
+            except RuntimeError:
+                # Interpreter is shutting down, the integration is called inline instead
+                continue
+
+            pending[x.NAME] = (x, future, int_budget)
+            handled.add(x.NAME)
+
+    if capture is not None:
+        with timed(stats, "capture"):
+            capture()
+
+    for x in integrations:
+        if x.NAME in handled or not _can_start(log, x.NAME, budget, total_budget, markers):
+            continue
+
+        int_budget = budget.for_integration(x.NAME, total_budget) if budget is not None else None
+        log.integrations_data[x.NAME] = _call_integration(log, x, stats, int_budget)
+        _finish_integration(x.NAME, budget, int_budget, stats, markers)
+
+    if pending:
+        for name, (integration, future, int_budget) in pending.items():
+            try:
+                data = future.result(None if int_budget is None else int_budget.remaining())
+            except FutureTimeoutError:
+                data = "TIMEOUT: integration did not finish within its time budget"
+                _mark_hung(integration, future)
+
+            log.integrations_data[name] = data
+            _finish_integration(name, budget, int_budget, stats, markers)
+
+        gathered = log.integrations_data
+        log.integrations_data = {x.NAME: gathered.pop(x.NAME) for x in integrations if x.NAME in gathered}
+        log.integrations_data.update(gathered)
+
+    if markers:
+        log.integrations_data[BUDGET_MARKER] = {x.NAME: markers[x.NAME] for x in integrations if x.NAME in markers}
+
+
+def _call_integration(
+        log: bases.LoccerOutput,
+        integration: bases.Integration,
+        stats: t.Optional[PipelineStats],
+        int_budget: t.Optional[Budget]
+    ) -> JSONType:
+    if int_budget is not None:
+        log.budget = int_budget
+
     try:
-        return repr(obj)
-    except Exception as exc:
-        exc_desc = str(exc.__class__.__name__)
-        if exc.args:
-            exc_desc = f"{exc_desc}: {'; '.join(exc.args)}"
+        with timed(stats, "integration", integration.NAME):
+            try:
+                return integration.gather(log)
+            except BudgetExceeded:
+                return f"TIMEOUT: integration exceeded its time budget after {int_budget.elapsed():.3f}s"
+            except Exception as exc:
+                desc = ["CRITICAL: error while calling the integration to gather data: "] + list(tb_module.format_exception(exc))
+                if stats is not None:
+                    stats.increment("integration_errors")
+                return os.linesep.join(desc)
+    finally:
+        if int_budget is not None:
+            log.budget = None
+
+
+def _can_start(
+        log: bases.LoccerOutput,
+        name: str,
+        budget: t.Optional[CaptureBudget],
+        total_budget: t.Optional[Budget],
+        markers: t.Dict[str, JSONType]
+    ) -> bool:
+    if budget is None:
+        return True
+    elif budget.is_disabled(name):
+        log.integrations_data[name] = "DISABLED: integration has been disabled after repeatedly exceeding its time budget"
+        return False
+    elif total_budget.expired():
+        log.integrations_data[name] = "TIMEOUT: total capture time budget has been exhausted before calling the integration"
+        markers[name] = {"timeout": True, "elapsed": round(total_budget.elapsed(), 6), "skipped": True}
+        return False
+
+    return True
+
+
+def _finish_integration(
+        name: str,
+        budget: t.Optional[CaptureBudget],
+        int_budget: t.Optional[Budget],
+        stats: t.Optional[PipelineStats],
+        markers: t.Dict[str, JSONType]
+    ) -> None:
+    if budget is None:
+        return
+
+    # Data returned after the deadline is kept, the overrun is recorded next to it
+    timed_out = int_budget.expired()
+    disabled = budget.record(name, timed_out)
+    if timed_out:
+        markers[name] = {"timeout": True, "elapsed": round(int_budget.elapsed(), 6), "disabled": disabled}
+        if stats is not None:
+            stats.increment("integration_timeouts")
+
+
+def _mark_hung(integration: bases.Integration, future: Future) -> None:
+    _HUNG_INTEGRATIONS[integration] = future
+
+    def _done(_):
+        if _HUNG_INTEGRATIONS.get(integration) is future:
+            del _HUNG_INTEGRATIONS[integration]
+
+    # Called right away if the future has finished in the meantime
+    future.add_done_callback(_done)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(max_workers=INTEGRATION_WORKERS, thread_name_prefix="loccer-integration")
+
+    return _EXECUTOR
+
+
+def _reset_executor() -> None:
+    # Worker threads do not survive fork, a new pool is created lazily in the child
+    global _EXECUTOR, _EXECUTOR_LOCK
+    _EXECUTOR = None
+    _EXECUTOR_LOCK = threading.Lock()
+    _HUNG_INTEGRATIONS.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+def _output(
+        log: bases.LoccerOutput,
+        output_handlers: t.Sequence[bases.OutputBase],
+        stats: t.Optional[PipelineStats] = None
+    ) -> None:
+    if stats is None:
+        for out_handler in output_handlers:
+            out_handler.output(log)
+        return
 
-        return f"Error getting repr of the object: `{exc_desc}`"
+    # Serialization is timed lazily by the log itself, output handlers might defer it to another thread
+    log.pipeline_stats = stats
+
+    for out_handler in output_handlers:
+        with timed(stats, "output", out_handler.__class__.__name__):
+            out_handler.output(log)
+
+
+def _emit_stats(stats: PipelineStats, output_handlers: t.Sequence[bases.OutputBase], force: bool = False) -> None:
+    summary = stats.pop_summary(output_handlers, force=force)
+    if summary is not None:
+        _output(bases.MetadataLog(summary), output_handlers)
 
 
 def get_hybrid_context() -> HybridContext:
@@ -155,7 +484,16 @@ def install(
     *,
     preserve_previous=True,
     output_handlers:  t.Sequence[bases.OutputBase] = DEFAULT_OUTPUT,
-    integrations: t.Sequence[bases.Integration] = DEFAULT_INTEGRATIONS
+    integrations: t.Sequence[bases.Integration] = DEFAULT_INTEGRATIONS,
+    repr_engine: t.Optional[SafeRepr] = None,
+    dedup: t.Optional[Deduplicator] = None,
+    rate_limiter: t.Optional[RateLimiter] = None,
+    globals_capture: str = "all",
+    source_lines: bool = True,
+    prewarm_modules: t.Sequence[str] = (),
+    stats: t.Optional[PipelineStats] = None,
+    budget: t.Optional[CaptureBudget] = None,
+    concurrent_integrations: bool = False
     ) -> Loccer:
     """
     Installs loccer as a global exception handler and activates all it's integrations
@@ -163,13 +501,35 @@ def install(
     :param preserve_previous: Forward all exceptions to the previous/original value of sys.excepthook as well
     :param output_handlers: List of output handlers for storing captured exceptions
     :param integrations: List of loccer integrations
+    :param repr_engine: Bounded repr used for capturing locals and globals, default limits are used if not set
+    :param dedup: Suppress duplicates of the same exception fingerprint within a time window
+    :param rate_limiter: Global and per fingerprint rate limiting of captured exceptions
+    :param globals_capture: Mode of capturing module globals; `all`, `referenced` by the failing code or `none`
+    :param source_lines: Include source code lines of the frames, resolved lazily on serialization
+    :param prewarm_modules: Names of application modules/packages whose source files are loaded into the source cache upfront
+    :param stats: Collect per stage timings and counters of the pipeline, exposed via `Loccer.stats()`
+    :param budget: Per integration and total time limits of the capture, integrations timing out repeatedly are disabled
+    :param concurrent_integrations: Run the `THREAD_SAFE` integrations on a shared thread pool while the frames are captured
     :return: Instance of loccer that has been installed as the global exception hook
     """
     global capture_exception
+    bases.validate_globals_capture(globals_capture)
     previous = sys.excepthook
+
+    if prewarm_modules and source_lines:
+        DEFAULT_SOURCE_CACHE.prewarm_modules(prewarm_modules)
+
     kwargs = {
         "output_handlers": output_handlers,
-        "integrations": integrations
+        "integrations": integrations,
+        "repr_engine": repr_engine,
+        "dedup": dedup,
+        "rate_limiter": rate_limiter,
+        "globals_capture": globals_capture,
+        "source_lines": source_lines,
+        "stats": stats,
+        "budget": budget,
+        "concurrent_integrations": concurrent_integrations
     }
     if preserve_previous:
         kwargs["previous_hook"] = previous
@@ -179,7 +539,15 @@ def install(
     lc = Loccer(
         output_handlers=output_handlers,
         integrations=integrations,
-        exc_hook=exc_hook
+        exc_hook=exc_hook,
+        repr_engine=repr_engine,
+        dedup=dedup,
+        rate_limiter=rate_limiter,
+        globals_capture=globals_capture,
+        source_lines=source_lines,
+        stats=stats,
+        budget=budget,
+        concurrent_integrations=concurrent_integrations
     )
     capture_exception = lc
     return lc
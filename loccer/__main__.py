@@ -0,0 +1,77 @@
+import argparse
+import json
+import sys
+import typing as t
+
+from .query import query
+from .collector import Collector, DEFAULT_SOCKET_PATH, run
+from .outputs.multiprocess import merge_segments
+
+
+def main(argv: t.Optional[t.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m loccer", description="Loccer command line tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    query_parser = subparsers.add_parser("query", help="Query logs written by `JSONFileOutput` using sidecar indexes")
+    query_parser.add_argument("filename", help="Path to the live log file")
+    query_parser.add_argument("--since", help="ISO formatted timestamp, return logs at or after this time")
+    query_parser.add_argument("--until", help="ISO formatted timestamp, return logs at or before this time")
+    query_parser.add_argument("--type", dest="loccer_type", help="Loccer type of the log, for example `exception` or `metadata_log`")
+    query_parser.add_argument("--exc-type", help="Name of the exception type")
+    query_parser.add_argument("--fingerprint", help="Exception fingerprint")
+    query_parser.add_argument("--endpoint", help="Flask/Quart endpoint")
+    query_parser.add_argument("--limit", type=int, help="Maximum number of returned logs")
+    query_parser.add_argument("--no-backups", action="store_true", help="Do not search rotated backups")
+    query_parser.add_argument("--reindex", action="store_true", help="Rebuild the indexes from scratch")
+    query_parser.add_argument("--indent", type=int, help="Pretty print the logs with the given indentation")
+
+    merge_parser = subparsers.add_parser("merge", help="Merge per-process segments written by `MultiProcessFileOutput`")
+    merge_parser.add_argument("filename", help="Path to the main log file")
+    merge_parser.add_argument("--max-size", type=int, default=0, help="Rotate the main log file after the merge if it reached this size")
+    merge_parser.add_argument("--max-files", type=int, default=10, help="Maximum number of compressed backups to keep when rotating")
+    merge_parser.add_argument("--no-sort", action="store_true", help="Do not order the merged records by their timestamp")
+
+    collect_parser = subparsers.add_parser("collect", help="Run the collector daemon receiving logs from `SocketOutput`")
+    collect_parser.add_argument("filename", help="Path to the log file")
+    collect_parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Path of the Unix domain socket to listen on")
+    collect_parser.add_argument("--max-size", type=int, default=(2**20)*10, help="Rotate the log file when it reaches this size, 0 to disable")
+    collect_parser.add_argument("--max-files", type=int, default=10, help="Maximum number of compressed backups to keep when rotating")
+    collect_parser.add_argument("--flush-interval", type=float, default=0.5, help="Maximum time in seconds before the received logs are written")
+    collect_parser.add_argument("--socket-mode", type=lambda x: int(x, 8), default=0o660, help="Octal file permissions of the socket")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "query":
+        results = query(
+            args.filename,
+            since=args.since,
+            until=args.until,
+            include_backups=not args.no_backups,
+            reindex=args.reindex,
+            loccer_type=args.loccer_type,
+            exc_type=args.exc_type,
+            fingerprint=args.fingerprint,
+            endpoint=args.endpoint,
+        )
+        for idx, record in enumerate(results):
+            if args.limit is not None and idx >= args.limit:
+                break
+            print(json.dumps(record, indent=args.indent))
+    elif args.command == "merge":
+        count = merge_segments(args.filename, max_size=args.max_size, max_files=args.max_files, sort=not args.no_sort)
+        print(f"Merged {count} records into `{args.filename}`", file=sys.stderr)
+    elif args.command == "collect":
+        run(Collector(
+            args.filename,
+            socket_path=args.socket,
+            max_size=args.max_size,
+            max_files=args.max_files,
+            flush_interval=args.flush_interval,
+            socket_mode=args.socket_mode,
+        ))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
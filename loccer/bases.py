@@ -1,45 +1,397 @@
 import abc
 from abc import ABCMeta, abstractmethod
+import collections
 import datetime
+import itertools
+import sys
+import threading
 import traceback
+import types
 import typing as t
+from traceback import walk_tb
 
-from .ltypes import T_exc_tb, JSONType
+from .budget import Budget
+from .fingerprint import compute_fingerprint
+from .ltypes import T_exc_type, T_exc_val, T_exc_tb, JSONType
+from .safe_repr import SafeRepr, DEFAULT_SAFE_REPR
+from .source import DEFAULT_SOURCE_CACHE
+from .stats import PipelineStats, timed
 
 
 class LoccerOutput(metaclass=abc.ABCMeta):
     def __init__(self):
         self.ts = datetime.datetime.utcnow()
         self.integrations_data: JSONType = {}
+        self._budgets: t.Dict[int, Budget] = {}
+        self._json_cache: t.Optional[JSONType] = None
+        self._encoded_cache: t.Dict[t.Hashable, t.Any] = {}
+        #: Stats recording the serialization, timed by whichever thread serializes the log first
+        self.pipeline_stats: t.Optional[PipelineStats] = None
+
+    @property
+    def budget(self) -> t.Optional[Budget]:
+        """
+        Time budget of the integration currently gathering data, if limited
+        Tracked per thread as integrations can gather the data concurrently
+        """
+        budgets = getattr(self, "_budgets", None)
+        return budgets.get(threading.get_ident()) if budgets else None
+
+    @budget.setter
+    def budget(self, value: t.Optional[Budget]) -> None:
+        budgets = self.__dict__.setdefault("_budgets", {})
+        if value is None:
+            budgets.pop(threading.get_ident(), None)
+        else:
+            budgets[threading.get_ident()] = value
 
     @abc.abstractmethod
     def as_json(self) -> JSONType:
         ...
 
+    def cached_json(self) -> JSONType:
+        """
+        JSON representation of the log materialized only once and shared by all output handlers
+        Returned data must be treated as read-only
+
+        Subclasses that don't call `LoccerOutput.__init__` are supported, the caches are created lazily
+        """
+        data = getattr(self, "_json_cache", None)
+        if data is None:
+            with timed(getattr(self, "pipeline_stats", None), "serialize"):
+                data = self._json_cache = self.as_json()
+        return data
+
+    def encoded(
+        self,
+        key: t.Hashable,
+        encoder: t.Callable[[JSONType], t.Any],
+        stream_encoder: t.Optional[t.Callable[["LoccerOutput"], t.Any]] = None
+    ) -> t.Any:
+        """
+        Encode the cached JSON representation, result is cached under the key of the encoder configuration
+        so output handlers sharing the same configuration encode the log only once
+
+        :param key: Unique identification of the encoder and its configuration
+        :param encoder: Callable encoding the JSON representation
+        :param stream_encoder: Callable encoding the log directly, used instead of the `encoder`
+            while the JSON representation has not been materialized yet
+        """
+        cache = self.__dict__.setdefault("_encoded_cache", {})
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+
+        stats = getattr(self, "pipeline_stats", None)
+        if stream_encoder is not None and getattr(self, "_json_cache", None) is None:
+            with timed(stats, "encode"):
+                value = cache[key] = stream_encoder(self)
+            return value
+
+        data = self.cached_json()
+        with timed(stats, "encode"):
+            value = cache[key] = encoder(data)
+        return value
+
+    def invalidate_cache(self) -> None:
+        """
+        Drop the cached JSON representation after the log data has been modified
+        """
+        self._json_cache = None
+        self.__dict__.setdefault("_encoded_cache", {}).clear()
+
+
+LAZY_LINE = object()  #: Marker of a source line that would be resolved on the first access
+
+
+class FrameRecord:
+    """
+    Compact representation of a traceback frame
+
+    Filename and function name are interned, locals are stored as a tuple of (name, repr) pairs.
+    Consecutive identical frames of a recursion are collapsed into a single record with the `repeated` count.
+    """
+    __slots__ = ("filename", "lineno", "name", "_line", "locals", "repeated")
+
+    def __init__(
+        self,
+        filename: str,
+        lineno: t.Optional[int],
+        name: str,
+        line: t.Union[None, str, object] = LAZY_LINE,
+        locals: t.Optional[t.Tuple[t.Tuple[str, str], ...]] = None,
+        repeated: int = 0
+    ):
+        self.filename = sys.intern(filename)
+        self.lineno = lineno
+        self.name = sys.intern(name)
+        self._line = line
+        self.locals = locals
+        self.repeated = repeated  #: Number of identical frames collapsed into this record
+
+    @property
+    def line(self) -> t.Optional[str]:
+        """
+        Source code line, resolved lazily via the `loccer.source.DEFAULT_SOURCE_CACHE` on the first access
+        """
+        if self._line is LAZY_LINE:
+            self._line = DEFAULT_SOURCE_CACHE.getline(self.filename, self.lineno) if self.lineno else ""
+        return self._line
+
+    def as_json(self) -> JSONType:
+        data = {
+            "filename": self.filename,
+            "lineno": self.lineno,
+            "name": self.name,
+            "line": self.line,
+            "locals": dict(self.locals) if self.locals is not None else None,
+        }
+        if self.repeated:
+            data["repeated"] = self.repeated
+        return data
+
+    def as_frame_summary(self) -> traceback.FrameSummary:
+        summary = _FrameSummary(self)
+        if self.locals is not None:
+            summary.locals = dict(self.locals)
+        return summary
+
+
+class _FrameSummary(traceback.FrameSummary):
+    """
+    `FrameSummary` of the frame record, the source line is resolved by the record on the first access
+    """
+    __slots__ = ("_record",)
+
+    def __init__(self, record: FrameRecord):
+        super().__init__(record.filename, record.lineno, record.name, lookup_line=False)
+        self._record = record
+
+    @property
+    def line(self) -> t.Optional[str]:
+        return self._record.line
+
+    @property
+    def _original_line(self) -> t.Optional[str]:
+        # Used by `StackSummary.format` since Python 3.11
+        return self._record.line
+
 
 class ExceptionData(traceback.TracebackException, LoccerOutput):
-    def __init__(self, *args, traceback: t.Optional[T_exc_tb]=None, **kwargs):
-        super().__init__(*args, **kwargs)
+    """
+    Captured exception
+
+    Frames of the exception are captured by loccer directly as compact `FrameRecord` objects instead of the
+    `FrameSummary` objects built by the `traceback` module. Chained exceptions (`__cause__`, `__context__`
+    and members of exception groups) are still available as `TracebackException` objects with their frames
+    captured by loccer in the same way.
+    """
+    def __init__(
+        self,
+        exc_type: T_exc_type,
+        exc_value: T_exc_val,
+        exc_traceback: T_exc_tb,
+        *,
+        traceback: t.Optional[T_exc_tb]=None,
+        capture_locals: bool = False,
+        repr_engine: t.Optional[SafeRepr] = None,
+        fingerprint: t.Optional[str] = None,
+        globals_capture: str = "all",
+        collapse_recursion: bool = True,
+        limit: t.Optional[int] = None,
+        lookup_lines: bool = True,
+        defer_capture: bool = False,
+        **kwargs
+    ):
+        # Frames are not extracted by the traceback module, see `capture_frames`
+        super().__init__(exc_type, exc_value, exc_traceback, limit=0, lookup_lines=False, capture_locals=False, **kwargs)
         LoccerOutput.__init__(self)
         self.traceback = traceback
+        self.repr_engine = repr_engine or DEFAULT_SAFE_REPR
+        self.fingerprint = fingerprint or compute_fingerprint(exc_type, exc_traceback)
+        self.frames: t.List[FrameRecord] = []
+
+        self.globals_capture = globals_capture
+
+        capture_kwargs = {
+            "capture_locals": capture_locals,
+            "collapse_recursion": collapse_recursion,
+            "limit": limit,
+            "lookup_lines": lookup_lines
+        }
+        if defer_capture:
+            self._deferred_capture = (exc_traceback, exc_value, capture_kwargs)
+        else:
+            self._deferred_capture = None
+            self.capture_frames(exc_traceback, exc_value=exc_value, **capture_kwargs)
+
+    @property
+    def stack(self) -> traceback.StackSummary:
+        """
+        Frames as the `StackSummary` for compatibility with the `TracebackException` API, such as `format()`
+        """
+        return stack_summary(self.frames)
+
+    @stack.setter
+    def stack(self, value: traceback.StackSummary) -> None:
+        # Assigned by the `TracebackException.__init__`, frames are held in `self.frames` instead
+        pass
+
+    def capture_deferred(self) -> None:
+        """
+        Capture the frames if it has been deferred by the `defer_capture` when creating the exception data
+        """
+        if self._deferred_capture is not None:
+            exc_tb, exc_value, capture_kwargs = self._deferred_capture
+            self._deferred_capture = None
+            self.capture_frames(exc_tb, exc_value=exc_value, **capture_kwargs)
+
+    def capture_frames(
+        self,
+        exc_tb: T_exc_tb,
+        capture_locals: bool = False,
+        collapse_recursion: bool = True,
+        limit: t.Optional[int] = None,
+        lookup_lines: bool = True,
+        exc_value: t.Optional[BaseException] = None
+    ) -> None:
+        """
+        Walk the traceback and capture the frames as `FrameRecord` objects
+
+        :param exc_tb: Traceback of the exception
+        :param capture_locals: Capture the bounded repr of frame locals
+        :param collapse_recursion: Collapse consecutive identical frames into a single record
+        :param limit: Limit the number of frames with the same semantics as in the `traceback` module
+        :param lookup_lines: Lookup the source code lines of the frames lazily when serialized, False to drop them entirely
+        :param exc_value: Captured exception, frames of its chained exceptions are captured as well if provided
+        """
+        if limit is None:
+            limit = getattr(sys, "tracebacklimit", None)
+            if limit is not None and limit < 0:
+                limit = 0
+
+        capture_kwargs = {
+            "capture_locals": capture_locals,
+            "collapse_recursion": collapse_recursion,
+            "limit": limit,
+            "lookup_lines": lookup_lines
+        }
+        self.frames = self._frame_records(exc_tb, **capture_kwargs)
+
+        if exc_value is None:
+            return
+
+        # Chained exceptions are built by the `TracebackException.__init__` without frames (`limit=0`)
+        queue: t.List[t.Tuple[traceback.TracebackException, BaseException]] = [(self, exc_value)]
+        while queue:
+            te, exc = queue.pop()
+            if te is not self:
+                te.stack = stack_summary(self._frame_records(exc.__traceback__, **capture_kwargs))
+
+            if te.__cause__ is not None:
+                queue.append((te.__cause__, exc.__cause__))
+            if te.__context__ is not None:
+                queue.append((te.__context__, exc.__context__))
+            if getattr(te, "exceptions", None):
+                queue.extend(zip(te.exceptions, exc.exceptions))
+
+    def _frame_records(
+        self,
+        exc_tb: T_exc_tb,
+        capture_locals: bool,
+        collapse_recursion: bool,
+        limit: t.Optional[int],
+        lookup_lines: bool
+    ) -> t.List[FrameRecord]:
+        frames = walk_tb(exc_tb)
+        if limit is not None:
+            if limit >= 0:
+                frames = itertools.islice(frames, limit)
+            else:
+                frames = collections.deque(frames, maxlen=-limit)
+
+        records = []
+        previous = None
+        for frame, lineno in frames:
+            code = frame.f_code
+            if collapse_recursion and previous is not None and (
+                previous.lineno == lineno and previous.name == code.co_name and previous.filename == code.co_filename
+            ):
+                previous.repeated += 1
+                continue
+
+            f_locals = None
+            if capture_locals:
+                f_locals = tuple((name, self.repr_engine.repr(value)) for name, value in frame.f_locals.items())
+
+            previous = FrameRecord(
+                code.co_filename,
+                lineno,
+                code.co_name,
+                line=(LAZY_LINE if lookup_lines else None),
+                locals=f_locals
+            )
+            records.append(previous)
+
+        return records
 
     def as_json(self) -> JSONType:
-        data = {
+        data = self.json_header()
+        data["frames"] = [frame.as_json() for frame in self.frames]
+
+        f_globals = self.json_globals()
+        if f_globals is not None:
+            data["globals"] = f_globals
+
+        return data
+
+    def json_header(self) -> JSONType:
+        """
+        JSON representation without the `frames` and `globals` which follow it in this order,
+        serializers can stream the frames directly from the `FrameRecord` objects, see `loccer.outputs.file_stream.encode_line`
+        """
+        return {
             "loccer_type": "exception",
             "timestamp": self.ts.isoformat(),
             "exc_type": self.exc_type.__name__,
             "msg": str(self),
+            "fingerprint": self.fingerprint,
             "integrations": self.integrations_data,
-            "frames": []
         }
 
-        if self.traceback:
-            data["globals"] = {name: repr(value) for name, value in self.traceback.tb_frame.f_globals.items() if name not in ("__builtins__",)}
+    def json_globals(self) -> t.Optional[JSONType]:
+        """
+        Captured module globals, None if globals are not captured
+        """
+        if self.traceback and self.globals_capture != "none":
+            return self.capture_globals()
+        return None
 
-        for frame in self.stack:
-            data["frames"].append(frame_as_json(frame))
+    def capture_globals(self) -> JSONType:
+        """
+        Capture module globals of the frame from the traceback according to the `globals_capture` mode
 
-        return data
+        - `all` captures every global except the builtins
+        - `referenced` captures only the globals referenced by the code objects of the traceback frames from the same module,
+          modules, functions and classes are skipped
+        """
+        f_globals = self.traceback.tb_frame.f_globals
+
+        if self.globals_capture == "referenced":
+            code_objects = tuple(frame.f_code for frame, _ in walk_tb(self.traceback) if frame.f_globals is f_globals)
+            data = {}
+            for name in referenced_globals(code_objects):
+                try:
+                    value = f_globals[name]
+                except KeyError:
+                    continue
+
+                if not isinstance(value, SKIPPED_GLOBALS_TYPES):
+                    data[name] = self.repr_engine.repr(value)
+            return data
+
+        return {name: self.repr_engine.repr(value) for name, value in f_globals.items() if name not in ("__builtins__",)}
 
 
 class MetadataLog(LoccerOutput):
@@ -48,7 +400,12 @@ class MetadataLog(LoccerOutput):
         self.data = data
 
     def as_json(self) -> JSONType:
-        return {"loccer_type": "metadata_log", "data": self.data, "integrations": self.integrations_data}
+        return {
+            "loccer_type": "metadata_log",
+            "timestamp": self.ts.isoformat(),
+            "data": self.data,
+            "integrations": self.integrations_data
+        }
 
 
 class OutputBase(metaclass=ABCMeta):
@@ -56,12 +413,42 @@ class OutputBase(metaclass=ABCMeta):
     def output(self, exc: MetadataLog) -> None:
         ...
 
+    def flush(self) -> None:
+        """
+        Make sure all previously emitted logs are written out, no-op by default
+        """
+        pass
+
+    def close(self) -> None:
+        """
+        Release all resources held by the output handler, no-op by default
+        """
+        pass
+
+
+class AsyncOutputBase(metaclass=ABCMeta):
+    """
+    Base class for output handlers running inside the asyncio loop, see `loccer.outputs.asyncio_output.AsyncioDispatcher`
+    """
+    @abstractmethod
+    async def output(self, exc: LoccerOutput) -> None:
+        ...
+
+    async def flush(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
 
 class Integration(metaclass=ABCMeta):
     """
     Base class definition for creating loccer integrations
     """
     NAME: t.ClassVar[str]  #: Required class var, name of the integration, must be unique
+    #: Gather can run in a worker thread concurrently with the frame capture, see `concurrent_integrations` of `loccer.install`
+    #: Such integrations must not depend on thread-local state and the frames of the context might not be captured yet
+    THREAD_SAFE: t.ClassVar[bool] = False
 
     def activate(self, loccer_obj) -> None:
         pass
@@ -70,6 +457,7 @@ class Integration(metaclass=ABCMeta):
     def gather(self, context: LoccerOutput) -> JSONType:
         """
         Called when an exception occurred to gather additional data from the integration framework
+        Slow integrations should cooperatively check `context.budget` if it's set and return partial data once it's expired
 
         :return: Extra data that would be added to the exception context in loccer
         :rtype: JSONType
@@ -77,21 +465,80 @@ class Integration(metaclass=ABCMeta):
         ...
 
 
-def frame_as_json(frame: traceback.FrameSummary) -> JSONType:
+def referenced_globals(code_objects: t.Tuple[types.CodeType, ...]) -> t.Tuple[str, ...]:
+    """
+    Names referenced (via `co_names`) by the code objects, cached for the same set of code objects
+    Only the names are cached, values are resolved from the globals on each capture so the globals
+    bound or rebound later are still captured
+
+    :param code_objects: Code objects of the frames executed within the module
+    :return: Unique names in the order of their first reference
     """
-    Reformat traceback frame summary as a json serializable dict
+    with _REFERENCED_GLOBALS_LOCK:
+        try:
+            _REFERENCED_GLOBALS_CACHE.move_to_end(code_objects)
+            return _REFERENCED_GLOBALS_CACHE[code_objects]
+        except KeyError:
+            pass
+
+    names = tuple(dict.fromkeys(itertools.chain.from_iterable(code.co_names for code in code_objects)))
+    with _REFERENCED_GLOBALS_LOCK:
+        _REFERENCED_GLOBALS_CACHE[code_objects] = names
+        while len(_REFERENCED_GLOBALS_CACHE) > REFERENCED_GLOBALS_CACHE_SIZE:
+            _REFERENCED_GLOBALS_CACHE.popitem(last=False)
+
+    return names
+
+
+def validate_globals_capture(mode: str) -> None:
+    """
+    Check the globals capture mode upfront so a typo in the configuration is not raised on every captured exception
+    """
+    if mode not in GLOBALS_CAPTURE_MODES:
+        raise ValueError(f"Unknown globals capture mode `{mode}`, must be one of {', '.join(GLOBALS_CAPTURE_MODES)}")
+
+
+GLOBALS_CAPTURE_MODES = ("all", "referenced", "none")
+SKIPPED_GLOBALS_TYPES = (types.ModuleType, types.FunctionType, types.BuiltinFunctionType, type)
+REFERENCED_GLOBALS_CACHE_SIZE = 512
+_REFERENCED_GLOBALS_CACHE: "collections.OrderedDict[t.Tuple[types.CodeType, ...], t.Tuple[str, ...]]" = collections.OrderedDict()
+_REFERENCED_GLOBALS_LOCK = threading.Lock()
+
+
+def stack_summary(frames: t.Sequence[FrameRecord]) -> traceback.StackSummary:
+    """
+    Frame records as the `StackSummary` of the traceback module
+
+    Collapsed recursive frames are expanded by repeating the same `FrameSummary` object, so `StackSummary.format`
+    reports them as "[Previous line repeated N more times]" without allocating the repeated frames.
+    """
+    summaries = []
+    for frame in frames:
+        summary = frame.as_frame_summary()
+        if frame.repeated:
+            summaries.extend(itertools.repeat(summary, frame.repeated + 1))
+        else:
+            summaries.append(summary)
+
+    return traceback.StackSummary.from_list(summaries)
+
+
+def frame_as_json(frame: t.Union[FrameRecord, traceback.FrameSummary]) -> JSONType:
+    """
+    Reformat traceback frame as a json serializable dict
+
+    Kept for backwards compatibility, frames are captured as `FrameRecord` objects, see `FrameRecord.as_json`
 
-    :param frame: traceback frame summary
-    :type frame: traceback.FrameSummary
+    :param frame: Frame record or traceback frame summary
     :return: json serializable dict
-    :rtype: JSONType
     """
-    return {
-        "filename": frame.filename,
-        "lineno": frame.lineno,
-        "name": frame.name,
-        "line": frame.line,
-        "locals": frame.locals,
-        #"colno": frame.colno
-    }
+    if not isinstance(frame, FrameRecord):
+        frame = FrameRecord(
+            frame.filename,
+            frame.lineno,
+            frame.name,
+            line=frame.line,
+            locals=(tuple(frame.locals.items()) if frame.locals is not None else None)
+        )
 
+    return frame.as_json()
@@ -0,0 +1,131 @@
+import threading
+import time
+import typing as t
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised by `Budget.check` when the deadline has passed, integrations can let it propagate to abort the gather
+    """
+
+
+class Budget:
+    """
+    Cooperative deadline of the capture, available to integrations as `context.budget` during the `gather`
+
+    Integrations doing potentially slow work should check `expired()` (or call `check()`) between the steps
+    and return partial data once the budget is exhausted.
+    """
+    __slots__ = ("deadline", "timeout", "started")
+
+    def __init__(self, timeout: t.Optional[float], parent: t.Optional["Budget"] = None):
+        """
+        :param timeout: Time in seconds from now, None for no limit
+        :param parent: Enclosing budget, the deadline never exceeds the deadline of the parent
+        """
+        self.started = time.monotonic()
+        self.timeout = timeout
+        self.deadline = None if timeout is None else (self.started + timeout)
+
+        if parent is not None and parent.deadline is not None:
+            if self.deadline is None or parent.deadline < self.deadline:
+                self.deadline = parent.deadline
+
+    def remaining(self) -> t.Optional[float]:
+        """
+        Remaining time in seconds, None if the budget is unlimited
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def check(self) -> None:
+        if self.expired():
+            raise BudgetExceeded(f"Time budget exceeded after {self.elapsed():.3f}s")
+
+
+class CaptureBudget:
+    """
+    Per integration and total time limits of the exception capture
+
+    Integrations exceeding their budget have the timeout marker recorded in the `integrations_data`.
+    After `max_timeouts` consecutive timeouts the integration is disabled and skipped by further captures
+    until it's re-enabled via `enable`.
+    """
+
+    def __init__(
+        self,
+        integration_timeout: t.Optional[float] = 0.5,
+        total_timeout: t.Optional[float] = 2.0,
+        max_timeouts: t.Optional[int] = 3,
+        timeouts: t.Optional[t.Dict[str, float]] = None,
+    ):
+        """
+        :param integration_timeout: Default time budget in seconds of a single integration gather, None for no limit
+        :param total_timeout: Time budget in seconds of the whole capture including all integrations, None for no limit
+        :param max_timeouts: Number of consecutive timeouts after which the integration is disabled, None to never disable
+        :param timeouts: Time budgets overriding the default for specific integrations by their `NAME`
+        """
+        if max_timeouts is not None and max_timeouts < 1:
+            raise ValueError("Max timeouts must be 1 or greater number")
+
+        self.integration_timeout = integration_timeout
+        self.total_timeout = total_timeout
+        self.max_timeouts = max_timeouts
+        self.timeouts = dict(timeouts or {})
+
+        self._lock = threading.Lock()
+        self._strikes: t.Dict[str, int] = {}
+        self._disabled: t.Set[str] = set()
+
+    def start(self) -> Budget:
+        """
+        Budget of the whole capture
+        """
+        return Budget(self.total_timeout)
+
+    def for_integration(self, name: str, total: Budget) -> Budget:
+        return Budget(self.timeouts.get(name, self.integration_timeout), parent=total)
+
+    def is_disabled(self, name: str) -> bool:
+        return name in self._disabled
+
+    @property
+    def disabled(self) -> t.FrozenSet[str]:
+        return frozenset(self._disabled)
+
+    def record(self, name: str, timed_out: bool) -> bool:
+        """
+        Record the result of the integration gather
+
+        :return: True if the integration has been disabled by this timeout
+        """
+        with self._lock:
+            if not timed_out:
+                self._strikes.pop(name, None)
+                return False
+
+            strikes = self._strikes[name] = self._strikes.get(name, 0) + 1
+            if self.max_timeouts is not None and strikes >= self.max_timeouts and name not in self._disabled:
+                self._disabled.add(name)
+                return True
+
+        return False
+
+    def enable(self, name: t.Optional[str] = None) -> None:
+        """
+        Re-enable the disabled integration, all of them if name is not provided
+        """
+        with self._lock:
+            if name is None:
+                self._disabled.clear()
+                self._strikes.clear()
+            else:
+                self._disabled.discard(name)
+                self._strikes.pop(name, None)
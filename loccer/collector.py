@@ -0,0 +1,297 @@
+"""
+Local collector daemon owning the disk I/O of the whole host
+
+Worker processes send the logs via `loccer.outputs.socket_output.SocketOutput` over a Unix domain socket,
+the collector batches them and writes them into the rotated JSON lines files compatible with `JSONFileOutput`.
+
+Wire format is a stream of frames, each frame is a 4 byte big-endian length followed by a single JSON line.
+
+By default the socket is placed in the per-user runtime directory (`$XDG_RUNTIME_DIR`) or in a private
+directory with mode 0700 under the system temporary directory, so other local users can't hijack it.
+
+Usage:
+    python -m loccer collect errors.log --socket /run/loccer.sock
+"""
+import os
+import selectors
+import signal
+import socket
+import stat
+import struct
+import tempfile
+import threading
+import time
+import typing as t
+
+from .outputs.file_stream import rotate
+
+
+HEADER = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 2**24
+
+
+def _default_socket_path() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, "loccer.sock")
+
+    uid = os.getuid() if hasattr(os, "getuid") else os.getpid()
+    return os.path.join(tempfile.gettempdir(), f"loccer-{uid}", "loccer.sock")
+
+
+DEFAULT_SOCKET_PATH = _default_socket_path()
+
+
+def encode_frame(payload: bytes) -> bytes:
+    return HEADER.pack(len(payload)) + payload
+
+
+class Collector:
+    def __init__(
+        self,
+        filename: str,
+        socket_path: str = DEFAULT_SOCKET_PATH,
+        max_size: int = ((2**20)*10),
+        max_files: int = 10,
+        flush_interval: float = 0.5,
+        flush_bytes: int = 2**20,
+        socket_mode: int = 0o660,
+    ):
+        """
+        Collector receiving the logs over the Unix domain socket and writing them in batches
+
+        :param filename: Path to the log file
+        :param socket_path: Path of the Unix domain socket to listen on
+        :param max_size: Maximum log size before the file is rotated, set to 0 to disable file rotation
+        :param max_files: Maximum number of compressed log backups to keep when rotating files
+        :param flush_interval: Maximum time in seconds the received logs can stay in the batch before written
+        :param flush_bytes: Write the batch when it reaches this size in bytes
+        :param socket_mode: File permissions of the socket, controls which users can send logs
+        """
+        if max_size < 0:
+            raise ValueError("Max size must be 0 or greater number")
+
+        if flush_interval <= 0:
+            raise ValueError("Flush interval must be greater than 0")
+
+        self.filename = filename
+        self.socket_path = socket_path
+        self.max_size = max_size
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.socket_mode = socket_mode
+
+        self.received = 0  #: Number of received logs
+        self.bytes_written = 0  #: Size of the logs written into the file
+        self.ready = threading.Event()  #: Set when the collector is listening
+
+        self._batch: t.List[bytes] = []
+        self._batched = 0
+        self._buffers: t.Dict[socket.socket, bytearray] = {}
+        self._selector: t.Optional[selectors.BaseSelector] = None
+        self._server: t.Optional[socket.socket] = None
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._running = False
+
+    def serve_forever(self) -> None:
+        self._listen()
+        self._running = True
+        self.ready.set()
+        last_flush = time.monotonic()
+
+        try:
+            while self._running:
+                timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+                for key, _ in self._selector.select(timeout):
+                    if key.fileobj is self._server:
+                        self._accept()
+                    elif key.fileobj is self._wakeup_r:
+                        self._wakeup_r.recv(64)
+                    else:
+                        self._read(key.fileobj)
+
+                if self._batched >= self.flush_bytes or (time.monotonic() - last_flush) >= self.flush_interval:
+                    self.flush()
+                    last_flush = time.monotonic()
+        finally:
+            self._drain_clients()
+            self.flush()
+            self._cleanup()
+
+    def shutdown(self) -> None:
+        """
+        Stop the collector, remaining received logs are written before `serve_forever` returns
+        Can be called from another thread or a signal handler
+        """
+        self._running = False
+        try:
+            self._wakeup_w.send(b"\0")
+        except OSError:
+            pass
+
+    def flush(self) -> None:
+        if not self._batch:
+            return
+
+        data = b"".join(self._batch)
+        self._batch.clear()
+        self._batched = 0
+
+        with open(self.filename, "ab") as fd:
+            fd.write(data)
+            size = fd.tell()
+
+        self.bytes_written += len(data)
+        if self.max_size and size >= self.max_size:
+            rotate(self.filename, self.max_size, self.max_files, background=True)
+
+    def _listen(self) -> None:
+        if self.socket_path == DEFAULT_SOCKET_PATH:
+            _ensure_private_dir(os.path.dirname(self.socket_path))
+
+        try:
+            st = os.lstat(self.socket_path)
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(st.st_mode):
+                raise RuntimeError(f"`{self.socket_path}` exists and is not a socket")
+
+            # Stale socket left by a collector that did not exit cleanly
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.socket_path)
+            else:
+                raise RuntimeError(f"Another collector is already listening on `{self.socket_path}`")
+            finally:
+                probe.close()
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Socket is created owner-only and opened up to `socket_mode` only after it's fully set up
+        old_umask = os.umask(0o177)
+        try:
+            self._server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.socket_path, self.socket_mode)
+        self._server.listen(128)
+        self._server.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._server, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+
+    def _accept(self) -> None:
+        try:
+            conn, _ = self._server.accept()
+        except BlockingIOError:
+            return
+
+        conn.setblocking(False)
+        self._buffers[conn] = bytearray()
+        self._selector.register(conn, selectors.EVENT_READ)
+
+    def _read(self, conn: socket.socket) -> None:
+        try:
+            data = conn.recv(2**16)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        if not data:
+            self._disconnect(conn)
+            return
+
+        buf = self._buffers[conn]
+        buf += data
+
+        pos = 0
+        while len(buf) - pos >= HEADER.size:
+            (length,) = HEADER.unpack_from(buf, pos)
+            if length > MAX_MESSAGE_SIZE:
+                # Corrupted stream, there is no way to find the next frame boundary
+                self._disconnect(conn)
+                return
+
+            end = pos + HEADER.size + length
+            if len(buf) < end:
+                break
+
+            payload = bytes(buf[pos + HEADER.size:end])
+            if not payload.endswith(b"\n"):
+                payload += b"\n"
+            self._batch.append(payload)
+            self._batched += len(payload)
+            self.received += 1
+            pos = end
+
+        del buf[:pos]
+
+    def _drain_clients(self) -> None:
+        # Read whatever the connected clients already sent before shutting down
+        for conn in list(self._buffers):
+            while conn in self._buffers:
+                try:
+                    if not conn.recv(1, socket.MSG_PEEK):
+                        self._disconnect(conn)
+                        break
+                except BlockingIOError:
+                    break
+                except OSError:
+                    self._disconnect(conn)
+                    break
+                self._read(conn)
+
+    def _disconnect(self, conn: socket.socket) -> None:
+        self._selector.unregister(conn)
+        self._buffers.pop(conn, None)
+        conn.close()
+
+    def _cleanup(self) -> None:
+        for conn in list(self._buffers):
+            self._disconnect(conn)
+
+        if self._selector is not None:
+            self._selector.close()
+
+        if self._server is not None:
+            self._server.close()
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+
+def _ensure_private_dir(path: str) -> None:
+    """
+    Create the directory of the default socket with mode 0700 or verify that an existing one is private
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise RuntimeError(f"Socket directory `{path}` is not a directory")
+
+    if hasattr(os, "getuid") and path != os.environ.get("XDG_RUNTIME_DIR"):
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise RuntimeError(f"Socket directory `{path}` must be owned by the current user with mode 0700")
+
+
+def run(collector: Collector) -> None:
+    """
+    Run the collector in the foreground until SIGINT or SIGTERM is received
+    """
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: collector.shutdown())
+
+    collector.serve_forever()
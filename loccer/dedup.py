@@ -0,0 +1,107 @@
+import datetime
+import threading
+import time
+import typing as t
+
+from .ltypes import JSONType
+
+
+class _Occurrence:
+    __slots__ = ("exc_type", "window_start", "first_seen", "last_seen", "suppressed")
+
+    def __init__(self, exc_type: str, window_start: float):
+        self.exc_type = exc_type
+        self.window_start = window_start
+        self.first_seen = datetime.datetime.utcnow()
+        self.last_seen = self.first_seen
+        self.suppressed = 0
+
+
+class Deduplicator:
+    """
+    Deduplication of repeated exceptions based on their fingerprint
+
+    The first occurrence of a fingerprint is emitted in full, any further occurrence within the window
+    is only counted. Number of suppressed duplicates is reported as a metadata log once the window expires,
+    summaries are collected with the next captured exception, on `Loccer.flush()` and at the interpreter exit.
+    """
+
+    def __init__(self, window: float = 60.0, max_fingerprints: int = 10000, sweep_interval: float = 1.0):
+        """
+        :param window: Time in seconds during which the duplicates of the same fingerprint are suppressed
+        :param max_fingerprints: Maximum number of tracked fingerprints, oldest windows are closed early when reached
+        :param sweep_interval: Minimum time in seconds between the checks for expired windows
+        """
+        if window <= 0:
+            raise ValueError("Window must be greater than 0")
+
+        if max_fingerprints < 1:
+            raise ValueError("Max fingerprints must be 1 or greater number")
+
+        self.window = window
+        self.max_fingerprints = max_fingerprints
+        self.sweep_interval = sweep_interval
+
+        self._occurrences: t.Dict[str, _Occurrence] = {}
+        self._summaries: t.List[JSONType] = []
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+
+    def register(self, fingerprint: str, exc_type: str) -> bool:
+        """
+        Register the occurrence of the exception
+
+        :param fingerprint: Fingerprint of the exception
+        :param exc_type: Name of the exception type, used in the summary
+        :return: True if the exception should be emitted in full, False if it's a suppressed duplicate
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            occurrence = self._occurrences.get(fingerprint)
+            if occurrence is not None and (now - occurrence.window_start) < self.window:
+                occurrence.suppressed += 1
+                occurrence.last_seen = datetime.datetime.utcnow()
+                return False
+
+            if occurrence is not None:
+                self._close(fingerprint)
+            elif len(self._occurrences) >= self.max_fingerprints:
+                self._close(next(iter(self._occurrences)))
+
+            self._occurrences[fingerprint] = _Occurrence(exc_type, now)
+            return True
+
+    def pop_summaries(self, force: bool = False) -> t.List[JSONType]:
+        """
+        Close the expired windows and return the summaries of suppressed duplicates that should be logged
+
+        :param force: Close all windows regardless of their expiration, for example when flushing at exit
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if force or (now - self._last_sweep) >= self.sweep_interval:
+                self._last_sweep = now
+                expired = [
+                    fingerprint for fingerprint, occurrence in self._occurrences.items()
+                    if force or (now - occurrence.window_start) >= self.window
+                ]
+                for fingerprint in expired:
+                    self._close(fingerprint)
+
+            summaries, self._summaries = self._summaries, []
+
+        return summaries
+
+    def _close(self, fingerprint: str) -> None:
+        occurrence = self._occurrences.pop(fingerprint)
+        if occurrence.suppressed:
+            self._summaries.append({
+                "msg": "Duplicate exceptions suppressed",
+                "fingerprint": fingerprint,
+                "exc_type": occurrence.exc_type,
+                "suppressed": occurrence.suppressed,
+                "first_seen": occurrence.first_seen.isoformat(),
+                "last_seen": occurrence.last_seen.isoformat(),
+            })
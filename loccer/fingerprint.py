@@ -0,0 +1,32 @@
+import hashlib
+from traceback import walk_tb
+
+from .ltypes import T_exc_type, T_exc_tb
+
+
+def compute_fingerprint(exc_type: T_exc_type, exc_tb: T_exc_tb) -> str:
+    """
+    Compute a fingerprint identifying the same error occurring repeatedly
+
+    Fingerprint is computed from the exception type and the normalized stack (filename, function name and line number)
+    directly from the traceback, without constructing `TracebackException` or touching the frame locals.
+    Consecutive identical frames are collapsed so that recursion depth does not change the fingerprint.
+
+    :param exc_type: Type of the exception
+    :param exc_tb: Traceback of the exception
+    :return: hex digest of the fingerprint
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{exc_type.__module__}.{exc_type.__qualname__}".encode())
+
+    previous = None
+    for frame, lineno in walk_tb(exc_tb):
+        code = frame.f_code
+        current = (code.co_filename, code.co_name, lineno)
+        if current == previous:
+            continue
+
+        previous = current
+        h.update(f"\0{code.co_filename}\0{code.co_name}\0{lineno}".encode(errors="replace"))
+
+    return h.hexdigest()
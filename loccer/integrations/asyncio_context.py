@@ -1,15 +1,30 @@
 import asyncio
+import collections
 import contextvars
+import copy
+import itertools
 import sys
+import time
+import typing as t
+import weakref
 
 from .. import get_hybrid_context
 from ..bases import Integration, LoccerOutput, JSONType
+from ..budget import Budget
+from ..safe_repr import safe_repr
 from ..utils import quick_format
 
 
 class AsyncioContextIntegration(Integration):
     """
     Integration with the asyncio context
+
+    Task dump is bounded so its cost stays low on loops with many tasks: only `max_tasks` tasks are dumped
+    individually and all the tasks are summarized in `coro_groups` by the coroutine name with counts.
+    With `current_task_only` the dump contains only the failing task and the tasks awaiting it,
+    the cost then doesn't grow with the number of tasks in the loop.
+    Otherwise the dump is reused for the events captured within `snapshot_interval` seconds,
+    so a burst of errors walks the tasks of the loop only once.
     """
     NAME = "asyncio"
 
@@ -18,10 +33,35 @@ class AsyncioContextIntegration(Integration):
     def __init__(
             self,
             dump_coros: bool = True,
-            dump_context: bool = True
+            dump_context: bool = True,
+            *,
+            max_tasks: t.Optional[int] = 100,
+            group_coros: bool = True,
+            top_stacks: int = 0,
+            stack_limit: int = 10,
+            current_task_only: bool = False,
+            snapshot_interval: float = 1.0
     ):
+        """
+        :param dump_coros: Include the tasks running in the loop
+        :param dump_context: Include the context variables
+        :param max_tasks: Maximum number of individually dumped tasks, None for no limit
+        :param group_coros: Include the number of tasks for each coroutine name
+        :param top_stacks: Include the stack of one task for this number of the most common coroutines
+        :param stack_limit: Maximum number of frames of the included task stacks
+        :param current_task_only: Dump only the current task and the tasks awaiting it (with their stacks)
+        :param snapshot_interval: Reuse the task dump of the loop for this number of seconds, 0 to dump the tasks for every event
+        """
         self._dump_coros = dump_coros
         self._dump_ctx = dump_context
+        self.max_tasks = max_tasks
+        self.group_coros = group_coros
+        self.top_stacks = top_stacks
+        self.stack_limit = stack_limit
+        self.current_task_only = current_task_only
+        self.snapshot_interval = snapshot_interval
+
+        self._tasks_snapshot: t.Optional[t.Tuple["weakref.ref[asyncio.AbstractEventLoop]", float, JSONType]] = None
 
     def gather(self, context: LoccerOutput) -> JSONType:
         data: JSONType = {}
@@ -31,8 +71,13 @@ class AsyncioContextIntegration(Integration):
         except RuntimeError:
             return data
 
-        if self._dump_coros:
-            data["coros"] = self.dump_coros(loop)
+        budget = context.budget if context is not None else None
+        if self._dump_coros and self.current_task_only:
+            data["coros"] = self.dump_task_graph(
+                self.current_task(loop), max_tasks=self.max_tasks, stack_limit=self.stack_limit, budget=budget
+            )
+        elif self._dump_coros:
+            data.update(self.tasks_snapshot(loop, budget=budget))
 
         if self._dump_ctx:
             try:
@@ -47,6 +92,29 @@ class AsyncioContextIntegration(Integration):
 
         return data
 
+    def tasks_snapshot(self, loop: asyncio.AbstractEventLoop, budget: Budget|None=None) -> JSONType:
+        """
+        Bounded dump of the tasks in the loop with their groups, reused within the `snapshot_interval`
+        """
+        now = time.monotonic()
+        cached = self._tasks_snapshot
+        if cached is not None and cached[0]() is loop and (now - cached[1]) < self.snapshot_interval:
+            # Every event gets its own copy, the outputs must not share the nested dicts
+            data = copy.deepcopy(cached[2])
+            data["tasks_snapshot_age"] = now - cached[1]
+            return data
+
+        tasks = asyncio.all_tasks(loop)
+        data = {"coros": self.dump_coros(loop, budget=budget, max_tasks=self.max_tasks, tasks=tasks)}
+        if self.group_coros:
+            data["coro_groups"] = self.group_tasks(
+                tasks, top_stacks=self.top_stacks, stack_limit=self.stack_limit, budget=budget
+            )
+
+        if self.snapshot_interval > 0:
+            self._tasks_snapshot = (weakref.ref(loop), now, copy.deepcopy(data))
+        return data
+
     def loop_exception_handler(self, loop: asyncio.AbstractEventLoop, context: contextvars.Context) -> None:
         ctx = contextvars.copy_context()
         ctx.run(self._loop_exception_handler, loop, context)
@@ -70,24 +138,195 @@ class AsyncioContextIntegration(Integration):
     @staticmethod
     def dump_contextvars(ctx: contextvars.Context) -> JSONType:
         return {
-            quick_format(name): repr(value) for (name, value) in ctx.items()
+            quick_format(name): safe_repr(value) for (name, value) in ctx.items()
         }
 
+    def current_task(self, loop: asyncio.AbstractEventLoop) -> t.Optional[asyncio.Future]:
+        """
+        Task running in the loop, or the task/future reported to the loop exception handler
+        """
+        task = asyncio.current_task(loop)
+        if task is None:
+            ctx = self._loop_ctx.get()
+            if ctx is not None:
+                task = ctx.get("task") or ctx.get("future")
+
+        return task
+
     @staticmethod
-    def dump_coros(loop: asyncio.AbstractEventLoop|None=None) -> JSONType:
+    def dump_coros(
+            loop: asyncio.AbstractEventLoop|None=None,
+            budget: Budget|None=None,
+            max_tasks: int|None=None,
+            tasks: t.Collection[asyncio.Task]|None=None
+    ) -> JSONType:
         data = {}
 
-        if loop is None:
-            try:
-                loop = asyncio.get_running_loop()
-            except RuntimeError:
-                return data
+        if tasks is None:
+            if loop is None:
+                try:
+                    loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    return data
+
+            tasks = asyncio.all_tasks(loop)
+
+        for idx, task in enumerate(tasks):
+            if max_tasks is not None and idx >= max_tasks:
+                data["..."] = f"truncated after {max_tasks} tasks, {len(tasks) - idx} more tasks"
+                break
+            elif budget is not None and budget.expired():
+                data["..."] = f"truncated after exceeding the time budget, {len(tasks) - idx} more tasks"
+                break
 
-        for task in asyncio.all_tasks(loop):
-            name = task.get_name()
-            data[name] = {
-                "coro": repr(task.get_coro()),
-                "is_done": task.done()
-            }
+            data[task.get_name()] = dump_task(task)
 
         return data
+
+    @staticmethod
+    def group_tasks(
+            tasks: t.Collection[asyncio.Task],
+            top_stacks: int = 0,
+            stack_limit: int = 10,
+            budget: Budget|None=None
+    ) -> JSONType:
+        """
+        Number of tasks for each coroutine name, most common first
+
+        :param tasks: Tasks to group
+        :param top_stacks: Include the stack of one task for this number of the most common coroutines
+        :param stack_limit: Maximum number of frames of the included stacks
+        :param budget: Time budget of the capture, remaining tasks are counted as `...` and stacks are skipped when exceeded
+        """
+        counts: t.Counter[str] = collections.Counter()
+        # One task of each coroutine is kept while counting as the stack sample, the tasks are not walked again
+        samples: t.Dict[str, asyncio.Task] = {}
+        iterator = iter(tasks)
+        grouped = 0
+        while grouped < len(tasks):
+            # Tasks are grouped in chunks, checking the clock for every task would cost more than grouping it
+            if budget is not None and budget.expired():
+                counts["..."] += len(tasks) - grouped
+                break
+
+            chunk = list(itertools.islice(iterator, 1000))
+            if not chunk:
+                break
+
+            names = list(map(coro_name, chunk))
+            counts.update(names)
+            if top_stacks:
+                for name, task in dict(zip(names, chunk)).items():
+                    samples.setdefault(name, task)
+            grouped += len(chunk)
+
+        data = {name: {"count": count} for name, count in counts.most_common()}
+
+        for name in itertools.islice(data, top_stacks):
+            if budget is not None and budget.expired():
+                break
+            elif name in samples:
+                data[name]["stack"] = dump_stack(samples[name], stack_limit)
+
+        return data
+
+    @staticmethod
+    def dump_task_graph(
+            task: asyncio.Future|None,
+            max_tasks: int|None=None,
+            stack_limit: int = 10,
+            budget: Budget|None=None
+    ) -> JSONType:
+        """
+        Dump the task together with the tasks awaiting it (transitively), with their stacks
+
+        Uses `asyncio.capture_call_graph` when available (Python 3.14+), otherwise the awaiting tasks
+        are found among the done callbacks of the awaited futures.
+        """
+        data = {}
+        if task is None:
+            return data
+
+        queue = collections.deque([task])
+        seen = {id(task)}
+        while queue:
+            if max_tasks is not None and len(data) >= max_tasks:
+                data["..."] = f"truncated after {max_tasks} tasks"
+                break
+            elif budget is not None and budget.expired():
+                data["..."] = "truncated after exceeding the time budget"
+                break
+
+            current = queue.popleft()
+            awaiters = [x for x in awaited_by(current) if id(x) not in seen]
+            seen.update(id(x) for x in awaiters)
+            queue.extend(awaiters)
+
+            if isinstance(current, asyncio.Task):
+                entry = dump_task(current)
+                entry["stack"] = dump_stack(current, stack_limit)
+                name = current.get_name()
+            else:
+                entry = {"coro": safe_repr(current), "is_done": current.done()}
+                name = f"future-{id(current):x}"
+
+            entry["awaited_by"] = [x.get_name() if isinstance(x, asyncio.Task) else f"future-{id(x):x}" for x in awaiters]
+            data[name] = entry
+
+        return data
+
+
+def dump_task(task: asyncio.Task) -> JSONType:
+    return {
+        "coro": safe_repr(task.get_coro()),
+        "is_done": task.done()
+    }
+
+
+def coro_name(task: asyncio.Task) -> str:
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", None) or type(coro).__qualname__
+
+
+def dump_stack(task: asyncio.Task, limit: int) -> t.List[JSONType]:
+    try:
+        frames = task.get_stack(limit=limit)
+    except Exception:
+        return []
+
+    return [
+        {"filename": frame.f_code.co_filename, "lineno": frame.f_lineno, "name": frame.f_code.co_name}
+        for frame in frames
+    ]
+
+
+def awaited_by(future: asyncio.Future) -> t.List[asyncio.Future]:
+    """
+    Futures directly awaiting the given future
+    """
+    if hasattr(asyncio, "capture_call_graph"):
+        graph = asyncio.capture_call_graph(future, depth=0)
+        if graph is not None:
+            return [x.future for x in graph.awaited_by]
+        return []
+
+    # Awaiting task registers its wakeup method as a done callback of the awaited future
+    result = []
+    for callback in (getattr(future, "_callbacks", None) or ()):
+        if isinstance(callback, tuple):
+            callback = callback[0]
+        owner = getattr(callback, "__self__", None)
+        if isinstance(owner, asyncio.Future):
+            result.append(owner)
+            continue
+
+        # `asyncio.gather` and `asyncio.shield` register closures referencing their outer future
+        for cell in (getattr(callback, "__closure__", None) or ()):
+            try:
+                value = cell.cell_contents
+            except ValueError:
+                continue
+            if isinstance(value, asyncio.Future) and value is not future:
+                result.append(value)
+
+    return result
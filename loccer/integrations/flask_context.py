@@ -1,3 +1,5 @@
+import io
+import typing as t
 import warnings
 
 import flask
@@ -5,11 +7,18 @@ from werkzeug.exceptions import HTTPException
 
 from .. import get_hybrid_context
 from ..bases import Integration, LoccerOutput, JSONType
+from .request_capture import (
+    DEFAULT_MAX_BODY_SIZE, DEFAULT_MAX_FORM_FIELDS, DEFAULT_MAX_VALUE_LENGTH, FORM_MIMETYPES, bounded_items,
+    body_payload, files_metadata, parsed_json, truncate
+)
 
 
 class FlaskContextIntegration(Integration):
     """
     Flask integration for loccer
+
+    Form data, files and JSON are included only if the application has already parsed them (they are None otherwise),
+    the body is captured from the data cached by `request.get_data` or from a bounded prefix peeked from the stream.
     """
     NAME = "flask"
 
@@ -17,62 +26,104 @@ class FlaskContextIntegration(Integration):
         self, *,
         capture_4xx: bool=False,
         capture_5xx: bool=True,
-        capture_body: bool=False
+        capture_body: bool=False,
+        max_body_size: int=DEFAULT_MAX_BODY_SIZE,
+        header_allowlist: t.Optional[t.Sequence[str]]=None,
+        cookie_allowlist: t.Optional[t.Sequence[str]]=None,
+        max_form_fields: int=DEFAULT_MAX_FORM_FIELDS,
+        max_value_length: int=DEFAULT_MAX_VALUE_LENGTH
     ):
+        """
+        :param capture_4xx: Log metadata for responses with 4xx status code
+        :param capture_5xx: Log metadata for responses with 5xx status code
+        :param capture_body: Include the request body
+        :param max_body_size: Maximum number of bytes of the request body to read and include
+        :param header_allowlist: Include only headers matching one of the case-insensitive fnmatch patterns, None to include all
+        :param cookie_allowlist: Include only cookies matching one of the case-insensitive fnmatch patterns, None to include all
+        :param max_form_fields: Maximum number of included form fields and files
+        :param max_value_length: Maximum length of the included header, cookie and form values
+        """
         self.capture_4xx = capture_4xx
         self.capture_5xx = capture_5xx
         self.capture_body = capture_body
+        self.max_body_size = max_body_size
+        self.header_allowlist = header_allowlist
+        self.cookie_allowlist = cookie_allowlist
+        self.max_form_fields = max_form_fields
+        self.max_value_length = max_value_length
 
     def gather(self, context: LoccerOutput) -> JSONType:
         data: JSONType = {}
         if flask.request:
+            request = flask.request._get_current_object()
+            headers, _ = bounded_items(request.headers.items(), self.header_allowlist, max_length=self.max_value_length)
             data.update({
                 "flask_context": True,
                 "flask_version": flask.__version__,
-                "endpoint": (flask.request.endpoint or "<unknown>"),
-                "client_ip": flask.request.remote_addr,
-                "url": flask.request.path,
-                "method": flask.request.method,
-                "headers": dict(flask.request.headers),
-                "user_agent": flask.request.headers.get("User-Agent", "<unknown>"),
-                "is_json": flask.request.is_json,
-                "form": dict(flask.request.form),
-                "content_length": flask.request.content_length,
-                "content_type": flask.request.content_type,
-                "files": {}
+                "endpoint": (request.endpoint or "<unknown>"),
+                "client_ip": request.remote_addr,
+                "url": truncate(request.path, self.max_value_length),
+                "method": request.method,
+                "headers": headers,
+                "user_agent": truncate(request.headers.get("User-Agent", "<unknown>"), self.max_value_length),
+                "is_json": request.is_json,
+                "form": None,
+                "content_length": request.content_length,
+                "content_type": request.content_type,
+                "files": None
             })
 
-            for fname, f in flask.request.files.items():
-                fdata = {
-                    "filename": f.filename,
-                    "form_name": f.name,
-                    "content_type": f.content_type,
-                    "content_length": f.content_length,
-                    "headers": dict(f.headers)
-                }
-                data["files"][fname] = fdata
-
-            data["cookies"] = {
-                k: v[0] if isinstance(v, list) and len(v) == 1 else v
-                for k, v in flask.request.cookies.items()
-            }
-
-            if self.capture_body:
-                if flask.request.is_json:
-                    data["json_payload"] = flask.request.get_json(silent=False)
-                else:
-                    data["json_payload"] = None
-
-                if not data["json_payload"]:
-                    try:
-                        data["raw_payload"] = flask.request.get_data(as_text=True)
-                    except Exception:
-                        data["raw_payload"] = "Loccer N/A; error getting raw request data"
+            # Accessing `request.form` or `request.files` would parse the whole body, use them only if already parsed
+            if "form" in request.__dict__:
+                data["form"], omitted = bounded_items(
+                    request.form.items(), max_items=self.max_form_fields, max_length=self.max_value_length
+                )
+                if omitted:
+                    data["form_omitted"] = omitted
+
+            if "files" in request.__dict__:
+                data["files"] = files_metadata(request.files.items(), self.max_form_fields, self.max_value_length)
+
+            data["cookies"], _ = bounded_items(
+                ((k, v[0] if isinstance(v, list) and len(v) == 1 else v) for k, v in request.cookies.items()),
+                self.cookie_allowlist,
+                max_length=self.max_value_length
+            )
+
+            if self.capture_body and context.budget is not None and context.budget.expired():
+                # Reading the body might block on a slow client, don't start it once the time budget is exhausted
+                data["raw_payload"] = "Loccer N/A; time budget exhausted before reading the request data"
+            elif self.capture_body:
+                try:
+                    data.update(self.capture_body_payload(request))
+                except Exception:
+                    data["raw_payload"] = "Loccer N/A; error getting raw request data"
 
         else:
             data["flask_context"] = False
         return data
 
+    def capture_body_payload(self, request: flask.Request) -> JSONType:
+        """
+        Capture at most `max_body_size` bytes of the request body without consuming it for the application
+        """
+        cached = getattr(request, "_cached_data", None)
+        if cached is not None:
+            return body_payload(cached, self.max_body_size, parsed_json(request))
+
+        if "form" in request.__dict__ and request.mimetype in FORM_MIMETYPES:
+            # Stream has been consumed by the form parser, the parsed fields are captured instead
+            return {"json_payload": None, "raw_payload": None, "body_truncated": False}
+
+        if self.max_body_size <= 0:
+            return {"json_payload": None, "raw_payload": None, "body_truncated": bool(request.content_length)}
+
+        stream = request.stream
+        prefix = stream.read(self.max_body_size + 1)
+        # Put the peeked data back so the body is still readable by the application (e.g. error handlers)
+        request.__dict__["stream"] = ReplayStream(prefix, stream)
+        return body_payload(prefix, self.max_body_size, parsed_json(request))
+
     def init_app(self, flask_app: flask.Flask) -> None:
         if not flask.signals_available:
             warnings.warn("Signals in Flask are not available (`blinker` is probably not installed)")
@@ -100,3 +151,25 @@ class FlaskContextIntegration(Integration):
     def handle_flask_exception(self, sender, exception: Exception):
         get_hybrid_context().from_exception(exception)
 
+
+class ReplayStream(io.RawIOBase):
+    """
+    Read-only stream returning the already read prefix followed by the rest of the original stream
+    """
+    def __init__(self, prefix: bytes, stream: t.IO[bytes]):
+        self._prefix = memoryview(prefix)
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+
+        chunk = self._stream.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
@@ -1,5 +1,11 @@
+import fnmatch
+import hashlib
+import json
 import os
 import platform
+import threading
+import time
+import weakref
 from getpass import getuser
 import typing as t
 
@@ -7,23 +13,171 @@ from ..bases import Integration, LoccerOutput
 
 
 class PlatformIntegration(Integration):
+    """
+    Integration gathering information about the platform, python interpreter and environment variables
+
+    Static part of the data is computed only once per process as a snapshot (invalidated after `fork`),
+    only the environment variables are gathered for every event.
+    Environment variables of the snapshot are copied from the environment once when the snapshot is computed
+    and shared by the events as is, outputs must not modify them.
+    """
     NAME = "platform"
+    THREAD_SAFE = True
+
+    def __init__(
+        self, *,
+        env_allowlist: t.Optional[t.Sequence[str]] = None,
+        env_denylist: t.Sequence[str] = (),
+        env_changes_only: bool = False,
+        reference_snapshot: bool = False,
+        snapshot_interval: float = 300.0
+    ):
+        """
+        :param env_allowlist: Capture only environment variables matching one of the fnmatch patterns, None to capture all
+        :param env_denylist: Never capture environment variables matching one of the fnmatch patterns
+        :param env_changes_only: Record only changes of environment variables compared to the snapshot
+        :param reference_snapshot: Include the full snapshot only in the first event, further events reference it by `snapshot_hash`
+        :param snapshot_interval: With `reference_snapshot`; include the full snapshot again once this many seconds passed
+            since it was last included, so the hash can be resolved after the first event has been rotated or dropped
+        """
+        self.env_allowlist = env_allowlist
+        self.env_denylist = env_denylist
+        self.env_changes_only = env_changes_only
+        self.reference_snapshot = reference_snapshot
+        self.snapshot_interval = snapshot_interval
+
+        self._snapshot: t.Optional[t.Dict[str, t.Any]] = None
+        self._snapshot_hash: t.Optional[str] = None
+        self._snapshot_emitted_at: t.Optional[float] = None
+        self._env_filter_cache: t.Dict[str, bool] = {}
+        # Gather can run concurrently on the integrations thread pool
+        self._lock = threading.Lock()
+        _INSTANCES.add(self)
 
     def gather(self, context: LoccerOutput) -> t.Dict[str, t.Any]:
-        uname = platform.uname()
-
-        data = {
-            "username": getuser(),
-            "hostname": platform.node(),
-            "uname": uname._asdict(),
-            "python": {
-                "compiler": platform.python_compiler(),
-                "branch": platform.python_branch(),
-                "implementation": platform.python_implementation(),
-                "revision": platform.python_revision(),
-                "version": platform.python_version()
-            },
-            "environment_variables": dict(os.environ)
-        }
+        snapshot = self.snapshot()
+        env = self.environment_variables()
+
+        if self.reference_snapshot:
+            data = {"snapshot_hash": self._snapshot_hash}
+            if self._should_emit_snapshot():
+                data["snapshot"] = _copy_snapshot(snapshot)
+        else:
+            data = _copy_snapshot(snapshot)
+
+        if self.env_changes_only:
+            data["environment_changes"] = self.environment_changes(snapshot["environment_variables"], env)
+        elif self.reference_snapshot:
+            if env != snapshot["environment_variables"]:
+                data["environment_variables"] = env
+        else:
+            data["environment_variables"] = env
 
         return data
+
+    def snapshot(self) -> t.Dict[str, t.Any]:
+        """
+        Static platform data computed once per process
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+
+            uname = platform.uname()
+
+            snapshot = {
+                "username": getuser(),
+                "hostname": platform.node(),
+                "uname": uname._asdict(),
+                "python": {
+                    "compiler": platform.python_compiler(),
+                    "branch": platform.python_branch(),
+                    "implementation": platform.python_implementation(),
+                    "revision": platform.python_revision(),
+                    "version": platform.python_version()
+                },
+                "pid": os.getpid(),
+                "environment_variables": self.environment_variables()
+            }
+            self._snapshot_hash = hashlib.sha1(
+                json.dumps(snapshot, sort_keys=True, default=repr).encode()
+            ).hexdigest()
+            self._snapshot_emitted_at = None
+            self._snapshot = snapshot
+
+        return snapshot
+
+    def invalidate(self) -> None:
+        """
+        Drop the snapshot so it's computed again on the next event
+        """
+        self._snapshot = None
+        self._snapshot_hash = None
+        self._snapshot_emitted_at = None
+
+    def _should_emit_snapshot(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._snapshot_emitted_at is None or (now - self._snapshot_emitted_at) >= self.snapshot_interval:
+                self._snapshot_emitted_at = now
+                return True
+        return False
+
+    def environment_variables(self) -> t.Dict[str, str]:
+        if self.env_allowlist is None and not self.env_denylist:
+            return dict(os.environ)
+
+        return {key: value for key, value in os.environ.items() if self._env_allowed(key)}
+
+    @staticmethod
+    def environment_changes(previous: t.Dict[str, str], current: t.Dict[str, str]) -> t.Dict[str, t.Optional[str]]:
+        """
+        Difference between two sets of environment variables, removed variables have a None value
+        """
+        changes: t.Dict[str, t.Optional[str]] = {
+            key: value for key, value in current.items() if previous.get(key) != value
+        }
+        for key in previous.keys() - current.keys():
+            changes[key] = None
+
+        return changes
+
+    def _env_allowed(self, key: str) -> bool:
+        try:
+            return self._env_filter_cache[key]
+        except KeyError:
+            pass
+
+        allowed = (
+            (self.env_allowlist is None or any(fnmatch.fnmatchcase(key, x) for x in self.env_allowlist))
+            and not any(fnmatch.fnmatchcase(key, x) for x in self.env_denylist)
+        )
+        self._env_filter_cache[key] = allowed
+        return allowed
+
+
+def _copy_snapshot(snapshot: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    # Snapshot is shared between the events, its small nested dicts (all flat) must not be shared with the outputs.
+    # Environment variables are already a copy made when the snapshot was computed, they are not copied again
+    return {
+        key: (dict(value) if isinstance(value, dict) and key != "environment_variables" else value)
+        for key, value in snapshot.items()
+    }
+
+
+_INSTANCES: "weakref.WeakSet[PlatformIntegration]" = weakref.WeakSet()
+
+
+def _invalidate_snapshots() -> None:
+    for x in _INSTANCES:
+        # Lock might have been held by another thread of the parent process during the fork
+        x._lock = threading.Lock()
+        x.invalidate()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_invalidate_snapshots)
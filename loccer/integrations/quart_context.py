@@ -1,16 +1,36 @@
+import asyncio
+import contextvars
 import functools
 import sys
+import typing as t
 import warnings
 
 import quart
 
 from .. import get_hybrid_context
 from ..bases import Integration, LoccerOutput, JSONType
+from .request_capture import (
+    DEFAULT_MAX_BODY_SIZE, DEFAULT_MAX_FORM_FIELDS, DEFAULT_MAX_VALUE_LENGTH, FORM_MIMETYPES, bounded_items,
+    body_payload, files_metadata, parsed_json, truncate
+)
+
+# (request, captured data) taken in the async hooks before the synchronous `gather` runs
+_REQUEST_SNAPSHOT: "contextvars.ContextVar[t.Optional[t.Tuple[t.Any, JSONType]]]" = contextvars.ContextVar(
+    "loccer_quart_request_snapshot", default=None
+)
 
 
 class QuartContextIntegration(Integration):
     """
     Quart integration for loccer
+
+    Request body and form are coroutines in Quart which can't be awaited from the synchronous `gather`.
+    They are snapshotted in the async `got_request_exception`/`request_finished` signal handlers instead,
+    the snapshot uses only the data Quart has already received or parsed and waits at most `body_wait`
+    seconds for the rest of the body.
+
+    Received body and parsed form are read from the Quart internals (`Body._data`, `Body._complete`,
+    `Request._form`, `Request._files`), any of them missing in other Quart versions is treated as not available.
     """
     NAME = "quart"
 
@@ -18,46 +38,158 @@ class QuartContextIntegration(Integration):
         self, *,
         capture_4xx: bool=False,
         capture_5xx: bool=True,
-        capture_body: bool=False
+        capture_body: bool=False,
+        max_body_size: int=DEFAULT_MAX_BODY_SIZE,
+        header_allowlist: t.Optional[t.Sequence[str]]=None,
+        cookie_allowlist: t.Optional[t.Sequence[str]]=None,
+        max_form_fields: int=DEFAULT_MAX_FORM_FIELDS,
+        max_value_length: int=DEFAULT_MAX_VALUE_LENGTH,
+        body_wait: float=0.5
     ):
+        """
+        :param capture_4xx: Log metadata for responses with 4xx status code
+        :param capture_5xx: Log metadata for responses with 5xx status code
+        :param capture_body: Include the request body
+        :param max_body_size: Maximum number of bytes of the request body to include
+        :param header_allowlist: Include only headers matching one of the case-insensitive fnmatch patterns, None to include all
+        :param cookie_allowlist: Include only cookies matching one of the case-insensitive fnmatch patterns, None to include all
+        :param max_form_fields: Maximum number of included form fields and files
+        :param max_value_length: Maximum length of the included header, cookie and form values
+        :param body_wait: Maximum time in seconds the async snapshot waits for the body that is still being received
+        """
         self.capture_4xx = capture_4xx
         self.capture_5xx = capture_5xx
         self.capture_body = capture_body
+        self.max_body_size = max_body_size
+        self.header_allowlist = header_allowlist
+        self.cookie_allowlist = cookie_allowlist
+        self.max_form_fields = max_form_fields
+        self.max_value_length = max_value_length
+        self.body_wait = body_wait
 
     def gather(self, context: LoccerOutput) -> JSONType:
         data: JSONType = {}
         if quart.request:
+            request = quart.request._get_current_object()
+            headers, _ = bounded_items(request.headers.items(), self.header_allowlist, max_length=self.max_value_length)
             data.update({
                 "quart_context": True,
                 # FIXME "quart_version": quart.__version__,
-                "endpoint": (quart.request.endpoint or "<unknown>"),
-                "client_ip": quart.request.remote_addr,
-                "url": quart.request.path,
-                "method": quart.request.method,
-                "headers": dict(quart.request.headers),
-                "user_agent": quart.request.headers.get("User-Agent", "<unknown>"),
-                "is_json": quart.request.is_json,
-                "content_length": quart.request.content_length,
-                "content_type": quart.request.content_type,
-                "files": {}
+                "endpoint": (request.endpoint or "<unknown>"),
+                "client_ip": request.remote_addr,
+                "url": truncate(request.path, self.max_value_length),
+                "method": request.method,
+                "headers": headers,
+                "user_agent": truncate(request.headers.get("User-Agent", "<unknown>"), self.max_value_length),
+                "is_json": request.is_json,
+                "content_length": request.content_length,
+                "content_type": request.content_type,
+                "files": None
             })
 
-            data["cookies"] = {
-                k: v[0] if isinstance(v, list) and len(v) == 1 else v
-                for k, v in quart.request.cookies.items()
-            }
+            data["cookies"], _ = bounded_items(
+                ((k, v[0] if isinstance(v, list) and len(v) == 1 else v) for k, v in request.cookies.items()),
+                self.cookie_allowlist,
+                max_length=self.max_value_length
+            )
+
+            snapshot = _REQUEST_SNAPSHOT.get()
+            if snapshot is not None and snapshot[0] is request:
+                data.update(snapshot[1])
+            else:
+                # Captured outside of the signal handlers, use only what is available without awaiting
+                budget = context.budget if context is not None else None
+                data.update(self.snapshot_request(request, budget_expired=(budget is not None and budget.expired())))
         else:
             data["quart_context"] = False
         return data
 
-    def init_app(self, quart_app: quart.Quart) -> None:
-        original_exc_handler = quart_app.log_exception
-        quart_app.log_exception = functools.partial(self.exc_handler_patch, original=original_exc_handler)
+    def snapshot_request(self, request: quart.Request, budget_expired: bool = False) -> JSONType:
+        """
+        Size-capped form and body data Quart has already received or parsed, never awaits
+
+        :param request: Quart request
+        :param budget_expired: Time budget of the capture is exhausted, the body is not copied
+        """
+        data: JSONType = {"form": None, "files": None}
 
-        if not quart.signals_available:
+        form = getattr(request, "_form", None)
+        if form is not None:
+            data["form"], omitted = bounded_items(
+                form.items(), max_items=self.max_form_fields, max_length=self.max_value_length
+            )
+            if omitted:
+                data["form_omitted"] = omitted
+
+        files = getattr(request, "_files", None)
+        if files is not None:
+            data["files"] = files_metadata(files.items(), self.max_form_fields, self.max_value_length)
+
+        if self.capture_body and budget_expired:
+            data["raw_payload"] = "Loccer N/A; time budget exhausted before reading the request data"
+        elif self.capture_body:
+            try:
+                data.update(self._body_payload(request))
+            except Exception:
+                data["raw_payload"] = "Loccer N/A; error getting raw request data"
+
+        return data
+
+    async def async_snapshot_request(self) -> None:
+        """
+        Snapshot the request data for the following synchronous `gather`
+        """
+        if not quart.request:
+            return
+
+        request = quart.request._get_current_object()
+        body = getattr(request, "body", None)
+        complete = getattr(body, "_complete", None)
+        received = getattr(body, "_data", None)
+        if (
+            self.capture_body and self.body_wait > 0 and isinstance(complete, asyncio.Event) and not complete.is_set()
+            and received is not None and len(received) <= self.max_body_size
+        ):
+            # Body is still being received, wait for it without blocking the loop
+            try:
+                await asyncio.wait_for(complete.wait(), timeout=self.body_wait)
+            except asyncio.TimeoutError:
+                pass
+
+        _REQUEST_SNAPSHOT.set((request, self.snapshot_request(request)))
+
+    def _body_payload(self, request: quart.Request) -> JSONType:
+        if getattr(request, "_form", None) is not None and request.mimetype in FORM_MIMETYPES:
+            # Body has been consumed by the form parser, the parsed fields are captured instead
+            return {"json_payload": None, "raw_payload": None, "body_truncated": False}
+
+        body = getattr(request, "body", None)
+        received = getattr(body, "_data", None)
+        if received is None:
+            # Body buffer is not available in this Quart version
+            return {"json_payload": None, "raw_payload": None, "body_truncated": bool(request.content_length)}
+
+        # Quart buffers the received body in the `Body` object, the data is copied only up to the max size
+        data = bytes(received[:self.max_body_size + 1])
+        complete_event = getattr(body, "_complete", None)
+        if isinstance(complete_event, asyncio.Event):
+            complete = complete_event.is_set()
+        else:
+            complete = request.content_length is not None and len(data) >= request.content_length
+
+        if not data and request.content_length:
+            # Body has been streamed by the application (`async for chunk in request.body`) and is gone
+            return {"json_payload": None, "raw_payload": None, "body_truncated": True}
+
+        return body_payload(data, self.max_body_size, parsed_json(request), complete=complete)
+
+    def init_app(self, quart_app: quart.Quart) -> None:
+        if not getattr(quart, "signals_available", True):
             warnings.warn("Signals in Quart are not available (`blinker` is probably not installed)")
+            original_exc_handler = quart_app.log_exception
+            quart_app.log_exception = functools.partial(self.exc_handler_patch, original=original_exc_handler)
         else:
-            # FIXME: quart.got_request_exception.connect(self.handle_quart_exception)
+            quart.got_request_exception.connect(self.handle_quart_exception)
 
             if self.capture_5xx or self.capture_4xx:
                 quart.request_finished.connect(self.handle_request_end)
@@ -71,6 +203,7 @@ class QuartContextIntegration(Integration):
         elif code >= 500 and not self.capture_5xx:
             return
 
+        await self.async_snapshot_request()
         lc = get_hybrid_context()
         lc.log_metadata({
             "msg": f"Quart `{code}` response",
@@ -79,9 +212,9 @@ class QuartContextIntegration(Integration):
 
     @staticmethod
     def exc_handler_patch(*args, original, **kwargs):
-        get_hybrid_context().from_exception(sys.exception())
+        get_hybrid_context().from_exception(sys.exc_info()[1])
         return original(*args, **kwargs)
 
-    @staticmethod
-    async def handle_quart_exception(sender, exception: Exception, **extra):
+    async def handle_quart_exception(self, sender, exception: Exception, **extra):
+        await self.async_snapshot_request()
         get_hybrid_context().from_exception(exception)
@@ -0,0 +1,140 @@
+"""
+Size-capped capture of the HTTP request data shared by the web framework integrations
+
+Nothing in here parses or reads the request on its own, the integrations pass in only the data
+the framework has already loaded (or a bounded prefix of the body they peeked at).
+"""
+import fnmatch
+import typing as t
+
+
+DEFAULT_MAX_BODY_SIZE = 2**16
+DEFAULT_MAX_FORM_FIELDS = 100
+DEFAULT_MAX_VALUE_LENGTH = 4096
+
+#: Mimetypes of the bodies consumed by the form parser of the frameworks
+FORM_MIMETYPES = ("multipart/form-data", "application/x-www-form-urlencoded")
+
+
+def is_allowed(name: str, allowlist: t.Optional[t.Sequence[str]]) -> bool:
+    """
+    Check the name against case-insensitive fnmatch patterns, None allowlist allows everything
+    """
+    if allowlist is None:
+        return True
+
+    name = name.lower()
+    return any(fnmatch.fnmatchcase(name, x.lower()) for x in allowlist)
+
+
+def truncate(value: t.Any, max_length: int) -> t.Any:
+    """
+    Truncate string values longer than `max_length`, other values are returned as they are
+    """
+    if isinstance(value, str) and len(value) > max_length:
+        return f"{value[:max_length]}...(+{len(value) - max_length})"
+    return value
+
+
+def bounded_items(
+    items: t.Iterable[t.Tuple[str, t.Any]],
+    allowlist: t.Optional[t.Sequence[str]] = None,
+    max_items: t.Optional[int] = None,
+    max_length: int = DEFAULT_MAX_VALUE_LENGTH,
+) -> t.Tuple[t.Dict[str, t.Any], int]:
+    """
+    Copy allowed items into a dict with their values truncated
+
+    :param items: Iterable of (name, value) pairs
+    :param allowlist: Copy only items with the name matching one of the fnmatch patterns, None to copy all
+    :param max_items: Maximum number of copied items, None for no limit
+    :param max_length: Maximum length of the string values
+    :return: Copied items and the number of allowed items left out due to `max_items`
+    """
+    data: t.Dict[str, t.Any] = {}
+    omitted = 0
+    for name, value in items:
+        if not is_allowed(name, allowlist):
+            continue
+        elif max_items is not None and len(data) >= max_items:
+            omitted += 1
+            continue
+
+        data[name] = truncate(value, max_length)
+
+    return data, omitted
+
+
+def files_metadata(
+    files: t.Iterable[t.Tuple[str, t.Any]],
+    max_items: int = DEFAULT_MAX_FORM_FIELDS,
+    max_length: int = DEFAULT_MAX_VALUE_LENGTH,
+) -> t.Dict[str, t.Any]:
+    """
+    Metadata of the uploaded files (werkzeug `FileStorage` compatible objects), the file content is never read
+
+    :param files: Iterable of (form name, file) pairs
+    :param max_items: Maximum number of included files
+    :param max_length: Maximum length of the file name and header values
+    """
+    data: t.Dict[str, t.Any] = {}
+    for fname, f in files:
+        if len(data) >= max_items:
+            break
+
+        data[fname] = {
+            "filename": truncate(f.filename, max_length),
+            "form_name": f.name,
+            "content_type": f.content_type,
+            "content_length": f.content_length,
+            "headers": bounded_items(f.headers.items(), max_length=max_length)[0]
+        }
+
+    return data
+
+
+def parsed_json(request: t.Any) -> t.Any:
+    """
+    JSON body the framework has already parsed and cached, None if the application did not parse it
+
+    Werkzeug caches the parsed JSON as a `(silent=False, silent=True)` tuple, Quart as a dict keyed by `silent`,
+    `Ellipsis` marks a value that has not been parsed yet.
+    """
+    cached = getattr(request, "_cached_json", None)
+    if isinstance(cached, dict):
+        values = cached.values()
+    elif isinstance(cached, tuple):
+        values = cached
+    else:
+        return None
+
+    for value in values:
+        if value is not Ellipsis and value is not None:
+            return value
+    return None
+
+
+def body_payload(
+    data: bytes, max_size: int, json_payload: t.Any = None, complete: bool = True
+) -> t.Dict[str, t.Any]:
+    """
+    Captured representation of the request body
+
+    The body is never parsed here, JSON already parsed by the framework (see `parsed_json`) is included only
+    for a complete body not larger than `max_size`, otherwise the body is stored as text cut to `max_size` bytes.
+
+    :param data: Request body or its prefix
+    :param max_size: Maximum number of bytes of the body to include
+    :param json_payload: JSON body parsed by the framework, None if it has not been parsed
+    :param complete: `data` contains the whole body and not only its prefix
+    """
+    truncated = not complete or len(data) > max_size
+    payload: t.Dict[str, t.Any] = {"json_payload": None, "body_truncated": truncated}
+
+    if not truncated:
+        payload["json_payload"] = json_payload
+
+    if not payload["json_payload"]:
+        payload["raw_payload"] = data[:max_size].decode(errors="replace")
+
+    return payload
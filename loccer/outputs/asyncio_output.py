@@ -0,0 +1,187 @@
+import asyncio
+import concurrent.futures
+import typing as t
+
+from ..bases import OutputBase, AsyncOutputBase, LoccerOutput
+
+
+class AsyncioDispatcher(OutputBase):
+    def __init__(
+        self,
+        handlers: t.Sequence[t.Union[OutputBase, AsyncOutputBase]],
+        loop: t.Optional[asyncio.AbstractEventLoop] = None,
+        executor: t.Optional[concurrent.futures.Executor] = None,
+        max_pending: int = 1000,
+    ):
+        """
+        Output handler dispatching logs from the asyncio loop without blocking it
+
+        Serialization of the log and the sync output handlers are offloaded to the executor,
+        async output handlers are awaited inside the loop. Logs are dispatched in the order they were captured.
+        If there is no loop available or the bound loop is not running, the logs are output synchronously.
+
+        :param handlers: Sync or async output handlers
+        :param loop: Loop the dispatcher is bound to, defaults to the loop running when the first log is dispatched
+        :param executor: Executor for the blocking work, defaults to a dedicated single thread executor
+        :param max_pending: Maximum number of logs waiting to be dispatched, further logs are dropped
+        """
+        if max_pending < 1:
+            raise ValueError("Max pending must be 1 or greater number")
+
+        self.handlers = handlers
+        self.loop = loop
+        self.max_pending = max_pending
+        self.errors = 0  #: Number of errors raised by the output handlers
+        self.dropped = 0  #: Number of logs dropped due to too many pending dispatches
+        self.last_error: t.Optional[BaseException] = None
+
+        self._executor = executor
+        self._own_executor = executor is None
+        self._pending: t.Set[asyncio.Task] = set()
+        # Flushes scheduled by `flush()` inside the loop, kept apart from the dispatches they wait for
+        self._flushes: t.Set[asyncio.Task] = set()
+        self._order_lock: t.Optional[asyncio.Lock] = None
+
+    def output(self, exc: LoccerOutput) -> None:
+        loop = self._get_loop()
+
+        if loop is None:
+            self._output_sync(exc)
+            return
+
+        if self._in_loop(loop):
+            self._schedule(exc)
+        elif loop.is_running():
+            loop.call_soon_threadsafe(self._schedule, exc)
+        else:
+            # Callback scheduled on a stopped loop would never run
+            self._output_sync(exc)
+
+    async def aflush(self) -> None:
+        """
+        Wait until all dispatched logs are output and flush the output handlers
+        """
+        current = asyncio.current_task()
+        while True:
+            pending = [x for x in self._pending if x is not current]
+            if not pending:
+                break
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        for handler in self.handlers:
+            if isinstance(handler, AsyncOutputBase):
+                await handler.flush()
+            else:
+                await self._run_blocking(handler.flush)
+
+    async def aclose(self) -> None:
+        """
+        Flush and close all output handlers, can be used for example from the Quart `after_serving`
+        """
+        current = asyncio.current_task()
+        flushes = [x for x in self._flushes if x is not current]
+        if flushes:
+            await asyncio.gather(*flushes, return_exceptions=True)
+        await self.aflush()
+
+        for handler in self.handlers:
+            if isinstance(handler, AsyncOutputBase):
+                await handler.close()
+            else:
+                await self._run_blocking(handler.close)
+
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def flush(self) -> None:
+        """
+        Flush the dispatched logs, blocks until done when called outside of the loop
+        Blocking inside the loop is not possible, the flush is only scheduled then, use `aflush` to wait for it
+        """
+        loop = self._get_loop()
+
+        if loop is not None and loop.is_running():
+            if self._in_loop(loop):
+                task = loop.create_task(self.aflush())
+                self._flushes.add(task)
+                task.add_done_callback(self._flushes.discard)
+            else:
+                asyncio.run_coroutine_threadsafe(self.aflush(), loop).result()
+            return
+
+        for handler in self.handlers:
+            if not isinstance(handler, AsyncOutputBase):
+                handler.flush()
+
+    def close(self) -> None:
+        """
+        Flush and close the sync output handlers, must not be called from inside the running loop, use `aclose` instead
+        """
+        loop = self._get_loop()
+        if loop is not None and loop.is_running() and self._in_loop(loop):
+            raise RuntimeError("AsyncioDispatcher.close() can't be called from inside the running loop, use `await aclose()`")
+
+        self.flush()
+        for handler in self.handlers:
+            if not isinstance(handler, AsyncOutputBase):
+                handler.close()
+
+    @staticmethod
+    def _in_loop(loop: asyncio.AbstractEventLoop) -> bool:
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+    def _get_loop(self) -> t.Optional[asyncio.AbstractEventLoop]:
+        if self.loop is not None and not self.loop.is_closed():
+            return self.loop
+
+        try:
+            self.loop = asyncio.get_running_loop()
+            self._order_lock = None
+        except RuntimeError:
+            return None
+
+        return self.loop
+
+    def _schedule(self, exc: LoccerOutput) -> None:
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+
+        task = self.loop.create_task(self._dispatch(exc))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _dispatch(self, exc: LoccerOutput) -> None:
+        if self._order_lock is None:
+            self._order_lock = asyncio.Lock()
+
+        async with self._order_lock:
+            # Serialize once in the executor, handlers would then use the cached representation
+            await self._run_blocking(exc.cached_json)
+
+            for handler in self.handlers:
+                try:
+                    if isinstance(handler, AsyncOutputBase):
+                        await handler.output(exc)
+                    else:
+                        await self._run_blocking(handler.output, exc)
+                except Exception as err:
+                    self.errors += 1
+                    self.last_error = err
+
+    async def _run_blocking(self, func: t.Callable, *args: t.Any) -> t.Any:
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="loccer-asyncio")
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _output_sync(self, exc: LoccerOutput) -> None:
+        for handler in self.handlers:
+            if isinstance(handler, AsyncOutputBase):
+                asyncio.run(handler.output(exc))
+            else:
+                handler.output(exc)
@@ -0,0 +1,445 @@
+"""
+Compact binary log format
+
+File starts with the `MAGIC` header followed by length-prefixed records (varint length + record body).
+First byte of the record body is the record kind:
+
+- `RECORD_RESET` clears the string table, written at the start of every writer session
+- `RECORD_LOG` followed by a single encoded value holding the JSON representation of the log
+
+Values are encoded with a one byte tag. Strings can be defined in a per-file string table (`TAG_STR_DEF`)
+and referenced later by their index (`TAG_STR_REF`), so repeated dict keys, filenames, function names
+or environment variables are stored only once per file. Integers are zigzag varints.
+
+String table is valid only for the records of a single writer, multiple processes can append to the same file
+as every writer takes an exclusive `fcntl.flock` on the file and starts with a `RECORD_RESET` whenever
+another writer appended to the file since its last record.
+"""
+import atexit
+import gzip
+import json
+import os
+import struct
+import threading
+import typing as t
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from ..bases import OutputBase, LoccerOutput
+from ..ltypes import JSONType
+from ..safe_repr import safe_repr
+from .file_stream import rotate, LoccerJSONEncoder, COMPRESSED_DUMP_KWARGS
+
+
+MAGIC = b"LCCB\x01"
+
+RECORD_RESET = 0
+RECORD_LOG = 1
+
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_STR_DEF = 6
+TAG_STR_REF = 7
+TAG_LIST = 8
+TAG_DICT = 9
+
+_FLOAT = struct.Struct("<d")
+
+
+class BinaryFormatError(ValueError):
+    pass
+
+
+def write_varint(buf: bytearray, value: int) -> None:
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def read_varint(data: bytes, pos: int) -> t.Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        try:
+            byte = data[pos]
+        except IndexError:
+            raise BinaryFormatError("Truncated varint") from None
+
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not (byte & 0x80):
+            return result, pos
+        shift += 7
+
+
+class BinaryEncoder:
+    """
+    Stateful encoder holding the string table of the file being written
+    """
+
+    def __init__(self, intern_max_length: int = 256, max_strings: int = 2**16):
+        """
+        :param intern_max_length: Maximum length of string values added to the string table, dict keys are always interned
+        :param max_strings: Maximum size of the string table, further strings are stored inline
+        """
+        self.intern_max_length = intern_max_length
+        self.max_strings = max_strings
+        self.strings: t.Dict[str, bytes] = {}  #: Interned strings with their encoded `TAG_STR_REF` reference
+
+    def reset(self) -> bytes:
+        self.strings.clear()
+        return self._record(bytes((RECORD_RESET,)))
+
+    def encode(self, data: JSONType) -> bytes:
+        buf = bytearray((RECORD_LOG,))
+        self._encode(buf, data)
+        return self._record(buf)
+
+    @staticmethod
+    def _record(body: t.Union[bytes, bytearray]) -> bytes:
+        out = bytearray()
+        write_varint(out, len(body))
+        out += body
+        return bytes(out)
+
+    def _encode(self, buf: bytearray, value: t.Any) -> None:
+        value_type = type(value)
+
+        if value_type is str:
+            # Most strings are repeated, the complete encoded reference is cached in the string table
+            ref = self.strings.get(value)
+            if ref is not None:
+                buf += ref
+            else:
+                self._encode_str(buf, value, len(value) <= self.intern_max_length)
+        elif value_type is dict:
+            buf.append(TAG_DICT)
+            write_varint(buf, len(value))
+            strings = self.strings
+            for key, item in value.items():
+                ref = strings.get(key)
+                if ref is not None:
+                    buf += ref
+                else:
+                    self._encode_str(buf, key if type(key) is str else str(key), True)
+
+                if type(item) is str:
+                    ref = strings.get(item)
+                    if ref is not None:
+                        buf += ref
+                        continue
+                self._encode(buf, item)
+        elif value_type is list or value_type is tuple:
+            buf.append(TAG_LIST)
+            write_varint(buf, len(value))
+            for item in value:
+                self._encode(buf, item)
+        elif value is None:
+            buf.append(TAG_NONE)
+        elif value is True:
+            buf.append(TAG_TRUE)
+        elif value is False:
+            buf.append(TAG_FALSE)
+        elif value_type is int:
+            buf.append(TAG_INT)
+            write_varint(buf, (value << 1) if value >= 0 else ((-value << 1) - 1))
+        elif value_type is float:
+            buf.append(TAG_FLOAT)
+            buf += _FLOAT.pack(value)
+        else:
+            # Same fallback as in the `LoccerJSONEncoder`
+            self._encode_str(buf, safe_repr(value), False)
+
+    def _encode_str(self, buf: bytearray, value: str, intern: bool) -> None:
+        ref = self.strings.get(value)
+        if ref is not None:
+            buf += ref
+            return
+
+        encoded = value.encode("utf-8", errors="surrogatepass")
+        if intern and len(self.strings) < self.max_strings:
+            ref = bytearray((TAG_STR_REF,))
+            write_varint(ref, len(self.strings))
+            self.strings[value] = bytes(ref)
+            buf.append(TAG_STR_DEF)
+        else:
+            buf.append(TAG_STR)
+
+        write_varint(buf, len(encoded))
+        buf += encoded
+
+
+class BinaryReader:
+    """
+    Streaming reader of the binary log files, records are decoded lazily one at a time
+    Gzip compressed backups created by the rotation are supported transparently
+    """
+
+    def __init__(self, fd: t.BinaryIO):
+        self.fd = fd
+        self.strings: t.List[str] = []
+
+        # Empty file is valid, for example a fresh file right after the rotation
+        header = fd.read(len(MAGIC))
+        self.empty = not header
+        if header != MAGIC and not self.empty:
+            raise BinaryFormatError("Not a loccer binary log file")
+
+    @classmethod
+    def open(cls, filename: str) -> "BinaryReader":
+        if filename.endswith(".gz"):
+            fd = gzip.open(filename, "rb")
+        else:
+            fd = open(filename, "rb")
+
+        try:
+            return cls(fd)
+        except Exception:
+            fd.close()
+            raise
+
+    def close(self) -> None:
+        self.fd.close()
+
+    def __enter__(self) -> "BinaryReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __iter__(self) -> t.Iterator[JSONType]:
+        while True:
+            body = self._read_record()
+            if body is None:
+                return
+
+            kind = body[0]
+            if kind == RECORD_RESET:
+                self.strings.clear()
+            elif kind == RECORD_LOG:
+                try:
+                    value, pos = self._decode(body, 1)
+                except (IndexError, struct.error, UnicodeDecodeError) as exc:
+                    raise BinaryFormatError(f"Corrupted record: {exc}") from exc
+
+                if pos != len(body):
+                    raise BinaryFormatError("Corrupted record: size does not match the encoded value")
+                yield value
+            else:
+                raise BinaryFormatError(f"Unknown record kind `{kind}`")
+
+    def _read_record(self) -> t.Optional[bytes]:
+        length = 0
+        shift = 0
+        while True:
+            byte = self.fd.read(1)
+            if not byte:
+                if shift:
+                    raise BinaryFormatError("Truncated record length")
+                return None
+
+            length |= (byte[0] & 0x7f) << shift
+            if not (byte[0] & 0x80):
+                break
+            shift += 7
+
+        body = self.fd.read(length)
+        if len(body) != length or not length:
+            raise BinaryFormatError("Truncated record")
+        return body
+
+    def _decode(self, data: bytes, pos: int) -> t.Tuple[t.Any, int]:
+        tag = data[pos]
+        pos += 1
+
+        if tag == TAG_STR_REF:
+            idx, pos = read_varint(data, pos)
+            return self.strings[idx], pos
+        elif tag == TAG_STR or tag == TAG_STR_DEF:
+            size, pos = read_varint(data, pos)
+            end = pos + size
+            if end > len(data):
+                raise BinaryFormatError("Truncated string")
+
+            value = data[pos:end].decode("utf-8", errors="surrogatepass")
+            if tag == TAG_STR_DEF:
+                self.strings.append(value)
+            return value, end
+        elif tag == TAG_DICT:
+            size, pos = read_varint(data, pos)
+            items, pos = self._decode_items(data, pos, size * 2)
+            return dict(zip(items[::2], items[1::2])), pos
+        elif tag == TAG_LIST:
+            size, pos = read_varint(data, pos)
+            return self._decode_items(data, pos, size)
+        elif tag == TAG_NONE:
+            return None, pos
+        elif tag == TAG_TRUE:
+            return True, pos
+        elif tag == TAG_FALSE:
+            return False, pos
+        elif tag == TAG_INT:
+            value, pos = read_varint(data, pos)
+            return (value >> 1) if not (value & 1) else -((value + 1) >> 1), pos
+        elif tag == TAG_FLOAT:
+            return _FLOAT.unpack_from(data, pos)[0], pos + _FLOAT.size
+
+        raise BinaryFormatError(f"Unknown value tag `{tag}`")
+
+    def _decode_items(self, data: bytes, pos: int, count: int) -> t.Tuple[t.List[t.Any], int]:
+        strings = self.strings
+        items: t.List[t.Any] = []
+        append = items.append
+
+        for _ in range(count):
+            # Fast path for references into the string table with up to 2 bytes long index, the vast majority of items
+            if data[pos] == TAG_STR_REF:
+                byte = data[pos + 1]
+                if byte < 0x80:
+                    append(strings[byte])
+                    pos += 2
+                    continue
+
+                high = data[pos + 2]
+                if high < 0x80:
+                    append(strings[(byte & 0x7f) | (high << 7)])
+                    pos += 3
+                    continue
+
+            item, pos = self._decode(data, pos)
+            append(item)
+
+        return items, pos
+
+
+class BinaryFileOutput(OutputBase):
+    def __init__(
+        self,
+        filename: str,
+        max_size: int = ((2**20)*10),
+        max_files: int = 10,
+        background_compression: bool = True,
+        intern_max_length: int = 256,
+    ):
+        """
+        Compact binary output into a file, see `loccer.outputs.binary` for the format description
+        File is kept open and the string table is reset on every open or after another process appended to the file,
+        rotation is the same as in `JSONFileOutput` and is not coordinated between the processes
+
+        :param filename:
+        :param max_size: maximum log size before the file is rotated, set to 0 to disable file rotation
+        :param max_files: Maximum number of compressed log backups to keep when rotating files
+        :param background_compression: Compress rotated log file in a background thread
+        :param intern_max_length: Maximum length of string values added to the per-file string table
+        """
+        if max_size < 0:
+            raise ValueError("Max size must be 0 or greater number")
+
+        if max_files < 0:
+            raise ValueError("Max files must be 0 or greater number")
+
+        self.filename = filename
+        self.max_size = max_size
+        self.max_files = max_files
+        self.background_compression = background_compression
+        self.encoder = BinaryEncoder(intern_max_length=intern_max_length)
+        self.bytes_written = 0  #: Size of the records written into the file
+
+        self._fd: t.Optional[t.BinaryIO] = None
+        self._size = 0
+        # Offset of the end of the last record written by this writer, None before the first record
+        self._end: t.Optional[int] = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def output(self, exc: LoccerOutput) -> None:
+        data = exc.cached_json()
+
+        with self._lock:
+            self._ensure_open()
+            written = self._write(data)
+            self.bytes_written += written
+
+            if self.max_size and self._size >= self.max_size:
+                self._close_fd()
+                rotate(self.filename, self.max_size, self.max_files, background=self.background_compression)
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_fd()
+        atexit.unregister(self.close)
+
+    def _ensure_open(self) -> None:
+        if self._pid != os.getpid():
+            # String table state is shared with the parent process, start a new session in the child
+            self._pid = os.getpid()
+            self._close_fd()
+
+        if self._fd is not None:
+            return
+
+        self._fd = open(self.filename, "ab", buffering=0)
+        # Header and the string table reset are written together with the first record
+        self._end = None
+
+    def _write(self, data: JSONType) -> int:
+        fd = self._fd.fileno()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+        try:
+            end = os.lseek(fd, 0, os.SEEK_END)
+            if end != self._end:
+                # File is new or another process appended its records which redefined the string table
+                record = (b"" if end else MAGIC) + self.encoder.reset() + self.encoder.encode(data)
+            else:
+                record = self.encoder.encode(data)
+
+            self._fd.write(record)
+            self._end = self._size = end + len(record)
+            return len(record)
+        except BaseException:
+            # String table might hold strings defined only by the record that has not been written
+            self._end = None
+            raise
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _close_fd(self) -> None:
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+
+def iter_records(filename: str) -> t.Iterator[JSONType]:
+    """
+    Lazily read the logs from the binary log file or its gzip compressed backup
+    """
+    with BinaryReader.open(filename) as reader:
+        yield from reader
+
+
+def convert_to_json(filename: str, out: t.TextIO) -> int:
+    """
+    Convert the binary log file into the JSON lines format as written by `JSONFileOutput`
+
+    :param filename: binary log file or its compressed backup
+    :param out: Text stream where to write the JSON lines
+    :return: Number of converted logs
+    """
+    count = 0
+    for record in iter_records(filename):
+        out.write(json.dumps(record, cls=LoccerJSONEncoder, **COMPRESSED_DUMP_KWARGS) + os.linesep)
+        count += 1
+
+    return count
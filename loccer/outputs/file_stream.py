@@ -1,43 +1,72 @@
+import atexit
 import os
 import os.path
 import shutil
 import json
 import gzip
+import threading
+import time
 import typing as t
+import weakref
+from json.encoder import encode_basestring, encode_basestring_ascii
 
-from ..bases import OutputBase, LoccerOutput
+from ..bases import OutputBase, LoccerOutput, ExceptionData, FrameRecord
+from ..ltypes import JSONType
+from ..query import INDEX_SUFFIX
+from ..safe_repr import safe_repr
 
 
 class LoccerJSONEncoder(json.JSONEncoder):
     def default(self, o: t.Any) -> t.Any:
         if not (isinstance(o, (int, str, list, bool, float, dict)) and o is not None):
-            return repr(o)
+            # Integrations might return arbitrary objects, their repr must be bounded as well
+            return safe_repr(o)
 
         return json.JSONEncoder.default(self, o)
 
 
+COMPRESSED_DUMP_KWARGS = {
+    "separators": (",", ":")
+}
+INDENTED_DUMP_KWARGS = {
+    "indent": 2,
+    "ensure_ascii": False
+}
+
+
 class JSONStreamOutput(OutputBase):
     def __init__(self, fd: t.TextIO, compressed=True):
         self.fd = fd
         self.compressed = compressed
 
         if self.compressed:
-            self.dump_kwargs = {
-                "separators": (",", ":")
-            }
+            self.dump_kwargs = dict(COMPRESSED_DUMP_KWARGS)
         else:
-            self.dump_kwargs = {
-                "indent": 2,
-                "ensure_ascii": False
-            }
+            self.dump_kwargs = dict(INDENTED_DUMP_KWARGS)
+
+        self.bytes_written = 0  #: Size of the written logs, counted in characters as the stream is text based
 
     def output(self, exc: LoccerOutput) -> None:
-        data = json.dumps(exc.as_json(), cls=LoccerJSONEncoder, **self.dump_kwargs)
-        self.fd.write(data.strip() + os.linesep)
+        line = encode_line(exc, self.dump_kwargs)
+        self.fd.write(line)
+        self.bytes_written += len(line)
 
 
 class JSONFileOutput(OutputBase):
-    def __init__(self, filename, compressed=True, max_size=((2**20)*10), max_files: int=10):
+    def __init__(
+        self,
+        filename,
+        compressed=True,
+        max_size=((2**20)*10),
+        max_files: int=10,
+        *,
+        persistent: bool = False,
+        flush_interval: t.Optional[float] = 1.0,
+        flush_bytes: int = 2**16,
+        fsync: bool = False,
+        background_compression: bool = True,
+        reopen_interval: float = 1.0,
+    ):
         """
         JSON output into file, one error report per line
 
@@ -45,6 +74,12 @@ class JSONFileOutput(OutputBase):
         :param compressed: Flag to turn on compressed json output stripping unnecessary whitespaces
         :param max_size: maximum error log size before the file is rotated, set to 0 to disable file rotation
         :param max_files: Maximum number of compressed error log backups to keep when rotating files
+        :param persistent: Keep the log file open between the outputs and buffer the writes instead of re-opening the file for every log
+        :param flush_interval: Persistent mode only; maximum time in seconds the logs can stay buffered, 0 to flush after every log, None to flush only based on `flush_bytes`
+        :param flush_bytes: Persistent mode only; flush the buffer when it reaches this size in bytes
+        :param fsync: Persistent mode only; call `os.fsync` after every flush of the buffer
+        :param background_compression: Compress rotated log file in a background thread, logging continues into a fresh file meanwhile
+        :param reopen_interval: Persistent mode only; minimum time in seconds between the checks if the file has been moved or removed by an external logrotate
         """
         if max_size < 0:
             raise ValueError("Max size must be greater than 10")
@@ -52,38 +87,332 @@ class JSONFileOutput(OutputBase):
         if max_files < 0:
             raise ValueError("Max files must be 0 or greater number")
 
+        if flush_interval is not None and flush_interval < 0:
+            raise ValueError("Flush interval must be 0 or greater number")
+
         self.filename = filename
         self.compressed = compressed
         self.max_size = max_size
         self.max_files = max_files
+        self.persistent = persistent
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync = fsync
+        self.background_compression = background_compression
+        self.reopen_interval = reopen_interval
+        self.bytes_written = 0  #: Size of the logs written into the file
+
+        self._fd: t.Optional[t.BinaryIO] = None
+        self._file_id: t.Optional[t.Tuple[int, int]] = None
+        self._size = 0
+        self._next_reopen_check = 0.0
+        self._buffer: t.List[bytes] = []
+        self._buffered = 0
+        self._lock = threading.RLock()
+        self._timer: t.Optional[threading.Timer] = None
+
+        if self.persistent:
+            _PERSISTENT_OUTPUTS.add(self)
+            atexit.register(self.close)
 
     def output(self, exc: LoccerOutput) -> None:
-        with open(self.filename, "a") as fd:
-            stream_out = JSONStreamOutput(fd=fd, compressed=self.compressed)
-            stream_out.output(exc)
+        if not self.persistent:
+            with open(self.filename, "a") as fd:
+                stream_out = JSONStreamOutput(fd=fd, compressed=self.compressed)
+                stream_out.output(exc)
+                self.bytes_written += stream_out.bytes_written
 
-        if self.max_size:
-            rotate(self.filename, self.max_size, self.max_files)
+            if self.max_size:
+                rotate(self.filename, self.max_size, self.max_files, background=self.background_compression)
+            return
 
+        data = encode_line_bytes(exc, COMPRESSED_DUMP_KWARGS if self.compressed else INDENTED_DUMP_KWARGS)
+        with self._lock:
+            self._buffer.append(data)
+            self._buffered += len(data)
 
-def rotate(filename: str, max_size: int, max_files: int = 10) -> bool:
-    fstat = os.stat(filename)
-    if fstat.st_size < max_size:
-        return False
+            if self._buffered >= self.flush_bytes or self.flush_interval == 0:
+                self._flush_buffer()
+            elif self.flush_interval is not None and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
 
-    for fnum in reversed(range(max_files-1)):
-        this_fname = f"{filename}.{fnum}.gz"
-        new_fname = f"{filename}.{fnum+1}.gz"
+    def flush(self) -> None:
+        if not self.persistent:
+            return
 
-        if os.path.exists(this_fname):
-            shutil.copyfile(this_fname, new_fname)
+        with self._lock:
+            self._flush_buffer()
+
+    def close(self) -> None:
+        if not self.persistent:
+            return
+
+        with self._lock:
+            self._flush_buffer()
+            self._close_fd()
+
+        atexit.unregister(self.close)
+
+    def _flush_buffer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._buffer:
+            return
+
+        self._ensure_open()
+        data = b"".join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+
+        self._fd.write(data)
+        self._fd.flush()
+        if self.fsync:
+            os.fsync(self._fd.fileno())
+
+        self._size += len(data)
+        self.bytes_written += len(data)
+        if self.max_size and self._size >= self.max_size:
+            self._close_fd()
+            rotate(self.filename, self.max_size, self.max_files, background=self.background_compression)
+
+    def _ensure_open(self) -> None:
+        if self._fd is not None and time.monotonic() >= self._next_reopen_check:
+            # File might have been moved or removed by an external logrotate, checked at most once per reopen interval
+            self._next_reopen_check = time.monotonic() + self.reopen_interval
+            try:
+                fstat = os.stat(self.filename)
+                if (fstat.st_dev, fstat.st_ino) != self._file_id:
+                    self._close_fd()
+            except FileNotFoundError:
+                self._close_fd()
+
+        if self._fd is None:
+            self._fd = open(self.filename, "ab", buffering=0)
+            fstat = os.fstat(self._fd.fileno())
+            self._file_id = (fstat.st_dev, fstat.st_ino)
+            self._size = fstat.st_size
+
+    def _close_fd(self) -> None:
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+            self._file_id = None
+
+    def _after_fork(self) -> None:
+        # Buffered logs belong to the parent process
+        self._lock = threading.RLock()
+        self._buffer.clear()
+        self._buffered = 0
+        self._timer = None
+        self._close_fd()
+
+
+_PERSISTENT_OUTPUTS: "weakref.WeakSet[JSONFileOutput]" = weakref.WeakSet()
+
+
+def _reset_persistent_outputs() -> None:
+    for x in _PERSISTENT_OUTPUTS:
+        x._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_persistent_outputs)
+
+
+def encode_line(exc: LoccerOutput, dump_kwargs: t.Dict[str, t.Any]) -> str:
+    """
+    Encode the log as a single JSON line including the line separator
+    Encoded line is cached on the log and shared with other handlers using the same `dump_kwargs`
+
+    Frames of the exceptions are streamed directly from the `FrameRecord` objects in the compact format,
+    unless the JSON representation has already been built for another handler.
+    """
+    def _encode(data: JSONType) -> str:
+        return json.dumps(data, cls=LoccerJSONEncoder, **dump_kwargs).strip() + os.linesep
+
+    stream_encoder = None
+    if isinstance(exc, ExceptionData) and _is_compact(dump_kwargs):
+        def stream_encoder(log: ExceptionData) -> str:
+            return encode_exception_compact(log, dump_kwargs) + os.linesep
+
+    return exc.encoded(("json_line",) + tuple(sorted(dump_kwargs.items())), _encode, stream_encoder)
+
+
+def encode_exception_compact(exc: ExceptionData, dump_kwargs: t.Dict[str, t.Any]) -> str:
+    """
+    Compact JSON of the exception identical to encoding its `as_json`, the frames are encoded
+    directly from the `FrameRecord` objects without building the intermediate dicts
+    """
+    encode_str = encode_basestring_ascii if dump_kwargs.get("ensure_ascii", True) else encode_basestring
+    header = json.dumps(exc.json_header(), cls=LoccerJSONEncoder, **dump_kwargs)
+    parts = [header[:-1], ',"frames":[', ",".join([_encode_frame(frame, encode_str) for frame in exc.frames]), "]"]
+
+    f_globals = exc.json_globals()
+    if f_globals is not None:
+        parts.append(',"globals":')
+        parts.append(json.dumps(f_globals, cls=LoccerJSONEncoder, **dump_kwargs))
+
+    parts.append("}")
+    return "".join(parts)
 
-        with open(filename, "r+b") as f_in:
-            with gzip.open(f"{filename}.0.gz", "wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
 
-            if f_in.seekable():
-                f_in.seek(0)
-            f_in.truncate()
+def _encode_frame(frame: FrameRecord, encode_str: t.Callable[[str], str]) -> str:
+    # Same keys and order as `FrameRecord.as_json`, locals are already reprred strings
+    if frame.locals is None:
+        f_locals = "null"
+    else:
+        f_locals = "{" + ",".join([encode_str(name) + ":" + encode_str(value) for name, value in frame.locals]) + "}"
+
+    line = frame.line
+    return (
+        '{"filename":' + encode_str(frame.filename)
+        + ',"lineno":' + ("null" if frame.lineno is None else str(frame.lineno))
+        + ',"name":' + encode_str(frame.name)
+        + ',"line":' + ("null" if line is None else encode_str(line))
+        + ',"locals":' + f_locals
+        + (f',"repeated":{frame.repeated}' if frame.repeated else "")
+        + "}"
+    )
+
+
+def _is_compact(dump_kwargs: t.Dict[str, t.Any]) -> bool:
+    return dump_kwargs.get("separators") == (",", ":") and dump_kwargs.keys() <= {"separators", "ensure_ascii"}
+
+
+def encode_line_bytes(exc: LoccerOutput, dump_kwargs: t.Dict[str, t.Any]) -> bytes:
+    """
+    UTF-8 encoded variant of `encode_line`
+    """
+    return exc.encoded(
+        ("json_line_bytes",) + tuple(sorted(dump_kwargs.items())),
+        lambda data: encode_line(exc, dump_kwargs).encode("utf-8")
+    )
+
+
+def rotate(filename: str, max_size: int, max_files: int = 10, background: bool = False) -> bool:
+    """
+    Rotate the log file if it reached the max size
+
+    The live file is atomically renamed to a pending segment and a fresh empty file is created in its place.
+    Pending segment is then compressed as the `.0.gz` backup and older backups are shifted via renames,
+    keeping at most `max_files` backups.
+
+    :param filename: Path to the live log file
+    :param max_size: Rotate the file only if it's at least this size in bytes
+    :param max_files: Maximum number of compressed backups to keep, 0 to discard the rotated content
+    :param background: Compress the rotated segment in a background thread, see `wait_for_rotation`.
+        Rotation is skipped while the previous segment of the same file is still being compressed
+    :return: True if the file has been rotated
+    """
+    with _rotation_lock(filename):
+        try:
+            fstat = os.stat(filename)
+        except FileNotFoundError:
+            return False
+
+        if fstat.st_size < max_size:
+            return False
+
+        # Previous segment must be compressed and shifted before another one can be created
+        previous = _PENDING_ROTATIONS.get(os.path.abspath(filename))
+        if previous is not None and previous.is_alive():
+            if background:
+                # Don't block the caller (possibly the excepthook), the file is rotated by one of the next writes
+                return False
+            previous.join()
+
+        segment = f"{filename}.rotating"
+        if os.path.exists(segment):
+            # Leftover from an interrupted rotation
+            _compress_segment(filename, segment, max_files)
+
+        os.replace(filename, segment)
+        open(filename, "ab").close()
+
+        if background:
+            thread = threading.Thread(
+                target=_compress_segment,
+                args=(filename, segment, max_files),
+                name="loccer-rotation",
+            )
+            _PENDING_ROTATIONS[os.path.abspath(filename)] = thread
+            thread.start()
+        else:
+            _compress_segment(filename, segment, max_files)
 
     return True
+
+
+def wait_for_rotation(filename: t.Optional[str] = None, timeout: t.Optional[float] = None) -> None:
+    """
+    Wait for the background compression of rotated segments to finish
+
+    :param filename: Wait only for the rotation of this log file, None to wait for all of them
+    :param timeout: Maximum time in seconds to wait for each rotation
+    """
+    if filename is None:
+        threads = list(_PENDING_ROTATIONS.values())
+    else:
+        threads = [_PENDING_ROTATIONS.get(os.path.abspath(filename))]
+
+    for thread in threads:
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+
+def _compress_segment(filename: str, segment: str, max_files: int) -> None:
+    try:
+        _shift_backups(filename, segment, max_files)
+    finally:
+        # Failed compression must not leave the rotation pending, the leftover segment is retried on the next rotation
+        key = os.path.abspath(filename)
+        if _PENDING_ROTATIONS.get(key) is threading.current_thread():
+            del _PENDING_ROTATIONS[key]
+
+
+def _shift_backups(filename: str, segment: str, max_files: int) -> None:
+    if max_files > 0:
+        tmp_fname = f"{filename}.0.gz.tmp"
+        with open(segment, "rb") as f_in:
+            with gzip.open(tmp_fname, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+
+        for fnum in reversed(range(max_files-1)):
+            this_fname = f"{filename}.{fnum}.gz"
+            if os.path.exists(this_fname):
+                os.replace(this_fname, f"{filename}.{fnum+1}.gz")
+                # Sidecar query index is renamed together with the backup so it doesn't need to be rebuilt
+                _replace_index(this_fname + INDEX_SUFFIX, f"{filename}.{fnum+1}.gz{INDEX_SUFFIX}")
+
+        os.replace(tmp_fname, f"{filename}.0.gz")
+
+    os.remove(segment)
+
+
+def _replace_index(src: str, dst: str) -> None:
+    try:
+        os.replace(src, dst)
+    except FileNotFoundError:
+        # Stale index of the overwritten backup would be rebuilt anyway, drop it right away
+        try:
+            os.remove(dst)
+        except FileNotFoundError:
+            pass
+
+
+_PENDING_ROTATIONS: t.Dict[str, threading.Thread] = {}
+_ROTATION_LOCKS: t.Dict[str, threading.Lock] = {}
+_ROTATION_LOCKS_GUARD = threading.Lock()
+
+
+def _rotation_lock(filename: str) -> threading.Lock:
+    key = os.path.abspath(filename)
+    with _ROTATION_LOCKS_GUARD:
+        lock = _ROTATION_LOCKS.get(key)
+        if lock is None:
+            lock = _ROTATION_LOCKS[key] = threading.Lock()
+        return lock
@@ -1,4 +1,12 @@
+import collections
+import copy
+import json
+import threading
+import typing as t
+
 from ..bases import OutputBase, LoccerOutput
+from ..ltypes import JSONType
+from .file_stream import encode_line_bytes, COMPRESSED_DUMP_KWARGS
 
 
 class InMemoryOutput(OutputBase):
@@ -6,7 +14,104 @@ class InMemoryOutput(OutputBase):
         self.logs = []
 
     def output(self, exc: LoccerOutput) -> None:
-        self.logs.append(exc.as_json())
+        # Cached JSON is shared with the other output handlers, stored logs can be modified by the consumer
+        self.logs.append(copy_json(exc.cached_json()))
+
+
+def copy_json(data: JSONType) -> JSONType:
+    """
+    Deep copy of the JSON representation of the log
+
+    Integrations might include values that can't be copied (locks, sockets, C objects), only the dicts and lists
+    are copied then and such values are shared with the original.
+    """
+    try:
+        return copy.deepcopy(data)
+    except Exception:
+        return _copy_containers(data)
+
+
+def _copy_containers(data: t.Any) -> t.Any:
+    if isinstance(data, dict):
+        return {key: _copy_containers(value) for key, value in data.items()}
+    elif isinstance(data, list):
+        return [_copy_containers(x) for x in data]
+    return data
+
+
+class RingBufferOutput(OutputBase):
+    def __init__(self, max_events: t.Optional[int] = 1000, max_bytes: t.Optional[int] = None):
+        """
+        Memory bounded buffer of the most recent logs, for example to expose recent errors on an admin endpoint
+        Logs are stored compactly as encoded JSON bytes and decoded only when read
+
+        :param max_events: Maximum number of retained logs, None for no limit
+        :param max_bytes: Maximum total size of the retained encoded logs in bytes, None for no limit
+        """
+        if max_events is None and max_bytes is None:
+            raise ValueError("At least one of max events or max bytes must be set")
+
+        if (max_events is not None and max_events < 1) or (max_bytes is not None and max_bytes < 1):
+            raise ValueError("Capacity must be 1 or greater number")
+
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.evicted = 0  #: Number of logs evicted from the buffer to make space for newer ones
+        self.dropped = 0  #: Number of logs that alone did not fit into `max_bytes`
+
+        self._buffer: t.Deque[bytes] = collections.deque()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def output(self, exc: LoccerOutput) -> None:
+        data = encode_line_bytes(exc, COMPRESSED_DUMP_KWARGS)
+
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            self.dropped += 1
+            return
+
+        with self._lock:
+            self._buffer.append(data)
+            self._size += len(data)
+
+            while (
+                (self.max_events is not None and len(self._buffer) > self.max_events)
+                or (self.max_bytes is not None and self._size > self.max_bytes)
+            ):
+                self._size -= len(self._buffer.popleft())
+                self.evicted += 1
+
+    def snapshot(self) -> t.List[JSONType]:
+        """
+        Thread-safe copy of the buffered logs ordered from the oldest, logs are decoded outside the lock
+        """
+        return [json.loads(x) for x in self.raw_snapshot()]
+
+    def raw_snapshot(self) -> t.List[bytes]:
+        """
+        Thread-safe copy of the buffered logs as encoded JSON lines
+        """
+        with self._lock:
+            return list(self._buffer)
+
+    @property
+    def logs(self) -> t.List[JSONType]:
+        return self.snapshot()
+
+    @property
+    def size(self) -> int:
+        """
+        Total size of the buffered encoded logs in bytes
+        """
+        return self._size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buffer.clear()
+            self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer)
 
 
 class NullOutput(OutputBase):
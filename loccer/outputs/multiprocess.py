@@ -0,0 +1,350 @@
+"""
+Multi-process safe file output for pre-fork servers such as gunicorn
+
+Every record is written with a single `os.write` into a file opened with `O_APPEND`, so records of different
+processes never interleave. Processes coordinate via `fcntl.flock` on a `<filename>.lock` file: writers hold
+a shared lock while writing, rotation and merging of the segments take the exclusive lock only for the renames.
+Writers compare the inode of their open file with the path under the shared lock and re-open the file
+after it has been rotated by another process.
+
+In the segments mode every process writes into its own `<filename>.<pid>.segment` file and the segments are
+merged into the main log file by `merge_segments` (or `python -m loccer merge`), sorted by the timestamp.
+"""
+import atexit
+import contextlib
+import glob
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+import typing as t
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from ..bases import OutputBase, LoccerOutput
+from .file_stream import encode_line_bytes, COMPRESSED_DUMP_KWARGS, INDENTED_DUMP_KWARGS
+
+
+SEGMENT_SUFFIX = ".segment"
+FILE_MODE = 0o644
+
+
+class MultiProcessFileOutput(OutputBase):
+    def __init__(
+        self,
+        filename: str,
+        compressed: bool = True,
+        max_size: int = ((2**20)*10),
+        max_files: int = 10,
+        *,
+        segments: bool = False,
+        fsync: bool = False,
+    ):
+        """
+        JSON lines output into a file shared by multiple processes, see `loccer.outputs.multiprocess`
+
+        :param filename: Path to the log file, `<filename>.lock` is created next to it
+        :param compressed: Flag to turn on compressed json output stripping unnecessary whitespaces
+        :param max_size: Maximum log size before the file is rotated, set to 0 to disable file rotation
+        :param max_files: Maximum number of compressed log backups to keep when rotating files
+        :param segments: Write into a per-process segment file instead, segment is merged into the main file when it reaches `max_size`
+        :param fsync: Call `os.fsync` after every written record
+        """
+        if fcntl is None:
+            raise RuntimeError("Multi-process file output requires `fcntl` which is not available on this platform")
+
+        if max_size < 0:
+            raise ValueError("Max size must be 0 or greater number")
+
+        if max_files < 0:
+            raise ValueError("Max files must be 0 or greater number")
+
+        self.filename = filename
+        self.compressed = compressed
+        self.max_size = max_size
+        self.max_files = max_files
+        self.segments = segments
+        self.fsync = fsync
+        self.bytes_written = 0  #: Size of the records written by this process
+
+        self._lock = threading.Lock()
+        self._fd: t.Optional[int] = None
+        self._lock_fd: t.Optional[int] = None
+        self._file_id: t.Optional[t.Tuple[int, int]] = None
+        self._pid = os.getpid()
+
+        _INSTANCES.add(self)
+        atexit.register(self.close)
+
+    @property
+    def path(self) -> str:
+        """
+        File the current process writes into
+        """
+        if self.segments:
+            return segment_name(self.filename, os.getpid())
+        return self.filename
+
+    def output(self, exc: LoccerOutput) -> None:
+        data = encode_line_bytes(exc, COMPRESSED_DUMP_KWARGS if self.compressed else INDENTED_DUMP_KWARGS)
+
+        with self._lock:
+            self._ensure_open()
+
+            with _flock(self._lock_fd, fcntl.LOCK_SH):
+                self._reopen_if_moved()
+                _write_all(self._fd, data)
+                if self.fsync:
+                    os.fsync(self._fd)
+                size = os.fstat(self._fd).st_size
+
+            self.bytes_written += len(data)
+
+        if self.max_size and size >= self.max_size:
+            if self.segments:
+                merge_segments(self.filename, max_size=self.max_size, max_files=self.max_files, pids=(os.getpid(),))
+            else:
+                rotate_shared(self.filename, self.max_size, self.max_files)
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_fds()
+        atexit.unregister(self.close)
+
+    def _ensure_open(self) -> None:
+        if self._pid != os.getpid():
+            self._after_fork()
+
+        if self._lock_fd is None:
+            self._lock_fd = _open_lock(self.filename)
+
+        if self._fd is None:
+            self._open()
+
+    def _open(self) -> None:
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, FILE_MODE)
+        fstat = os.fstat(self._fd)
+        self._file_id = (fstat.st_dev, fstat.st_ino)
+
+    def _reopen_if_moved(self) -> None:
+        # Called under the shared lock, renames are done only under the exclusive lock
+        try:
+            fstat = os.stat(self.path)
+            moved = (fstat.st_dev, fstat.st_ino) != self._file_id
+        except FileNotFoundError:
+            moved = True
+
+        if moved:
+            os.close(self._fd)
+            self._open()
+
+    def _close_fds(self) -> None:
+        for fd in (self._fd, self._lock_fd):
+            if fd is not None:
+                os.close(fd)
+
+        self._fd = None
+        self._lock_fd = None
+        self._file_id = None
+
+    def _after_fork(self) -> None:
+        # Descriptors are shared with the parent, the child opens its own (and its own segment in the segments mode)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._close_fds()
+
+
+_INSTANCES: "weakref.WeakSet[MultiProcessFileOutput]" = weakref.WeakSet()
+
+
+def _reset_instances() -> None:
+    for x in _INSTANCES:
+        x._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_instances)
+
+
+def segment_name(filename: str, pid: int) -> str:
+    return f"{filename}.{pid}{SEGMENT_SUFFIX}"
+
+
+def rotate_shared(filename: str, max_size: int, max_files: int = 10) -> bool:
+    """
+    Rotate the log file shared by multiple processes if it reached the max size
+
+    Live file is renamed under the exclusive lock, compression runs without holding the lock
+    so the writers are blocked only for the duration of the renames.
+
+    :return: True if the file has been rotated by this call
+    """
+    lock_fd = _open_lock(filename)
+    try:
+        with _flock(lock_fd, fcntl.LOCK_EX):
+            try:
+                if os.stat(filename).st_size < max_size:
+                    # Already rotated by another process
+                    return False
+            except FileNotFoundError:
+                return False
+
+            segment = f"{filename}.{os.getpid()}.{time.time_ns()}.rotating"
+            os.replace(filename, segment)
+            os.close(os.open(filename, os.O_WRONLY | os.O_CREAT, FILE_MODE))
+
+        if max_files > 0:
+            tmp_fname = f"{segment}.gz.tmp"
+            with open(segment, "rb") as f_in, gzip.open(tmp_fname, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+
+            with _flock(lock_fd, fcntl.LOCK_EX):
+                for fnum in reversed(range(max_files-1)):
+                    this_fname = f"{filename}.{fnum}.gz"
+                    if os.path.exists(this_fname):
+                        os.replace(this_fname, f"{filename}.{fnum+1}.gz")
+
+                os.replace(tmp_fname, f"{filename}.0.gz")
+
+        os.remove(segment)
+        return True
+    finally:
+        os.close(lock_fd)
+
+
+def merge_segments(
+    filename: str,
+    *,
+    max_size: int = 0,
+    max_files: int = 10,
+    pids: t.Optional[t.Iterable[int]] = None,
+    sort: bool = True,
+) -> int:
+    """
+    Merge per-process segment files into the main log file and remove them
+
+    Segments are renamed under the exclusive lock so processes still writing into them start a fresh segment.
+
+    :param filename: Path to the main log file
+    :param max_size: Rotate the main file after the merge if it reached this size, 0 to disable the rotation
+    :param max_files: Maximum number of compressed log backups to keep when rotating files
+    :param pids: Merge only the segments of these processes, None to merge all of them
+    :param sort: Order the merged records by their timestamp
+    :return: Number of merged records
+    """
+    if pids is None:
+        segments = glob.glob(glob.escape(filename) + ".*" + SEGMENT_SUFFIX)
+    else:
+        segments = [segment_name(filename, pid) for pid in pids]
+
+    lock_fd = _open_lock(filename)
+    try:
+        merging = []
+        with _flock(lock_fd, fcntl.LOCK_EX):
+            for segment in segments:
+                target = f"{segment}.{os.getpid()}.{time.time_ns()}.merging"
+                try:
+                    os.replace(segment, target)
+                except FileNotFoundError:
+                    continue
+                merging.append(target)
+
+        if pids is None:
+            # Leftovers of merges interrupted by the death of the merging process
+            merging.extend(
+                x for x in glob.glob(glob.escape(filename) + ".*" + SEGMENT_SUFFIX + ".*.merging")
+                if x not in merging and not _pid_alive(int(x.rsplit(".", 3)[1]))
+            )
+
+        records = []
+        for segment in merging:
+            with open(segment, "rb") as fd:
+                records.extend(_read_records(fd))
+
+        if sort:
+            records.sort(key=_record_timestamp)
+
+        if records:
+            with _flock(lock_fd, fcntl.LOCK_EX):
+                fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, FILE_MODE)
+                try:
+                    _write_all(fd, b"".join(records))
+                finally:
+                    os.close(fd)
+
+        for segment in merging:
+            os.remove(segment)
+    finally:
+        os.close(lock_fd)
+
+    if max_size:
+        rotate_shared(filename, max_size, max_files)
+
+    return len(records)
+
+
+def _read_records(fd: t.BinaryIO) -> t.Iterator[bytes]:
+    """
+    Split the segment into records, indented records spanning multiple lines are kept together
+    """
+    # Lines of the indented (multi line) record that is being read
+    chunk: t.List[bytes] = []
+
+    for line in fd:
+        if not line.strip():
+            continue
+        if not line.endswith(b"\n"):
+            line += b"\n"
+
+        # Every record starts at the beginning of the line with its top level object, nested lines are indented
+        if line.startswith(b"{") and chunk:
+            yield b"".join(chunk)
+            chunk = []
+        chunk.append(line)
+
+    if chunk:
+        yield b"".join(chunk)
+
+
+def _record_timestamp(record: bytes) -> str:
+    try:
+        return json.loads(record).get("timestamp") or ""
+    except (ValueError, AttributeError):
+        return ""
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _open_lock(filename: str) -> int:
+    return os.open(f"{filename}.lock", os.O_RDWR | os.O_CREAT, FILE_MODE)
+
+
+@contextlib.contextmanager
+def _flock(fd: int, operation: int) -> t.Iterator[None]:
+    fcntl.flock(fd, operation)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    # Regular files are written in full by a single call, the loop only guards against a signal interruption
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
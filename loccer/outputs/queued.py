@@ -0,0 +1,208 @@
+import atexit
+import collections
+import os
+import threading
+import time
+import typing as t
+import weakref
+
+from ..bases import OutputBase, LoccerOutput
+
+
+OVERFLOW_POLICIES = ("block", "drop_newest", "drop_oldest")
+#: Seconds the idle writer thread waits for new logs before exiting, it's started again by the next log
+WRITER_IDLE_TIMEOUT = 1.0
+
+
+class QueuedOutput(OutputBase):
+    def __init__(
+        self,
+        handler: OutputBase,
+        max_size: int = 1000,
+        overflow: str = "drop_newest",
+        block_timeout: t.Optional[float] = None,
+        close_timeout: t.Optional[float] = 5.0,
+    ):
+        """
+        Wraps an output handler and moves the actual output into a dedicated writer thread
+        The exception hook only appends the log into a bounded queue so a slow output can't stall the caller
+
+        :param handler: Output handler that would be called from the writer thread
+        :param max_size: Maximum number of logs waiting in the queue
+        :param overflow: Policy when the queue is full; `block` the caller, `drop_newest` log or `drop_oldest` queued log
+        :param block_timeout: Maximum time in seconds to block the caller with the `block` policy, log is dropped afterwards
+        :param close_timeout: Maximum time in seconds to wait for the queue to drain when closing the output
+        """
+        if max_size < 1:
+            raise ValueError("Max size must be 1 or greater number")
+
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy `{overflow}`, must be one of {', '.join(OVERFLOW_POLICIES)}")
+
+        self.handler = handler
+        self.max_size = max_size
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.close_timeout = close_timeout
+
+        self.dropped = 0  #: Number of logs that has been dropped due to the full queue
+        self.processed = 0  #: Number of logs passed to the wrapped output handler
+        self.errors = 0  #: Number of errors raised by the wrapped output handler
+        self.last_error: t.Optional[BaseException] = None
+
+        self._queue: t.Deque[LoccerOutput] = collections.deque()
+        self._cond = threading.Condition()
+        self._pending = 0  # queued logs + log currently being processed by the writer
+        self._closed = False
+        self._thread: t.Optional[threading.Thread] = None
+        self._pid = os.getpid()
+
+        # Weakly referenced so outputs that are no longer used are not kept alive until the interpreter exits
+        _INSTANCES.add(self)
+
+    def output(self, exc: LoccerOutput) -> None:
+        if self._closed:
+            # Interpreter is shutting down or the output has been closed, there is no writer thread anymore
+            self._process(exc)
+            return
+
+        if self._pid != os.getpid():
+            self._after_fork()
+
+        with self._cond:
+            self._ensure_thread()
+
+            if len(self._queue) >= self.max_size:
+                if self.overflow == "drop_newest":
+                    self.dropped += 1
+                    return
+                elif self.overflow == "drop_oldest":
+                    self._queue.popleft()
+                    self._pending -= 1
+                    self.dropped += 1
+                else:
+                    deadline = None if self.block_timeout is None else (time.monotonic() + self.block_timeout)
+                    while len(self._queue) >= self.max_size and not self._closed:
+                        remaining = None if deadline is None else (deadline - time.monotonic())
+                        if remaining is not None and remaining <= 0:
+                            self.dropped += 1
+                            return
+                        self._cond.wait(remaining)
+
+            self._queue.append(exc)
+            self._pending += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout: t.Optional[float] = None) -> bool:
+        """
+        Wait until all queued logs are processed by the writer thread
+
+        :param timeout: Maximum time to wait in seconds, None to wait indefinitely
+        :return: True if the queue has been fully drained
+        """
+        deadline = None if timeout is None else (time.monotonic() + timeout)
+
+        if self._pid != os.getpid():
+            self._after_fork()
+
+        with self._cond:
+            while self._pending and self._thread is not None and self._thread.is_alive():
+                remaining = None if deadline is None else (deadline - time.monotonic())
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+            drained = (self._pending == 0)
+
+        self.handler.flush()
+        return drained
+
+    def close(self) -> None:
+        """
+        Drain the queue, stop the writer thread and close the wrapped output handler
+        Called at the interpreter exit for outputs still alive so logs queued at the shutdown are not lost
+        """
+        if self._closed:
+            return
+
+        self.flush(timeout=self.close_timeout)
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(self.close_timeout)
+
+        _INSTANCES.discard(self)
+        self.handler.close()
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="loccer-queued-output", daemon=True)
+            self._thread.start()
+
+    def _after_fork(self) -> None:
+        # Threads do not survive fork and the condition might have been held by one of them,
+        # logs queued by the parent process are discarded in the child
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._pending = 0
+        self._thread = None
+        self._pid = os.getpid()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._queue and not self._closed:
+                    # Idle thread exits so it does not keep the output alive, the next log starts it again
+                    if not self._cond.wait_for(lambda: self._queue or self._closed, WRITER_IDLE_TIMEOUT):
+                        if self._thread is threading.current_thread():
+                            self._thread = None
+                        return
+
+                if not self._queue:
+                    return
+
+                exc = self._queue.popleft()
+                # Wake up callers blocked on the full queue
+                self._cond.notify_all()
+
+            try:
+                self._process(exc)
+            finally:
+                with self._cond:
+                    self._pending -= 1
+                    self._cond.notify_all()
+
+    def _process(self, exc: LoccerOutput) -> None:
+        try:
+            self.handler.output(exc)
+            self.processed += 1
+        except Exception as err:
+            self.errors += 1
+            self.last_error = err
+
+
+_INSTANCES: "weakref.WeakSet[QueuedOutput]" = weakref.WeakSet()
+
+
+def _close_instances() -> None:
+    for x in list(_INSTANCES):
+        x.close()
+
+
+def _reset_instances() -> None:
+    for x in _INSTANCES:
+        x._after_fork()
+
+
+atexit.register(_close_instances)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_instances)
@@ -0,0 +1,197 @@
+import atexit
+import collections
+import os
+import socket
+import threading
+import time
+import typing as t
+import weakref
+
+from ..bases import OutputBase, LoccerOutput
+from ..collector import HEADER, DEFAULT_SOCKET_PATH
+from .file_stream import encode_line_bytes, COMPRESSED_DUMP_KWARGS
+
+
+class SocketOutput(OutputBase):
+    def __init__(
+        self,
+        socket_path: str = DEFAULT_SOCKET_PATH,
+        spill_max_events: int = 1000,
+        spill_max_bytes: int = 2**24,
+        reconnect_interval: float = 1.0,
+        close_timeout: float = 1.0,
+    ):
+        """
+        Send the logs to the local collector (`python -m loccer collect`) over the Unix domain socket
+
+        Socket is non-blocking, logs that can't be sent right away (collector is down or the socket buffer is full)
+        are kept in the in-memory spill buffer and sent with the next log or on `flush`.
+
+        :param socket_path: Path of the collector socket
+        :param spill_max_events: Maximum number of logs kept in the spill buffer, further logs are dropped
+        :param spill_max_bytes: Maximum size in bytes of the spill buffer, further logs are dropped
+        :param reconnect_interval: Minimum time in seconds between the connection attempts when the collector is down
+        :param close_timeout: Maximum time in seconds to wait for the spilled logs to be sent when closing the output
+        """
+        self.socket_path = socket_path
+        self.spill_max_events = spill_max_events
+        self.spill_max_bytes = spill_max_bytes
+        self.reconnect_interval = reconnect_interval
+        self.close_timeout = close_timeout
+
+        self.sent = 0  #: Number of logs sent to the collector
+        self.dropped = 0  #: Number of logs dropped due to the full spill buffer
+        self.bytes_written = 0  #: Size of the data sent to the collector
+
+        self._lock = threading.Lock()
+        self._sock: t.Optional[socket.socket] = None
+        self._next_connect = 0.0
+        self._spill: t.Deque[t.Union[bytes, memoryview]] = collections.deque()
+        self._spilled = 0
+        self._partial = False  # first frame in the spill buffer has been partially sent
+        self._pid = os.getpid()
+        _INSTANCES.add(self)
+        atexit.register(self.close)
+
+    def output(self, exc: LoccerOutput) -> None:
+        payload = encode_line_bytes(exc, COMPRESSED_DUMP_KWARGS)
+        header = HEADER.pack(len(payload))
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._after_fork()
+
+            sent = 0
+            if self._spill:
+                self._drain()
+
+            if not self._spill and self._connect():
+                sent = self._send((header, payload))
+                if sent == len(header) + len(payload):
+                    self.sent += 1
+                    return
+
+            frame = memoryview(header + payload)[sent:]
+            if sent:
+                # Remainder of a partially sent frame is always kept, dropping it would corrupt the stream
+                self._partial = True
+            elif len(self._spill) >= self.spill_max_events or self._spilled + len(frame) > self.spill_max_bytes:
+                self.dropped += 1
+                return
+
+            self._spill.append(frame)
+            self._spilled += len(frame)
+
+    def flush(self, timeout: float = 1.0) -> bool:
+        """
+        Try to send the spilled logs to the collector
+
+        :param timeout: Maximum time in seconds to wait for the collector to accept the logs
+        :return: True if the spill buffer has been fully sent
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._drain(force_connect=True)
+                if not self._spill or time.monotonic() >= deadline:
+                    return not self._spill
+            # Lock is released while waiting so the concurrent `output` calls are not stalled
+            time.sleep(0.01)
+
+    def close(self) -> None:
+        self.flush(timeout=self.close_timeout)
+        with self._lock:
+            self._disconnect()
+        atexit.unregister(self.close)
+
+    @property
+    def spilled(self) -> int:
+        """
+        Number of logs waiting in the spill buffer
+        """
+        return len(self._spill)
+
+    def _connect(self, force: bool = False) -> bool:
+        if self._sock is not None:
+            return True
+
+        now = time.monotonic()
+        if not force and now < self._next_connect:
+            return False
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Non-blocking connect, full listen backlog of the collector fails with EAGAIN and the log is spilled
+        sock.setblocking(False)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            # Includes BlockingIOError (EAGAIN/EINPROGRESS), connection is retried after the reconnect interval
+            sock.close()
+            self._next_connect = now + self.reconnect_interval
+            return False
+
+        self._sock = sock
+        return True
+
+    def _send(self, buffers: t.Sequence[t.Union[bytes, memoryview]]) -> int:
+        try:
+            sent = self._sock.sendmsg(buffers)
+            self.bytes_written += sent
+            return sent
+        except BlockingIOError:
+            return 0
+        except OSError:
+            # Collector went away, logs are spilled until it's back
+            self._disconnect()
+            self._next_connect = time.monotonic() + self.reconnect_interval
+            return 0
+
+    def _drain(self, force_connect: bool = False) -> None:
+        while self._spill and self._connect(force=force_connect):
+            frame = memoryview(self._spill[0])
+            sent = self._send((frame,))
+            if sent == len(frame):
+                self._spill.popleft()
+                self._spilled -= len(frame)
+                self._partial = False
+                self.sent += 1
+            else:
+                if sent:
+                    self._spill[0] = frame[sent:]
+                    self._spilled -= sent
+                    self._partial = True
+                return
+
+    def _disconnect(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+            # Remainder of a partially sent frame can't be completed on a new connection
+            if self._partial:
+                self._spilled -= len(self._spill.popleft())
+                self._partial = False
+                self.dropped += 1
+
+    def _after_fork(self) -> None:
+        # Connection and spilled logs belong to the parent process
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._spill.clear()
+        self._spilled = 0
+        self._partial = False
+
+
+_INSTANCES: "weakref.WeakSet[SocketOutput]" = weakref.WeakSet()
+
+
+def _reset_instances() -> None:
+    for x in _INSTANCES:
+        x._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_instances)
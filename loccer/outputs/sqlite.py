@@ -0,0 +1,533 @@
+"""
+SQLite output with batched inserts from a writer thread
+
+Schema is normalized so the common lookups are served by indexes:
+
+- `exc_types` - unique exception type names
+- `fingerprints` - unique exception fingerprints with the occurrence count and first/last seen timestamps
+- `frames` - unique (filename, lineno, name) frames, linked to the events via `event_frames`
+- `events` - one row per log with the timestamp, type references and the full JSON payload,
+  payloads larger than the `compress_threshold` are stored zlib compressed
+"""
+import atexit
+import collections
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing as t
+import zlib
+
+from ..bases import OutputBase, LoccerOutput
+from ..ltypes import JSONType
+from .file_stream import encode_line_bytes, COMPRESSED_DUMP_KWARGS
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exc_types (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL UNIQUE,
+    exc_type_id INTEGER REFERENCES exc_types(id),
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS frames (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL,
+    lineno INTEGER,
+    name TEXT NOT NULL,
+    UNIQUE (filename, lineno, name)
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    loccer_type TEXT NOT NULL,
+    exc_type_id INTEGER REFERENCES exc_types(id),
+    fingerprint_id INTEGER REFERENCES fingerprints(id),
+    msg TEXT,
+    size INTEGER NOT NULL,
+    compressed INTEGER NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS event_frames (
+    event_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    frame_id INTEGER NOT NULL,
+    PRIMARY KEY (event_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp);
+CREATE INDEX IF NOT EXISTS events_exc_type ON events (exc_type_id, timestamp);
+CREATE INDEX IF NOT EXISTS events_fingerprint ON events (fingerprint_id, timestamp);
+CREATE INDEX IF NOT EXISTS event_frames_frame ON event_frames (frame_id);
+CREATE INDEX IF NOT EXISTS frames_name ON frames (name);
+"""
+
+CACHE_SIZE = 10000  # Maximum number of cached ids of the normalized rows
+
+
+class SQLiteOutput(OutputBase):
+    def __init__(
+        self,
+        filename: str,
+        batch_size: int = 500,
+        max_queue: int = 10000,
+        compress_threshold: int = 1024,
+        max_events: t.Optional[int] = None,
+        max_age: t.Optional[float] = None,
+        max_bytes: t.Optional[int] = None,
+        prune_interval: float = 60.0,
+        close_timeout: t.Optional[float] = 5.0,
+    ):
+        """
+        Store the logs into the SQLite database, see `loccer.outputs.sqlite` for the schema
+
+        Logs are queued and inserted by a dedicated writer thread in batches, each batch in a single transaction.
+        Database is opened in the WAL mode so it can be queried while the logs are being written.
+
+        :param filename: Path to the SQLite database file
+        :param batch_size: Maximum number of logs inserted in a single transaction
+        :param max_queue: Maximum number of logs waiting to be inserted, further logs are dropped
+        :param compress_threshold: Payloads larger than this number of bytes are stored zlib compressed
+        :param max_events: Prune the oldest events above this count, None for no limit
+        :param max_age: Prune events older than this number of seconds, None for no limit
+        :param max_bytes: Prune the oldest events when the uncompressed size of payloads exceeds this limit, None for no limit
+        :param prune_interval: Minimum time in seconds between the pruning runs
+        :param close_timeout: Maximum time in seconds to wait for the queue to drain when closing the output
+        """
+        if batch_size < 1:
+            raise ValueError("Batch size must be 1 or greater number")
+
+        if max_queue < 1:
+            raise ValueError("Max queue must be 1 or greater number")
+
+        self.filename = filename
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.compress_threshold = compress_threshold
+        self.max_events = max_events
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.prune_interval = prune_interval
+        self.close_timeout = close_timeout
+
+        self.dropped = 0  #: Number of logs that has been dropped due to the full queue or a closed output
+        self.inserted = 0  #: Number of logs inserted into the database
+        self.pruned = 0  #: Number of events removed by the pruning
+        self.errors = 0  #: Number of logs that failed to be inserted
+        self.last_error: t.Optional[BaseException] = None
+
+        self._queue: t.Deque[LoccerOutput] = collections.deque()
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._closed = False
+        self._thread: t.Optional[threading.Thread] = None
+        self._pid = os.getpid()
+        self._last_prune = 0.0
+        # Incremented whenever pruning removes the normalized rows, the writer then drops its cached ids
+        self._prune_generation = 0
+
+        # Writer thread only
+        self._conn: t.Optional[sqlite3.Connection] = None
+        self._type_ids: t.Dict[str, int] = {}
+        self._fingerprint_ids: t.Dict[str, int] = {}
+        self._frame_ids: t.Dict[t.Tuple[str, t.Optional[int], str], int] = {}
+        self._cache_generation = 0
+
+        # Create the schema upfront so the database can be queried right away
+        connect(filename).close()
+        atexit.register(self.close)
+
+    def output(self, exc: LoccerOutput) -> None:
+        with self._cond:
+            if self._closed:
+                self.dropped += 1
+                return
+
+            self._ensure_thread()
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return
+
+            self._queue.append(exc)
+            self._pending += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout: t.Optional[float] = None) -> bool:
+        """
+        Wait until all queued logs are inserted
+
+        :param timeout: Maximum time to wait in seconds, None to wait indefinitely
+        :return: True if the queue has been fully drained
+        """
+        deadline = None if timeout is None else (time.monotonic() + timeout)
+
+        with self._cond:
+            while self._pending and self._thread is not None and self._thread.is_alive():
+                remaining = None if deadline is None else (deadline - time.monotonic())
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+            return self._pending == 0
+
+    def close(self) -> None:
+        if self._closed:
+            return
+
+        self.flush(timeout=self.close_timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(self.close_timeout)
+
+        atexit.unregister(self.close)
+
+    def query(self, **kwargs) -> t.List[JSONType]:
+        """
+        Query the stored logs, see `loccer.outputs.sqlite.query` for the arguments
+        Logs still waiting in the queue are not included, call `flush` first if needed
+        """
+        return list(query(self.filename, **kwargs))
+
+    def prune(self) -> int:
+        """
+        Remove the events exceeding the `max_events`, `max_age` or `max_bytes` limits
+
+        :return: Number of removed events
+        """
+        conn = connect(self.filename)
+        try:
+            return self._prune(conn)
+        finally:
+            conn.close()
+
+    def _ensure_thread(self) -> None:
+        pid = os.getpid()
+        if pid != self._pid:
+            # Threads and connections do not survive fork, logs queued by the parent are discarded in the child
+            self._pid = pid
+            self._queue.clear()
+            self._pending = 0
+            self._thread = None
+            self._conn = None
+
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="loccer-sqlite-output", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+
+                if not self._queue:
+                    if self._conn is not None:
+                        self._conn.close()
+                        self._conn = None
+                    return
+
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+
+            try:
+                self._insert_batch(batch)
+                try:
+                    self._maybe_prune()
+                except Exception as err:
+                    self.last_error = err
+            finally:
+                with self._cond:
+                    self._pending -= len(batch)
+                    self._cond.notify_all()
+
+    def _insert_batch(self, batch: t.List[LoccerOutput]) -> None:
+        try:
+            self._insert(batch)
+            return
+        except Exception as err:
+            self.last_error = err
+            # Cached ids might refer to rows of the rolled back transaction
+            self._clear_caches()
+
+        if len(batch) == 1:
+            self.errors += 1
+            return
+
+        # A single malformed log must not drop the whole batch, insert the logs one by one instead
+        for exc in batch:
+            try:
+                self._insert([exc])
+            except Exception as err:
+                self.errors += 1
+                self.last_error = err
+                self._clear_caches()
+
+    def _insert(self, batch: t.List[LoccerOutput]) -> None:
+        if self._conn is None:
+            self._conn = connect(self.filename)
+
+        cur = self._conn.cursor()
+        # Immediate transaction waits for a pruning run in progress so the generation check below is reliable
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            if self._cache_generation != self._prune_generation:
+                self._clear_caches()
+                self._cache_generation = self._prune_generation
+
+            for exc in batch:
+                self._insert_log(cur, exc)
+            cur.execute("COMMIT")
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+
+        self.inserted += len(batch)
+
+    def _insert_log(self, cur: sqlite3.Cursor, exc: LoccerOutput) -> None:
+        data = exc.cached_json()
+        payload = encode_line_bytes(exc, COMPRESSED_DUMP_KWARGS).rstrip()
+        size = len(payload)
+
+        compressed = size > self.compress_threshold
+        if compressed:
+            payload = zlib.compress(payload)
+
+        timestamp = data.get("timestamp") or exc.ts.isoformat()
+        exc_type = data.get("exc_type")
+        type_id = self._type_id(cur, exc_type) if exc_type else None
+
+        fingerprint_id = None
+        fingerprint = data.get("fingerprint")
+        if fingerprint:
+            fingerprint_id = self._fingerprint_id(cur, fingerprint, type_id, timestamp)
+
+        cur.execute(
+            "INSERT INTO events (timestamp, loccer_type, exc_type_id, fingerprint_id, msg, size, compressed, payload) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (timestamp, data.get("loccer_type", ""), type_id, fingerprint_id, data.get("msg"), size, int(compressed), payload)
+        )
+        event_id = cur.lastrowid
+
+        frames = data.get("frames")
+        if frames:
+            cur.executemany(
+                "INSERT INTO event_frames (event_id, position, frame_id) VALUES (?, ?, ?)",
+                [
+                    (event_id, pos, self._frame_id(cur, (frame["filename"], frame["lineno"], frame["name"])))
+                    for pos, frame in enumerate(frames)
+                ]
+            )
+
+    def _type_id(self, cur: sqlite3.Cursor, name: str) -> int:
+        type_id = self._type_ids.get(name)
+        if type_id is None:
+            cur.execute("INSERT OR IGNORE INTO exc_types (name) VALUES (?)", (name,))
+            type_id = cur.execute("SELECT id FROM exc_types WHERE name = ?", (name,)).fetchone()[0]
+            _cache(self._type_ids, name, type_id)
+        return type_id
+
+    def _fingerprint_id(self, cur: sqlite3.Cursor, fingerprint: str, type_id: t.Optional[int], timestamp: str) -> int:
+        fingerprint_id = self._fingerprint_ids.get(fingerprint)
+        if fingerprint_id is None:
+            cur.execute(
+                "INSERT OR IGNORE INTO fingerprints (fingerprint, exc_type_id, first_seen, last_seen) VALUES (?, ?, ?, ?)",
+                (fingerprint, type_id, timestamp, timestamp)
+            )
+            fingerprint_id = cur.execute("SELECT id FROM fingerprints WHERE fingerprint = ?", (fingerprint,)).fetchone()[0]
+            _cache(self._fingerprint_ids, fingerprint, fingerprint_id)
+
+        cur.execute(
+            "UPDATE fingerprints SET count = count + 1, last_seen = MAX(last_seen, ?) WHERE id = ?",
+            (timestamp, fingerprint_id)
+        )
+        return fingerprint_id
+
+    def _frame_id(self, cur: sqlite3.Cursor, key: t.Tuple[str, t.Optional[int], str]) -> int:
+        frame_id = self._frame_ids.get(key)
+        if frame_id is None:
+            cur.execute("INSERT OR IGNORE INTO frames (filename, lineno, name) VALUES (?, ?, ?)", key)
+            frame_id = cur.execute(
+                "SELECT id FROM frames WHERE filename = ? AND lineno IS ? AND name = ?", key
+            ).fetchone()[0]
+            _cache(self._frame_ids, key, frame_id)
+        return frame_id
+
+    def _clear_caches(self) -> None:
+        self._type_ids.clear()
+        self._fingerprint_ids.clear()
+        self._frame_ids.clear()
+
+    def _maybe_prune(self) -> None:
+        if self.max_events is None and self.max_age is None and self.max_bytes is None:
+            return
+
+        now = time.monotonic()
+        if (now - self._last_prune) < self.prune_interval:
+            return
+
+        self._last_prune = now
+        self._prune(self._conn)
+
+    def _prune(self, conn: sqlite3.Connection) -> int:
+        # Count and size limits remove the oldest inserted events up to the cutoff id
+        cutoffs = []
+
+        if self.max_events is not None:
+            row = conn.execute(
+                "SELECT id FROM events ORDER BY id DESC LIMIT 1 OFFSET ?", (self.max_events - 1,)
+            ).fetchone()
+            if row:
+                cutoffs.append(row[0] - 1)
+
+        if self.max_bytes is not None:
+            row = conn.execute(
+                "SELECT MAX(id) FROM (SELECT id, SUM(size) OVER (ORDER BY id DESC) AS total FROM events) WHERE total > ?",
+                (self.max_bytes,)
+            ).fetchone()
+            if row and row[0] is not None:
+                cutoffs.append(row[0])
+
+        removed = 0
+        with conn:
+            if cutoffs:
+                removed += _delete_events(conn, "id <= ?", (max(cutoffs),))
+
+            if self.max_age is not None:
+                limit = (datetime.datetime.utcnow() - datetime.timedelta(seconds=self.max_age)).isoformat()
+                removed += _delete_events(conn, "timestamp < ?", (limit,))
+
+            if removed:
+                # Ids cached by the writer might point to the orphaned rows removed below
+                self._prune_generation += 1
+                conn.execute(
+                    "DELETE FROM fingerprints WHERE NOT EXISTS (SELECT 1 FROM events WHERE fingerprint_id = fingerprints.id)"
+                )
+                conn.execute(
+                    "DELETE FROM frames WHERE NOT EXISTS (SELECT 1 FROM event_frames WHERE frame_id = frames.id)"
+                )
+
+        self.pruned += removed
+        return removed
+
+
+def _delete_events(conn: sqlite3.Connection, where: str, params: t.Tuple[t.Any, ...]) -> int:
+    # Occurrence counts of the fingerprints are kept in sync with the remaining events
+    conn.execute(
+        f"UPDATE fingerprints SET count = count - "
+        f"(SELECT COUNT(*) FROM events WHERE fingerprint_id = fingerprints.id AND {where}) "
+        f"WHERE id IN (SELECT fingerprint_id FROM events WHERE {where})",
+        params + params
+    )
+    conn.execute(f"DELETE FROM event_frames WHERE event_id IN (SELECT id FROM events WHERE {where})", params)
+    return conn.execute(f"DELETE FROM events WHERE {where}", params).rowcount
+
+
+def _cache(cache: t.Dict, key: t.Hashable, value: int) -> None:
+    if len(cache) >= CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+
+
+def connect(filename: str) -> sqlite3.Connection:
+    """
+    Open the loccer SQLite database in the WAL mode, schema is created if it does not exist yet
+    """
+    conn = sqlite3.connect(filename, isolation_level=None, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def query(
+    filename: str,
+    since: t.Union[None, str, datetime.datetime] = None,
+    until: t.Union[None, str, datetime.datetime] = None,
+    exc_type: t.Optional[str] = None,
+    fingerprint: t.Optional[str] = None,
+    loccer_type: t.Optional[str] = None,
+    frame_name: t.Optional[str] = None,
+    limit: t.Optional[int] = None,
+) -> t.Iterator[JSONType]:
+    """
+    Lazily read the logs from the SQLite database ordered by time, all filters are served by indexes
+
+    :param filename: Path to the SQLite database file
+    :param since: Return logs at or after this time
+    :param until: Return logs at or before this time
+    :param exc_type: Name of the exception type
+    :param fingerprint: Exception fingerprint
+    :param loccer_type: Loccer type of the log, for example `exception` or `metadata_log`
+    :param frame_name: Return only exceptions with a frame of the function with this name in the traceback
+    :param limit: Maximum number of returned logs
+    """
+    sql, params = _build_query(since, until, exc_type, fingerprint, loccer_type, frame_name, limit)
+
+    conn = connect(filename)
+    try:
+        for compressed, payload in conn.execute(sql, params):
+            if compressed:
+                payload = zlib.decompress(payload)
+            yield json.loads(payload)
+    finally:
+        conn.close()
+
+
+def _build_query(
+    since: t.Union[None, str, datetime.datetime],
+    until: t.Union[None, str, datetime.datetime],
+    exc_type: t.Optional[str],
+    fingerprint: t.Optional[str],
+    loccer_type: t.Optional[str],
+    frame_name: t.Optional[str],
+    limit: t.Optional[int],
+) -> t.Tuple[str, t.List[t.Any]]:
+    conditions = []
+    params: t.List[t.Any] = []
+
+    if since is not None:
+        conditions.append("e.timestamp >= ?")
+        params.append(since.isoformat() if isinstance(since, datetime.datetime) else since)
+
+    if until is not None:
+        conditions.append("e.timestamp <= ?")
+        params.append(until.isoformat() if isinstance(until, datetime.datetime) else until)
+
+    if exc_type is not None:
+        conditions.append("e.exc_type_id = (SELECT id FROM exc_types WHERE name = ?)")
+        params.append(exc_type)
+
+    if fingerprint is not None:
+        conditions.append("e.fingerprint_id = (SELECT id FROM fingerprints WHERE fingerprint = ?)")
+        params.append(fingerprint)
+
+    if loccer_type is not None:
+        conditions.append("e.loccer_type = ?")
+        params.append(loccer_type)
+
+    if frame_name is not None:
+        conditions.append(
+            "e.id IN (SELECT ef.event_id FROM event_frames ef JOIN frames f ON f.id = ef.frame_id WHERE f.name = ?)"
+        )
+        params.append(frame_name)
+
+    sql = "SELECT e.compressed, e.payload FROM events e"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY e.timestamp, e.id"
+
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    return sql, params
@@ -0,0 +1,295 @@
+import datetime
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import re
+import typing as t
+
+from .ltypes import JSONType
+
+
+INDEX_VERSION = 2
+
+INDEX_SUFFIX = ".idx"
+
+#: Order of the fields in the index entries
+INDEX_FIELDS = ("offset", "length", "timestamp", "loccer_type", "exc_type", "fingerprint", "endpoint")
+
+
+class IndexEntry(t.NamedTuple):
+    offset: int
+    length: int
+    timestamp: t.Optional[str]
+    loccer_type: t.Optional[str]
+    exc_type: t.Optional[str]
+    fingerprint: t.Optional[str]
+    endpoint: t.Optional[str]
+
+
+class LogIndex:
+    """
+    Sidecar index of a JSON log file written by `JSONFileOutput` or its gzip compressed backup
+
+    Index is stored next to the log file with the `.idx` suffix as JSON lines, the first line identifies
+    the indexed file and each further line is an entry with the byte offset of the record inside the
+    (uncompressed) log file. The index of the live log file is updated incrementally, it's rebuilt when
+    the log file has been replaced (for example rotated) or truncated. Indexes of the backups are renamed
+    together with the backups when the files are rotated so they stay valid.
+    Both compressed (single line) and indented (multi line) JSON records are indexed.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.index_filename = filename + INDEX_SUFFIX
+        self.compressed = filename.endswith(".gz")
+        self.entries: t.List[IndexEntry] = []
+
+    def update(self, force: bool = False) -> int:
+        """
+        Load the index and index any new records in the log file
+
+        :param force: Rebuild the index from scratch
+        :return: Number of newly indexed records
+        """
+        identity = self._identity()
+        self.entries = [] if force else self._load(identity)
+
+        if self.compressed and self.entries and not force:
+            return 0
+
+        start = (self.entries[-1].offset + self.entries[-1].length) if self.entries else 0
+        new_entries = list(self._scan(start))
+
+        if not self.entries or force:
+            with open(self.index_filename, "w") as fd:
+                header = {"version": INDEX_VERSION, "identity": identity, "head": self._head(new_entries[:1])}
+                fd.write(json.dumps(header) + "\n")
+
+        if new_entries:
+            with open(self.index_filename, "a") as fd:
+                fd.writelines(json.dumps(list(x), separators=(",", ":")) + "\n" for x in new_entries)
+
+        self.entries.extend(new_entries)
+        return len(new_entries)
+
+    def search(
+        self,
+        since: t.Union[None, str, datetime.datetime] = None,
+        until: t.Union[None, str, datetime.datetime] = None,
+        loccer_type: t.Optional[str] = None,
+        exc_type: t.Optional[str] = None,
+        fingerprint: t.Optional[str] = None,
+        endpoint: t.Optional[str] = None,
+    ) -> t.Iterator[IndexEntry]:
+        """
+        Index entries matching all the given criteria
+        Timestamps are compared as datetimes, timezone aware values are converted to the naive UTC used by the logs
+        """
+        since_dt = parse_timestamp(since) if since is not None else None
+        until_dt = parse_timestamp(until) if until is not None else None
+        if (since is not None and since_dt is None) or (until is not None and until_dt is None):
+            raise ValueError(f"Invalid ISO format of the timestamp filter: since=`{since}`, until=`{until}`")
+
+        for entry in self.entries:
+            if since_dt is not None or until_dt is not None:
+                timestamp = parse_timestamp(entry.timestamp)
+                if timestamp is None:
+                    continue
+                elif since_dt is not None and timestamp < since_dt:
+                    continue
+                elif until_dt is not None and timestamp > until_dt:
+                    continue
+
+            if loccer_type is not None and entry.loccer_type != loccer_type:
+                continue
+            elif exc_type is not None and entry.exc_type != exc_type:
+                continue
+            elif fingerprint is not None and entry.fingerprint != fingerprint:
+                continue
+            elif endpoint is not None and entry.endpoint != endpoint:
+                continue
+
+            yield entry
+
+    def read(self, entries: t.Iterable[IndexEntry]) -> t.Iterator[bytes]:
+        """
+        Read the raw records of the index entries, entries must be ordered by their offset
+        Live log file is memory mapped so only the matching records are touched
+        """
+        if self.compressed:
+            with gzip.open(self.filename, "rb") as fd:
+                for entry in entries:
+                    fd.seek(entry.offset)
+                    yield fd.read(entry.length)
+            return
+
+        with open(self.filename, "rb") as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                return
+
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for entry in entries:
+                    yield mm[entry.offset:entry.offset + entry.length]
+
+    def _identity(self) -> t.List[int]:
+        fstat = os.stat(self.filename)
+        if self.compressed:
+            return [fstat.st_dev, fstat.st_ino, fstat.st_size, fstat.st_mtime_ns]
+        return [fstat.st_dev, fstat.st_ino]
+
+    def _head(self, entries: t.List[IndexEntry]) -> t.Optional[str]:
+        # Hash of the first record, identifies the content of the file in addition to the inode
+        if not entries:
+            return None
+
+        for raw in self.read(entries):
+            return hashlib.sha1(raw).hexdigest()
+        return None
+
+    def _load(self, identity: t.List[int]) -> t.List[IndexEntry]:
+        try:
+            with open(self.index_filename, "r") as fd:
+                header = json.loads(fd.readline() or "{}")
+                if header.get("version") != INDEX_VERSION or header.get("identity") != identity:
+                    return []
+
+                entries = [IndexEntry(*json.loads(line)) for line in fd if line.endswith("\n")]
+
+            if self._head(entries[:1]) != header.get("head"):
+                # Log file has been replaced by a new one reusing the same inode number
+                return []
+        except (OSError, ValueError, TypeError):
+            return []
+
+        if entries and not self.compressed:
+            end = entries[-1].offset + entries[-1].length
+            if os.path.getsize(self.filename) < end:
+                # Log file has been truncated in place
+                return []
+
+        return entries
+
+    def _scan(self, start: int) -> t.Iterator[IndexEntry]:
+        opener = gzip.open if self.compressed else open
+        with opener(self.filename, "rb") as fd:
+            fd.seek(start)
+            offset = start
+            # Lines of the indented (multi line) record that is being read
+            chunk: t.List[bytes] = []
+
+            for line in fd:
+                if not line.endswith(b"\n"):
+                    # Record is still being written
+                    break
+
+                if chunk:
+                    chunk.append(line)
+                    if line.rstrip() != b"}":
+                        continue
+                    # Top level object of the indented record is closed by the unindented brace
+                    record = b"".join(chunk)
+                    chunk = []
+                elif line.rstrip() == b"{":
+                    chunk.append(line)
+                    continue
+                else:
+                    record = line
+
+                entry = _index_record(offset, record)
+                offset += len(record)
+                if entry is not None:
+                    yield entry
+
+
+def _index_record(offset: int, line: bytes) -> t.Optional[IndexEntry]:
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+
+    if not isinstance(record, dict):
+        return None
+
+    endpoint = None
+    integrations = record.get("integrations")
+    if isinstance(integrations, dict):
+        for name in ("flask", "quart"):
+            if isinstance(integrations.get(name), dict) and integrations[name].get("endpoint"):
+                endpoint = integrations[name]["endpoint"]
+                break
+
+    return IndexEntry(
+        offset=offset,
+        length=len(line),
+        timestamp=record.get("timestamp"),
+        loccer_type=record.get("loccer_type"),
+        exc_type=record.get("exc_type"),
+        fingerprint=record.get("fingerprint"),
+        endpoint=endpoint,
+    )
+
+
+def parse_timestamp(value: t.Union[None, str, datetime.datetime]) -> t.Optional[datetime.datetime]:
+    """
+    Parse the ISO formatted timestamp as a naive UTC datetime, None if it's missing or invalid
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None
+
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return value if isinstance(value, datetime.datetime) else None
+
+
+def log_files(filename: str) -> t.List[str]:
+    """
+    Log file and its rotated backups ordered from the oldest to the newest
+    """
+    dirname = os.path.dirname(filename) or "."
+    pattern = re.compile(re.escape(os.path.basename(filename)) + r"\.(\d+)\.gz$")
+    backups = []
+
+    for name in os.listdir(dirname):
+        match = pattern.match(name)
+        if match:
+            backups.append((int(match.group(1)), os.path.join(dirname, name)))
+
+    files = [path for _, path in sorted(backups, reverse=True)]
+    if os.path.exists(filename):
+        files.append(filename)
+    return files
+
+
+def query(
+    filename: str,
+    since: t.Union[None, str, datetime.datetime] = None,
+    until: t.Union[None, str, datetime.datetime] = None,
+    include_backups: bool = True,
+    reindex: bool = False,
+    **criteria: t.Optional[str],
+) -> t.Iterator[JSONType]:
+    """
+    Query logs from the log file and its backups using the sidecar indexes, indexes are updated before the query
+
+    :param filename: Path to the live log file
+    :param since: Return only logs with the timestamp equal or greater
+    :param until: Return only logs with the timestamp equal or lower
+    :param include_backups: Search also rotated gzip compressed backups
+    :param reindex: Rebuild the indexes from scratch
+    :param criteria: Additional exact match criteria; `loccer_type`, `exc_type`, `fingerprint`, `endpoint`
+    :return: Matching logs ordered from the oldest
+    """
+    files = log_files(filename) if include_backups else [filename]
+    for fname in files:
+        index = LogIndex(fname)
+        index.update(force=reindex)
+        matches = list(index.search(since=since, until=until, **criteria))
+
+        for raw in index.read(matches):
+            yield json.loads(raw)
@@ -0,0 +1,167 @@
+import datetime
+import threading
+import time
+import typing as t
+
+from .ltypes import JSONType
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: t.Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def consume(self, now: t.Optional[float] = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def refund(self) -> None:
+        """
+        Return the token consumed by the last successful `consume`
+        """
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiting of captured exceptions with a circuit breaker
+
+    The decision is made from the exception fingerprint before the traceback is processed, rejected exceptions
+    don't pay for the frame walking and repr of locals. When the global rate is exceeded the circuit breaker opens
+    and all exceptions are rejected for the `cooldown` period. Rejected exceptions are only counted and reported
+    as a "N events suppressed" metadata log at most once per `summary_interval`, the summary is collected with
+    the next captured exception, on `Loccer.flush()` and at the interpreter exit.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: int = 50,
+        per_fingerprint_rate: t.Optional[float] = None,
+        per_fingerprint_burst: t.Optional[int] = None,
+        cooldown: float = 10.0,
+        summary_interval: float = 60.0,
+        max_fingerprints: int = 10000,
+    ):
+        """
+        :param rate: Global number of captured exceptions allowed per second
+        :param burst: Global burst size of the token bucket
+        :param per_fingerprint_rate: Number of captured exceptions per second allowed for each fingerprint, None to disable
+        :param per_fingerprint_burst: Burst size of the per fingerprint token buckets, defaults to the global burst
+        :param cooldown: Time in seconds the circuit breaker stays open after the global rate has been exceeded
+        :param summary_interval: Minimum time in seconds between the summaries of suppressed exceptions
+        :param max_fingerprints: Maximum number of tracked per fingerprint token buckets
+        """
+        if rate <= 0 or (per_fingerprint_rate is not None and per_fingerprint_rate <= 0):
+            raise ValueError("Rate must be greater than 0")
+
+        if burst < 1 or (per_fingerprint_burst is not None and per_fingerprint_burst < 1):
+            raise ValueError("Burst must be 1 or greater number")
+
+        self.rate = rate
+        self.burst = burst
+        self.per_fingerprint_rate = per_fingerprint_rate
+        self.per_fingerprint_burst = per_fingerprint_burst or burst
+        self.cooldown = cooldown
+        self.summary_interval = summary_interval
+        self.max_fingerprints = max_fingerprints
+
+        self.suppressed_total = 0  #: Number of suppressed exceptions since the creation of the rate limiter
+
+        self._bucket = TokenBucket(rate, burst)
+        self._fingerprint_buckets: t.Dict[str, TokenBucket] = {}
+        self._open_until: t.Optional[float] = None
+        self._suppressed: t.Dict[str, int] = {}
+        self._suppressed_since: t.Optional[datetime.datetime] = None
+        self._last_summary = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Circuit breaker is open, all exceptions are being suppressed
+        """
+        return self._open_until is not None and time.monotonic() < self._open_until
+
+    def allow(self, fingerprint: str, exc_type: str) -> bool:
+        """
+        Decide if the exception should be captured
+
+        :param fingerprint: Fingerprint of the exception
+        :param exc_type: Name of the exception type, used in the summary
+        :return: True if the exception should be captured
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if self._open_until is not None:
+                if now < self._open_until:
+                    return self._reject(exc_type)
+                self._open_until = None
+
+            if self.per_fingerprint_rate is not None:
+                bucket = self._fingerprint_buckets.get(fingerprint)
+                if bucket is None:
+                    if len(self._fingerprint_buckets) >= self.max_fingerprints:
+                        del self._fingerprint_buckets[next(iter(self._fingerprint_buckets))]
+                    bucket = self._fingerprint_buckets[fingerprint] = TokenBucket(
+                        self.per_fingerprint_rate, self.per_fingerprint_burst, now
+                    )
+
+                if not bucket.consume(now):
+                    return self._reject(exc_type)
+
+            if not self._bucket.consume(now):
+                if self.per_fingerprint_rate is not None:
+                    # Event is rejected anyway, the per fingerprint token must not be spent on it
+                    bucket.refund()
+                self._open_until = now + self.cooldown
+                return self._reject(exc_type)
+
+            return True
+
+    def pop_summaries(self, force: bool = False) -> t.List[JSONType]:
+        """
+        Return the summary of suppressed exceptions if the summary interval has elapsed
+
+        :param force: Return the summary regardless of the interval, for example when flushing at exit
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if not self._suppressed or not (force or (now - self._last_summary) >= self.summary_interval):
+                return []
+
+            suppressed, self._suppressed = self._suppressed, {}
+            since, self._suppressed_since = self._suppressed_since, None
+            self._last_summary = now
+
+        total = sum(suppressed.values())
+        return [{
+            "msg": f"{total} events suppressed by the rate limiter",
+            "suppressed": total,
+            "exc_types": suppressed,
+            "since": since.isoformat(),
+            "until": datetime.datetime.utcnow().isoformat(),
+            "circuit_open": self.is_open,
+        }]
+
+    def _reject(self, exc_type: str) -> bool:
+        if self._suppressed_since is None:
+            self._suppressed_since = datetime.datetime.utcnow()
+
+        self._suppressed[exc_type] = self._suppressed.get(exc_type, 0) + 1
+        self.suppressed_total += 1
+        return False
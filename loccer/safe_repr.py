@@ -0,0 +1,195 @@
+import collections
+import collections.abc
+import sys
+import typing as t
+
+
+# Containers formatted directly as long as their type still uses the built-in `__repr__`, subclasses included
+_BUILTIN_REPRS: t.Dict[t.Any, str] = {
+    dict.__repr__: "dict",
+    list.__repr__: "list",
+    tuple.__repr__: "tuple",
+    set.__repr__: "set",
+    frozenset.__repr__: "set",
+    collections.deque.__repr__: "deque",
+    collections.OrderedDict.__repr__: "ordered_dict",
+    collections.defaultdict.__repr__: "defaultdict",
+    collections.Counter.__repr__: "counter",
+}
+
+_CONTAINER_ABCS = (collections.abc.Mapping, collections.abc.Sequence, collections.abc.Set)
+# Types that are instances of the collection ABCs but have a cheap repr which does not list the items
+_NOT_CONTAINERS = (str, bytes, bytearray, memoryview, range)
+
+
+class SafeRepr:
+    """
+    Bounded repr of arbitrary objects, used for capturing locals, globals and integration payloads
+
+    Built-in containers and their subclasses that don't override `__repr__` are formatted directly so only
+    the first `max_items` are ever visited and nested containers are cut at `max_depth`. Other mappings,
+    sequences and sets larger than `max_items` are formatted the same way `reprlib` does, as `Name([...])`.
+    Remaining objects use their own `__repr__` which is truncated afterwards.
+    Reference cycles are detected and replaced by a marker.
+    Any exception raised by the `__repr__` of an object is caught and reported in place of the repr.
+    Instances are stateless and can be shared between threads.
+    """
+
+    def __init__(
+        self,
+        max_length: int = 1024,
+        max_string: int = 512,
+        max_depth: int = 3,
+        max_items: int = 20,
+        max_int_bits: int = 4096,
+    ):
+        """
+        :param max_length: Maximum length of the resulting repr, longer reprs are truncated
+        :param max_string: Maximum number of characters/bytes from str/bytes objects
+        :param max_depth: Maximum nesting level of containers
+        :param max_items: Maximum number of items displayed from a container
+        :param max_int_bits: Integers larger than this are summarized instead of converted to decimal
+        """
+        self.max_length = max_length
+        self.max_string = max_string
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_int_bits = max_int_bits
+
+    def __call__(self, obj: t.Any) -> str:
+        return self.repr(obj)
+
+    def repr(self, obj: t.Any) -> str:
+        try:
+            return self._truncate(self._repr(obj, 0, set()))
+        except Exception as exc:
+            return repr_error(exc)
+
+    def _repr(self, obj: t.Any, level: int, seen: t.Set[int]) -> str:
+        obj_type = type(obj)
+
+        # Fast path for primitives
+        if obj is None or obj_type is bool or obj_type is float:
+            return repr(obj)
+        elif obj_type is int:
+            if obj.bit_length() > self.max_int_bits:
+                return f"<int with {obj.bit_length()} bits>"
+            return repr(obj)
+        elif obj_type is str or obj_type is bytes or obj_type is bytearray:
+            if len(obj) > self.max_string:
+                return f"{repr(obj[:self.max_string])}...(+{len(obj) - self.max_string})"
+            return repr(obj)
+
+        kind = _BUILTIN_REPRS.get(obj_type.__repr__)
+        if kind is None and isinstance(obj, _CONTAINER_ABCS) and not isinstance(obj, _NOT_CONTAINERS):
+            try:
+                if len(obj) > self.max_items:
+                    kind = "abc"
+            except Exception:
+                pass
+
+        if kind is not None:
+            if level >= self.max_depth:
+                return "{...}" if isinstance(obj, collections.abc.Mapping) else "[...]"
+
+            obj_id = id(obj)
+            if obj_id in seen:
+                return f"<recursion on {obj_type.__name__} with id={obj_id}>"
+
+            seen.add(obj_id)
+            try:
+                return self._repr_container(kind, obj, level, seen)
+            finally:
+                seen.discard(obj_id)
+
+        try:
+            return self._truncate(repr(obj))
+        except Exception as exc:
+            return repr_error(exc)
+
+    def _repr_container(self, kind: str, obj: t.Any, level: int, seen: t.Set[int]) -> str:
+        name = type(obj).__name__
+
+        if kind == "dict":
+            return self._repr_dict(obj, level, seen)
+        elif kind == "list":
+            return "[" + ", ".join(self._repr_sequence(obj, level, seen)) + "]"
+        elif kind == "tuple":
+            end = ",)" if len(obj) == 1 else ")"
+            return "(" + ", ".join(self._repr_sequence(obj, level, seen)) + end
+        elif kind == "set":
+            if not obj:
+                return f"{name}()"
+            inner = "{" + ", ".join(self._repr_sequence(obj, level, seen)) + "}"
+            return inner if type(obj) is set else f"{name}({inner})"
+        elif kind == "deque":
+            inner = "[" + ", ".join(self._repr_sequence(obj, level, seen)) + "]"
+            if obj.maxlen is not None:
+                return f"{name}({inner}, maxlen={obj.maxlen})"
+            return f"{name}({inner})"
+        elif kind == "ordered_dict" or kind == "counter":
+            if not obj:
+                return f"{name}()"
+            elif kind == "ordered_dict" and sys.version_info < (3, 12):
+                parts = self._repr_items(
+                    obj.items(),
+                    len(obj),
+                    lambda item: f"({self._repr(item[0], level+1, seen)}, {self._repr(item[1], level+1, seen)})"
+                )
+                return f"{name}([" + ", ".join(parts) + "])"
+            return f"{name}({self._repr_dict(obj, level, seen)})"
+        elif kind == "defaultdict":
+            return f"{name}({self._repr(obj.default_factory, level+1, seen)}, {self._repr_dict(obj, level, seen)})"
+        elif isinstance(obj, collections.abc.Mapping):
+            return f"{name}({self._repr_dict(obj, level, seen)})"
+        else:
+            return f"{name}([" + ", ".join(self._repr_sequence(obj, level, seen)) + "])"
+
+    def _repr_dict(self, obj: t.Mapping, level: int, seen: t.Set[int]) -> str:
+        parts = self._repr_items(
+            obj.items(),
+            len(obj),
+            lambda item: f"{self._repr(item[0], level+1, seen)}: {self._repr(item[1], level+1, seen)}"
+        )
+        return "{" + ", ".join(parts) + "}"
+
+    def _repr_sequence(self, obj: t.Collection, level: int, seen: t.Set[int]) -> t.List[str]:
+        return self._repr_items(obj, len(obj), lambda item: self._repr(item, level+1, seen))
+
+    def _repr_items(self, items: t.Iterable, size: int, repr_item: t.Callable[[t.Any], str]) -> t.List[str]:
+        # Stop at the item count limit or as soon as the output can't fit into the max length anyway
+        parts = []
+        total = 0
+        for idx, item in enumerate(items):
+            if idx >= self.max_items or total > self.max_length:
+                parts.append(f"...(+{size - idx})")
+                break
+
+            part = repr_item(item)
+            total += len(part) + 2
+            parts.append(part)
+
+        return parts
+
+    def _truncate(self, value: str) -> str:
+        if len(value) > self.max_length:
+            return f"{value[:self.max_length]}...(+{len(value) - self.max_length})"
+        return value
+
+
+def repr_error(exc: BaseException) -> str:
+    exc_desc = str(exc.__class__.__name__)
+    if exc.args:
+        exc_desc = f"{exc_desc}: {'; '.join(str(x) for x in exc.args)}"
+
+    return f"Error getting repr of the object: `{exc_desc}`"
+
+
+DEFAULT_SAFE_REPR = SafeRepr()
+
+
+def safe_repr(obj: t.Any) -> str:
+    """
+    Bounded repr of the object using the default limits
+    """
+    return DEFAULT_SAFE_REPR.repr(obj)
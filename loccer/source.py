@@ -0,0 +1,156 @@
+import collections
+import itertools
+import linecache
+import os
+import sys
+import threading
+import time
+import tokenize
+import typing as t
+
+
+class SourceCache:
+    """
+    Bounded cache of source code lines used for resolving the `line` of captured frames
+
+    Unlike `linecache`, only the requested lines are retained in an LRU cache instead of whole source files.
+    Source files of the application modules can be prewarmed (for example at `loccer.install()`) so that
+    the lines are resolved without any disk access when an exception is being logged.
+    Cached lines are invalidated when the modification time of the source file changes, the time is checked
+    at most once per `check_interval` for each file.
+    """
+
+    def __init__(self, max_lines: int = 4096, check_interval: float = 1.0):
+        """
+        :param max_lines: Maximum number of cached (filename, lineno) lines
+        :param check_interval: Minimum time in seconds between the checks of the source file modification time
+        """
+        if check_interval < 0:
+            raise ValueError("Check interval must be 0 or greater number")
+
+        self.max_lines = max_lines
+        self.check_interval = check_interval
+        self._lines: "collections.OrderedDict[t.Tuple[str, int], t.Tuple[str, t.Optional[float]]]" = collections.OrderedDict()
+        self._files: t.Dict[str, t.Tuple[t.List[str], t.Optional[float]]] = {}
+        # filename -> (time of the last check, modification time)
+        self._mtimes: t.Dict[str, t.Tuple[float, t.Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def getline(self, filename: str, lineno: int) -> str:
+        """
+        Source code line stripped of the leading and trailing whitespace, empty string if not available
+        """
+        key = (filename, lineno)
+        mtime = self._mtime(filename)
+
+        with self._lock:
+            cached = self._lines.get(key)
+            if cached is not None and _is_fresh(cached[1], mtime):
+                self._lines.move_to_end(key)
+                return cached[0]
+
+            lines = None
+            prewarmed = self._files.get(filename)
+            if prewarmed is not None:
+                if _is_fresh(prewarmed[1], mtime):
+                    lines = prewarmed[0]
+                else:
+                    del self._files[filename]
+
+        if lines is not None:
+            line = lines[lineno - 1] if 0 < lineno <= len(lines) else ""
+        else:
+            line = self._read_line(filename, lineno)
+
+        line = line.strip()
+        with self._lock:
+            self._lines[key] = (line, mtime)
+            self._lines.move_to_end(key)
+            while len(self._lines) > self.max_lines:
+                self._lines.popitem(last=False)
+
+        return line
+
+    def prewarm(self, filenames: t.Iterable[str]) -> int:
+        """
+        Load the whole source files into the cache
+
+        :param filenames: Paths to the source files
+        :return: Number of loaded files
+        """
+        count = 0
+        for filename in filenames:
+            try:
+                # Modification time is taken before reading, a concurrent change would be detected by the next check
+                mtime = os.stat(filename).st_mtime
+                with tokenize.open(filename) as fd:
+                    lines = fd.readlines()
+            except (OSError, SyntaxError, UnicodeDecodeError):
+                continue
+
+            with self._lock:
+                self._files[filename] = (lines, mtime)
+                self._mtimes[filename] = (time.monotonic(), mtime)
+            count += 1
+
+        return count
+
+    def prewarm_modules(self, names: t.Iterable[str]) -> int:
+        """
+        Load source files of the imported modules and their submodules into the cache
+
+        :param names: Names of the top level modules or packages, for example the name of the application package
+        :return: Number of loaded files
+        """
+        names = tuple(names)
+        filenames = []
+
+        for module_name, module in list(sys.modules.items()):
+            if not any(module_name == x or module_name.startswith(x + ".") for x in names):
+                continue
+
+            filename = getattr(module, "__file__", None)
+            if filename and filename.endswith(".py"):
+                filenames.append(filename)
+
+        return self.prewarm(filenames)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lines.clear()
+            self._files.clear()
+            self._mtimes.clear()
+
+    def _mtime(self, filename: str) -> t.Optional[float]:
+        now = time.monotonic()
+        checked = self._mtimes.get(filename)
+        if checked is not None and now - checked[0] < self.check_interval:
+            return checked[1]
+
+        try:
+            mtime: t.Optional[float] = os.stat(filename).st_mtime
+        except (OSError, ValueError):
+            # Not a file on disk or it has been removed, cached lines are kept
+            mtime = None
+
+        self._mtimes[filename] = (now, mtime)
+        return mtime
+
+    @staticmethod
+    def _read_line(filename: str, lineno: int) -> str:
+        if lineno < 1:
+            return ""
+
+        try:
+            with tokenize.open(filename) as fd:
+                return next(itertools.islice(fd, lineno - 1, None), "")
+        except (OSError, SyntaxError, UnicodeDecodeError):
+            # Not a file on disk, for example a module imported from a zip archive
+            return linecache.getline(filename, lineno)
+
+
+def _is_fresh(cached_mtime: t.Optional[float], mtime: t.Optional[float]) -> bool:
+    return mtime is None or cached_mtime == mtime
+
+
+DEFAULT_SOURCE_CACHE = SourceCache()
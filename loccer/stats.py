@@ -0,0 +1,164 @@
+import datetime
+import threading
+import time
+import typing as t
+
+from .ltypes import JSONType
+
+
+COUNTERS = ("events", "metadata_events", "filtered", "integration_errors", "integration_timeouts")
+
+
+class StageTiming:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def as_json(self) -> t.Dict[str, t.Any]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": (self.total / self.count) if self.count else 0.0,
+            "max": self.max,
+        }
+
+
+class Timer:
+    __slots__ = ("stats", "stage", "start")
+
+    def __init__(self, stats: "PipelineStats", stage: str):
+        self.stats = stats
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> bool:
+        self.stats.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *args) -> bool:
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+def timed(stats: t.Optional["PipelineStats"], kind: str, name: t.Optional[str] = None) -> t.Union[Timer, _NullTimer]:
+    """
+    Context manager measuring the duration of the pipeline stage, shared no-op instance is returned if `stats` is None
+    """
+    if stats is None:
+        return NULL_TIMER
+
+    return Timer(stats, kind if name is None else f"{kind}:{name}")
+
+
+class PipelineStats:
+    """
+    Self-instrumentation of the loccer pipeline
+
+    Records monotonic timings of the pipeline stages (`filter`, `capture`, `integration:<NAME>`, `serialize`,
+    `encode` and `output:<handler class>`) and event counters. Number of dropped logs and bytes written are read
+    from the output handlers (`dropped` and `bytes_written` attributes) when the snapshot is taken.
+    """
+
+    def __init__(self, emit_interval: t.Optional[float] = None):
+        """
+        :param emit_interval: Emit the stats snapshot as a metadata log every N seconds, None to disable
+        """
+        if emit_interval is not None and emit_interval <= 0:
+            raise ValueError("Emit interval must be greater than 0")
+
+        self.emit_interval = emit_interval
+        self.started = datetime.datetime.utcnow()
+
+        self._lock = threading.Lock()
+        self._stages: t.Dict[str, StageTiming] = {}
+        self._counters: t.Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self._last_emit = time.monotonic()
+
+    def record(self, stage: str, duration: float) -> None:
+        with self._lock:
+            timing = self._stages.get(stage)
+            if timing is None:
+                timing = self._stages[stage] = StageTiming()
+
+            timing.count += 1
+            timing.total += duration
+            if duration > timing.max:
+                timing.max = duration
+
+    def increment(self, counter: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + value
+
+    def snapshot(self, output_handlers: t.Sequence[t.Any] = ()) -> t.Dict[str, t.Any]:
+        """
+        Current timings and counters
+
+        :param output_handlers: Output handlers from which the number of dropped logs and bytes written is collected
+        """
+        with self._lock:
+            stages = {name: timing.as_json() for name, timing in self._stages.items()}
+            counters = dict(self._counters)
+
+        counters["dropped"] = 0
+        counters["bytes_written"] = 0
+        for handler in _walk_handlers(output_handlers):
+            counters["dropped"] += getattr(handler, "dropped", 0)
+            counters["bytes_written"] += getattr(handler, "bytes_written", 0)
+
+        return {
+            "since": self.started.isoformat(),
+            "counters": counters,
+            "stages": stages,
+        }
+
+    def pop_summary(self, output_handlers: t.Sequence[t.Any] = (), force: bool = False) -> t.Optional[JSONType]:
+        """
+        Return the stats snapshot that should be logged if the emit interval elapsed
+
+        :param output_handlers: See `snapshot`
+        :param force: Return the snapshot regardless of the interval, for example when flushing at exit
+        """
+        if self.emit_interval is None:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            if not force and (now - self._last_emit) < self.emit_interval:
+                return None
+            self._last_emit = now
+
+        return {"msg": "Loccer pipeline stats", "loccer_stats": self.snapshot(output_handlers)}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._counters = dict.fromkeys(COUNTERS, 0)
+            self.started = datetime.datetime.utcnow()
+
+
+def _walk_handlers(output_handlers: t.Sequence[t.Any]) -> t.Iterator[t.Any]:
+    # Wrapping outputs such as `QueuedOutput` or `AsyncioDispatcher` are traversed into their inner handlers
+    for handler in output_handlers:
+        yield handler
+
+        inner = getattr(handler, "handler", None)
+        if inner is not None:
+            yield from _walk_handlers((inner,))
+
+        yield from _walk_handlers(getattr(handler, "handlers", ()))
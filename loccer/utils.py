@@ -1,7 +1,10 @@
+from .safe_repr import safe_repr
+
+
 def quick_format(obj):
     if obj is None:
         return obj
     elif isinstance(obj, (str, int, float, bool)):
         return obj
     else:
-        return repr(obj)
+        return safe_repr(obj)
@@ -1,9 +1,13 @@
 import asyncio
+import threading
 
 import pytest
 
 import loccer
+from loccer.bases import AsyncOutputBase, MetadataLog
 from loccer.integrations.asyncio_context import AsyncioContextIntegration
+from loccer.outputs.asyncio_output import AsyncioDispatcher
+from loccer.outputs.misc import InMemoryOutput
 
 
 @pytest.fixture(scope="function")
@@ -50,3 +54,246 @@ def test_asyncio_enrichment_new_loop(in_memory, asyncio_integration):
     assert data["loop_context"]["message"] == "'Task exception was never retrieved'"
     assert data["loop_context"]["exception"] == "RuntimeError('Test exception')"
     assert "_exc()" in data["loop_context"]["future"]
+
+
+class AsyncInMemoryOutput(AsyncOutputBase):
+    def __init__(self):
+        self.logs = []
+        self.closed = False
+
+    async def output(self, exc) -> None:
+        await asyncio.sleep(0)
+        self.logs.append(exc.cached_json())
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class ThreadRecordingOutput(InMemoryOutput):
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def output(self, exc) -> None:
+        self.threads.add(threading.current_thread())
+        super().output(exc)
+
+
+def test_asyncio_dispatcher():
+    sync_out = ThreadRecordingOutput()
+    async_out = AsyncInMemoryOutput()
+    dispatcher = AsyncioDispatcher((sync_out, async_out))
+
+    async def _main():
+        for x in range(10):
+            dispatcher.output(MetadataLog(x))
+
+        # Nothing is written inline inside the loop
+        assert sync_out.logs == []
+        await dispatcher.aclose()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_main())
+    finally:
+        loop.close()
+
+    assert [x["data"] for x in sync_out.logs] == list(range(10))
+    assert [x["data"] for x in async_out.logs] == list(range(10))
+    assert threading.current_thread() not in sync_out.threads
+    assert async_out.closed is True
+    assert dispatcher.errors == 0
+
+
+def test_asyncio_dispatcher_flush_in_loop():
+    sync_out = InMemoryOutput()
+    dispatcher = AsyncioDispatcher((sync_out,))
+
+    async def _main():
+        for x in range(3):
+            dispatcher.output(MetadataLog(x))
+
+        # Flush is only scheduled inside the loop, it must not wait for itself
+        dispatcher.flush()
+        await asyncio.wait_for(dispatcher.aclose(), timeout=5)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_main())
+    finally:
+        loop.close()
+
+    assert [x["data"] for x in sync_out.logs] == [0, 1, 2]
+    assert dispatcher.errors == 0
+
+
+def test_asyncio_dispatcher_without_loop():
+    sync_out = InMemoryOutput()
+    async_out = AsyncInMemoryOutput()
+    dispatcher = AsyncioDispatcher((sync_out, async_out))
+
+    dispatcher.output(MetadataLog("no loop"))
+    assert sync_out.logs[0]["data"] == "no loop"
+    assert async_out.logs[0]["data"] == "no loop"
+
+
+def test_asyncio_bounded_dump(in_memory, asyncio_integration):
+    asyncio_integration.max_tasks = 5
+    asyncio_integration.top_stacks = 1
+
+    async def _idle(ev):
+        await ev.wait()
+
+    async def _main():
+        ev = asyncio.Event()
+        tasks = [asyncio.create_task(_idle(ev)) for _ in range(50)]
+        await asyncio.sleep(0)
+        with loccer.capture_exception:
+            raise RuntimeError("bounded")
+        ev.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(_main())
+
+    data = in_memory.logs[0]["integrations"]["asyncio"]
+    assert len(data["coros"]) == 6
+    assert data["coros"]["..."] == "truncated after 5 tasks, 46 more tasks"
+
+    qualname = "test_asyncio_bounded_dump.<locals>._idle"
+    assert list(data["coro_groups"])[0] == qualname
+    assert data["coro_groups"][qualname]["count"] == 50
+    assert data["coro_groups"][qualname]["stack"][0]["name"] == "_idle"
+    assert "stack" not in data["coro_groups"]["test_asyncio_bounded_dump.<locals>._main"]
+
+
+def test_asyncio_tasks_snapshot_reused(in_memory, asyncio_integration):
+    async def _idle(ev):
+        await ev.wait()
+
+    async def _main():
+        ev = asyncio.Event()
+        tasks = [asyncio.create_task(_idle(ev)) for _ in range(10)]
+        await asyncio.sleep(0)
+        with loccer.capture_exception:
+            raise RuntimeError("first")
+
+        tasks.extend(asyncio.create_task(_idle(ev)) for _ in range(10))
+        await asyncio.sleep(0)
+        with loccer.capture_exception:
+            raise RuntimeError("second")
+
+        asyncio_integration.snapshot_interval = 0
+        with loccer.capture_exception:
+            raise RuntimeError("third")
+
+        ev.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(_main())
+
+    qualname = "test_asyncio_tasks_snapshot_reused.<locals>._idle"
+    first, second, third = (x["integrations"]["asyncio"] for x in in_memory.logs)
+    # Tasks created within the interval are not in the reused snapshot
+    assert first["coro_groups"][qualname]["count"] == second["coro_groups"][qualname]["count"] == 10
+    assert second["tasks_snapshot_age"] >= 0
+    assert second["coros"] is not first["coros"]
+    assert third["coro_groups"][qualname]["count"] == 20
+    assert "tasks_snapshot_age" not in third
+
+
+def test_asyncio_group_stacks_budget():
+    class _Budget:
+        # Expires after the single counting chunk
+        def __init__(self):
+            self.checks = 0
+
+        def expired(self):
+            self.checks += 1
+            return self.checks > 1
+
+    async def _idle(ev):
+        await ev.wait()
+
+    async def _main():
+        ev = asyncio.Event()
+        tasks = [asyncio.create_task(_idle(ev)) for _ in range(10)]
+        await asyncio.sleep(0)
+        without_budget = AsyncioContextIntegration.group_tasks(tasks, top_stacks=1)
+        with_budget = AsyncioContextIntegration.group_tasks(tasks, top_stacks=1, budget=_Budget())
+        ev.set()
+        await asyncio.gather(*tasks)
+        return without_budget, with_budget
+
+    without_budget, with_budget = asyncio.run(_main())
+    qualname = "test_asyncio_group_stacks_budget.<locals>._idle"
+    assert without_budget[qualname]["stack"][0]["name"] == "_idle"
+    assert with_budget == {qualname: {"count": 10}}
+
+
+def test_asyncio_current_task_only(in_memory, asyncio_integration):
+    asyncio_integration.current_task_only = True
+
+    async def _idle(ev):
+        await ev.wait()
+
+    async def _failing():
+        await asyncio.sleep(0)
+        with loccer.capture_exception:
+            raise RuntimeError("current")
+
+    async def _parent():
+        await asyncio.gather(_failing(), asyncio.sleep(0))
+
+    async def _main():
+        ev = asyncio.Event()
+        tasks = [asyncio.create_task(_idle(ev)) for _ in range(50)]
+        await asyncio.create_task(_parent(), name="parent")
+        ev.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(_main(), debug=False)
+
+    coros = in_memory.logs[0]["integrations"]["asyncio"]["coros"]
+    assert "coro_groups" not in in_memory.logs[0]["integrations"]["asyncio"]
+    names = list(coros)
+    assert len(names) == 4
+    current = coros[names[0]]
+    assert "_failing" in current["coro"]
+    assert current["stack"][-1]["name"] == "_failing"
+    # failing task -> gather future -> parent task -> main task
+    assert coros["parent"]["awaited_by"] == [names[3]]
+    assert "_main" in coros[names[3]]["coro"]
+
+
+def test_asyncio_dispatcher_stopped_loop():
+    sync_out = InMemoryOutput()
+    loop = asyncio.new_event_loop()
+    dispatcher = AsyncioDispatcher((sync_out,), loop=loop)
+
+    try:
+        # Bound loop is not running, log must not be left in the callbacks of the stopped loop
+        dispatcher.output(MetadataLog("stopped"))
+        assert sync_out.logs[0]["data"] == "stopped"
+
+        async def _main():
+            with pytest.raises(RuntimeError):
+                dispatcher.close()
+            await dispatcher.aclose()
+
+        loop.run_until_complete(_main())
+    finally:
+        loop.close()
+
+
+def test_asyncio_dispatcher_max_pending():
+    sync_out = InMemoryOutput()
+    dispatcher = AsyncioDispatcher((sync_out,), max_pending=3)
+
+    async def _main():
+        for x in range(5):
+            dispatcher.output(MetadataLog(x))
+        await dispatcher.aclose()
+
+    asyncio.run(_main())
+    assert [x["data"] for x in sync_out.logs] == [0, 1, 2]
+    assert dispatcher.dropped == 2
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 
 import loccer
@@ -23,6 +25,27 @@ def throw_exc():
     raise ValueError("ratatata")
 
 
+@app.route("/json_exc", methods=["POST"])
+def throw_json_exc():
+    flask.request.get_json()
+    raise ValueError("json error")
+
+
+@app.route("/form_exc", methods=["POST"])
+def throw_form_exc():
+    if flask.request.args.get("parse"):
+        flask.request.form.get("field_0")
+    raise ValueError("form error")
+
+
+@app.route("/upload_exc", methods=["POST"])
+def throw_upload_exc():
+    with loccer.capture_exception:
+        raise ValueError("upload error")
+    # Body is still fully readable after loccer peeked at it
+    return flask.Response(str(len(flask.request.get_data())))
+
+
 @pytest.fixture(scope="function")
 def client(in_memory):
     assert flask.signals_available is True
@@ -54,11 +77,21 @@ def test_flask_enrichment(in_memory, client):
     assert extra["flask_context"] is True
     assert extra["client_ip"] == "127.0.0.1"
     assert extra["url"] == "/status_code/500/error_500"
-    assert extra["json_payload"] == {"test": "body"}
+    # JSON is not parsed by loccer if the application did not parse it
+    assert extra["json_payload"] is None
+    assert json.loads(extra["raw_payload"]) == {"test": "body"}
     assert extra["is_json"] is True
     assert extra["method"] == "POST"
 
 
+@pytest.fixture(scope="function")
+def limits(monkeypatch):
+    def _set(**kwargs):
+        for key, value in kwargs.items():
+            monkeypatch.setattr(flask_integration, key, value)
+    return _set
+
+
 def test_flask_exception(in_memory, client):
     assert in_memory.logs == []
 
@@ -81,3 +114,68 @@ def test_success(code, text, in_memory, client):
     assert resp.status_code == code
     assert resp.text == text
     assert in_memory.logs == []
+
+
+def test_flask_body_capture_bounded(in_memory, client, limits):
+    limits(max_body_size=1024)
+
+    resp = client.post("/upload_exc", data=b"x" * 100_000, content_type="application/octet-stream")
+    assert resp.status_code == 200
+    assert resp.text == "100000"
+
+    extra = in_memory.logs[0]["integrations"]["flask"]
+    assert extra["body_truncated"] is True
+    assert extra["raw_payload"] == "x" * 1024
+    assert extra["form"] is None
+    assert extra["files"] is None
+
+
+@pytest.mark.parametrize("parse", (False, True))
+def test_flask_form_only_if_parsed(in_memory, client, limits, parse):
+    limits(max_form_fields=3, max_value_length=10)
+
+    form = {f"field_{idx}": "v" * 20 for idx in range(5)}
+    with pytest.raises(ValueError):
+        client.post("/form_exc" + ("?parse=1" if parse else ""), data=form)
+
+    extra = in_memory.logs[0]["integrations"]["flask"]
+    if parse:
+        assert extra["form"] == {f"field_{idx}": "v" * 10 + "...(+10)" for idx in range(3)}
+        assert extra["form_omitted"] == 2
+        assert extra["raw_payload"] is None
+    else:
+        assert extra["form"] is None
+        assert extra["raw_payload"].startswith("field_0=")
+
+
+def test_flask_header_cookie_allowlist(in_memory, client, limits):
+    limits(header_allowlist=("user-agent", "x-request-*"), cookie_allowlist=("session",))
+
+    client.set_cookie("localhost", "session", "abc")
+    client.set_cookie("localhost", "secret", "xyz")
+    with pytest.raises(ValueError):
+        client.get("/exc", headers={"Authorization": "Bearer token", "X-Request-Id": "123"})
+
+    extra = in_memory.logs[0]["integrations"]["flask"]
+    assert set(extra["headers"]) == {"User-Agent", "X-Request-Id"}
+    assert extra["user_agent"] == extra["headers"]["User-Agent"]
+    assert extra["cookies"] == {"session": "abc"}
+
+
+def test_flask_user_agent_not_in_allowlist(in_memory, client, limits):
+    limits(header_allowlist=("x-request-*",))
+
+    with pytest.raises(ValueError):
+        client.get("/exc", headers={"User-Agent": "loccer-test", "X-Request-Id": "123"})
+
+    extra = in_memory.logs[0]["integrations"]["flask"]
+    assert set(extra["headers"]) == {"X-Request-Id"}
+    assert extra["user_agent"] == "loccer-test"
+
+
+def test_flask_parsed_json(in_memory, client):
+    with pytest.raises(ValueError):
+        client.post("/json_exc", json={"parsed": True})
+
+    extra = in_memory.logs[0]["integrations"]["flask"]
+    assert extra["json_payload"] == {"parsed": True}
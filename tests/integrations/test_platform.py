@@ -0,0 +1,93 @@
+import os
+from unittest.mock import patch
+
+from loccer.bases import MetadataLog
+from loccer.integrations import platform_context
+from loccer.integrations.platform_context import PlatformIntegration
+
+
+def test_snapshot_computed_once():
+    integration = PlatformIntegration()
+
+    with patch.object(platform_context, "getuser", return_value="loccer") as getuser:
+        first = integration.gather(MetadataLog({}))
+        second = integration.gather(MetadataLog({}))
+
+    assert getuser.call_count == 1
+    assert first["username"] == second["username"] == "loccer"
+    assert first["pid"] == os.getpid()
+    assert first["environment_variables"] == dict(os.environ)
+
+    platform_context._invalidate_snapshots()
+    with patch.object(platform_context, "getuser", return_value="loccer") as getuser:
+        integration.gather(MetadataLog({}))
+
+    assert getuser.call_count == 1
+
+
+def test_env_filters():
+    env = {"APP_NAME": "loccer", "APP_SECRET": "hunter2", "HOME": "/root"}
+    integration = PlatformIntegration(env_allowlist=("APP_*",), env_denylist=("*SECRET*",))
+
+    with patch.dict(os.environ, env, clear=True):
+        data = integration.gather(MetadataLog({}))
+
+    assert data["environment_variables"] == {"APP_NAME": "loccer"}
+
+
+def test_env_changes_and_snapshot_reference():
+    integration = PlatformIntegration(env_changes_only=True, reference_snapshot=True)
+
+    with patch.dict(os.environ, {"A": "1", "B": "2"}, clear=True):
+        first = integration.gather(MetadataLog({}))
+        os.environ["A"] = "changed"
+        del os.environ["B"]
+        second = integration.gather(MetadataLog({}))
+
+    assert first["snapshot"]["environment_variables"] == {"A": "1", "B": "2"}
+    assert first["environment_changes"] == {}
+
+    assert "snapshot" not in second
+    assert second["snapshot_hash"] == first["snapshot_hash"]
+    assert second["environment_changes"] == {"A": "changed", "B": None}
+
+
+def test_snapshot_not_shared_between_events():
+    integration = PlatformIntegration()
+
+    first = integration.gather(MetadataLog({}))
+    first["uname"]["system"] = "mutated"
+    first["python"]["version"] = "mutated"
+
+    second = integration.gather(MetadataLog({}))
+    assert second["uname"]["system"] != "mutated"
+    assert second["python"]["version"] != "mutated"
+
+
+def test_snapshot_reference_reemitted():
+    integration = PlatformIntegration(reference_snapshot=True, snapshot_interval=3600)
+
+    assert "snapshot" in integration.gather(MetadataLog({}))
+    assert "snapshot" not in integration.gather(MetadataLog({}))
+
+    # Full snapshot is included again once the interval passed since the last one
+    integration.snapshot_interval = 0
+    third = integration.gather(MetadataLog({}))
+    assert third["snapshot"]["pid"] == os.getpid()
+    assert third["snapshot_hash"] == integration._snapshot_hash
+
+
+def test_snapshot_environment_copied_once():
+    integration = PlatformIntegration(env_changes_only=True)
+    snapshot_env = integration.snapshot()["environment_variables"]
+
+    with patch.dict(os.environ, {"A": "1"}):
+        with patch.object(integration, "environment_variables", wraps=integration.environment_variables) as env_vars:
+            first = integration.gather(MetadataLog({}))
+            second = integration.gather(MetadataLog({}))
+
+    # Environment is read once per event, the snapshot environment is not copied again
+    assert env_vars.call_count == 2
+    assert first["environment_variables"] is snapshot_env
+    assert second["environment_variables"] is snapshot_env
+    assert first["environment_changes"]["A"] == "1"
@@ -1,9 +1,15 @@
+import asyncio
+import json
+
 import pytest
 
 import loccer
+from loccer.bases import MetadataLog
+from loccer.budget import Budget
 
 
 quart = pytest.importorskip("quart")
+from quart.wrappers.request import Body
 from loccer.integrations.quart_context import QuartContextIntegration
 
 
@@ -22,8 +28,10 @@ async def status_code(status_code: int, msg: str) -> quart.Response:
     return quart.Response(msg, status=status_code)
 
 
-@app.route("/exc")
+@app.route("/exc", methods=["GET", "POST"])
 async def throw_exc():
+    if quart.request.args.get("parse"):
+        await quart.request.form
     raise ValueError("ratatata")
 
 
@@ -39,6 +47,14 @@ def client(in_memory):
         loccer.capture_exception.integrations = prev_integrations
 
 
+@pytest.fixture(scope="function")
+def limits(monkeypatch):
+    def _set(**kwargs):
+        for key, value in kwargs.items():
+            monkeypatch.setattr(quart_integration, key, value)
+    return _set
+
+
 @pytest.mark.asyncio
 async def test_quart_hooks(client):
     req_fin = False
@@ -79,6 +95,9 @@ async def test_quart_enrichment(in_memory, client):
     assert extra["url"] == "/status_code/500/error_500"
     assert extra["is_json"] is True
     assert extra["method"] == "POST"
+    # JSON is not parsed by loccer if the application did not parse it
+    assert extra["json_payload"] is None
+    assert json.loads(extra["raw_payload"]) == {"test": "body"}
 
 
 @pytest.mark.parametrize("code, text", (
@@ -92,3 +111,83 @@ async def test_success(code, text, in_memory, client):
     assert resp.status_code == code
     assert (await resp.data).decode() == text
     assert in_memory.logs == []
+
+
+@pytest.mark.asyncio
+async def test_quart_exception_body(in_memory, client, limits):
+    limits(max_body_size=1024)
+
+    resp = await client.post("/exc", data=b"x" * 100_000)
+    assert resp.status_code == 500
+
+    assert len(in_memory.logs) == 1
+    log = in_memory.logs[0]
+    assert log["loccer_type"] == "exception"
+    extra = log["integrations"]["quart"]
+    assert extra["body_truncated"] is True
+    assert extra["raw_payload"] == "x" * 1024
+    assert extra["form"] is None
+
+
+@pytest.mark.parametrize("parse", (False, True))
+@pytest.mark.asyncio
+async def test_quart_form_only_if_parsed(in_memory, client, limits, parse):
+    limits(max_form_fields=3, max_value_length=10)
+
+    form = {f"field_{idx}": "v" * 20 for idx in range(5)}
+    resp = await client.post("/exc" + ("?parse=1" if parse else ""), form=form)
+    assert resp.status_code == 500
+
+    extra = in_memory.logs[0]["integrations"]["quart"]
+    if parse:
+        assert extra["form"] == {f"field_{idx}": "v" * 10 + "...(+10)" for idx in range(3)}
+        assert extra["form_omitted"] == 2
+        assert extra["raw_payload"] is None
+    else:
+        assert extra["form"] is None
+        assert extra["raw_payload"].startswith("field_0=")
+
+
+@pytest.mark.asyncio
+async def test_quart_snapshot_waits_for_body(in_memory, client):
+    async with app.test_request_context("/exc", method="POST", headers={"Content-Type": "application/json"}):
+        # Test request context has an already completed empty body, simulate the one still being received
+        body = quart.request.body = Body(None, None)
+
+        async def receive():
+            await asyncio.sleep(0.05)
+            body.set_result(b'{"late": true}')
+
+        task = asyncio.create_task(receive())
+        await quart_integration.async_snapshot_request()
+        await task
+
+        data = quart_integration.gather(None)
+        assert json.loads(data["raw_payload"]) == {"late": True}
+
+
+def test_quart_without_signals(monkeypatch):
+    monkeypatch.setattr(quart, "signals_available", False, raising=False)
+    fallback_app = quart.Quart("fallback")
+    original = fallback_app.log_exception
+
+    with pytest.warns(UserWarning, match="Signals in Quart are not available"):
+        QuartContextIntegration().init_app(fallback_app)
+
+    assert fallback_app.log_exception.keywords["original"] == original
+
+
+@pytest.mark.asyncio
+async def test_quart_budget_and_missing_internals():
+    context = MetadataLog({})
+    context.budget = Budget(0)
+
+    async with app.test_request_context("/exc", method="POST", headers={"Content-Type": "application/json"}):
+        data = quart_integration.gather(context)
+        assert data["raw_payload"].startswith("Loccer N/A; time budget exhausted")
+
+        # Body buffer internals are missing in other Quart versions, the capture degrades gracefully
+        quart.request.body = object()
+        await quart_integration.async_snapshot_request()
+        data = quart_integration.gather(None)
+        assert data["raw_payload"] is None
@@ -0,0 +1,114 @@
+import io
+import json
+
+import pytest
+
+import loccer
+from loccer.bases import MetadataLog
+from loccer.outputs.binary import (
+    BinaryEncoder, BinaryFileOutput, BinaryFormatError, BinaryReader, convert_to_json, iter_records, write_varint,
+    MAGIC
+)
+from loccer.outputs.file_stream import wait_for_rotation
+
+
+SAMPLE = {
+    "str": "value",
+    "long": "x" * 1000,
+    "unicode": "žluťoučký kůň",
+    "ints": [0, 1, -1, 127, 128, -129, 2**70, -(2**70)],
+    "float": 1.5,
+    "consts": [None, True, False],
+    "nested": {"a": [{"b": {}}], "1": []},
+}
+
+
+def _read(data: bytes):
+    return list(BinaryReader(io.BytesIO(data)))
+
+
+def test_roundtrip():
+    encoder = BinaryEncoder()
+    data = MAGIC + encoder.reset() + encoder.encode(SAMPLE) + encoder.encode(SAMPLE)
+
+    assert _read(data) == [SAMPLE, SAMPLE]
+    # Second record references the interned strings
+    assert len(encoder.encode(SAMPLE)) < len(data) / 2
+
+
+def test_invalid_data():
+    with pytest.raises(BinaryFormatError):
+        _read(b"ratata")
+
+    encoder = BinaryEncoder()
+    with pytest.raises(BinaryFormatError):
+        _read(MAGIC + encoder.reset() + encoder.encode(SAMPLE)[:-3])
+
+
+@pytest.mark.parametrize("cut", (1, 3, 10, 200))
+def test_truncated_record_body(cut):
+    encoder = BinaryEncoder()
+    reset = encoder.reset()
+    record = encoder.encode(SAMPLE)
+    # Record length is consistent with the truncated body, the encoded value itself is incomplete
+    body = record[1:] if record[0] < 0x80 else record[2:]
+    body = body[:-cut]
+    length = bytearray()
+    write_varint(length, len(body))
+
+    with pytest.raises(BinaryFormatError):
+        _read(MAGIC + reset + bytes(length) + body)
+
+
+def test_binary_file_output(tmp_path):
+    fpath = tmp_path / "errors.bin"
+
+    for session in range(2):
+        # String table is reset for every writer session appending to the same file
+        out = BinaryFileOutput(str(fpath), max_size=0)
+        out.output(MetadataLog({"session": session, **SAMPLE}))
+        out.close()
+
+    records = list(iter_records(str(fpath)))
+    assert [x["data"]["session"] for x in records] == [0, 1]
+    assert records[0]["data"]["nested"] == SAMPLE["nested"]
+
+    converted = io.StringIO()
+    assert convert_to_json(str(fpath), converted) == 2
+    assert [json.loads(x) for x in converted.getvalue().splitlines()] == records
+
+
+def test_binary_file_output_shared_file(tmp_path):
+    fpath = str(tmp_path / "errors.bin")
+    # Writers appending to the same file as if they were separate processes, each with its own string table
+    writers = [BinaryFileOutput(fpath, max_size=0) for _ in range(2)]
+
+    for idx in range(6):
+        writers[idx % 3 % 2].output(MetadataLog({"idx": idx, **SAMPLE}))
+
+    for out in writers:
+        out.close()
+
+    records = list(iter_records(fpath))
+    assert [x["data"]["idx"] for x in records] == list(range(6))
+    assert all(x["data"]["nested"] == SAMPLE["nested"] for x in records)
+
+
+def test_binary_file_output_rotation(tmp_path, in_memory):
+    fpath = tmp_path / "errors.bin"
+    out = BinaryFileOutput(str(fpath), max_size=4096, max_files=2)
+    lc = loccer.Loccer(output_handlers=(out, in_memory), integrations=(), suppress_exception=True)
+
+    for x in range(30):
+        with lc:
+            raise RuntimeError(f"binary {x}")
+
+    out.close()
+    wait_for_rotation(str(fpath))
+
+    records = []
+    for fname in (f"{fpath}.1.gz", f"{fpath}.0.gz", str(fpath)):
+        records.extend(iter_records(fname))
+
+    assert len(records) > 2
+    assert records == in_memory.logs[-len(records):]
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import loccer
+from loccer.bases import Integration
+from loccer.budget import Budget, CaptureBudget
+from loccer.integrations.asyncio_context import AsyncioContextIntegration
+
+
+class SlowIntegration(Integration):
+    NAME = "slow"
+
+    def __init__(self, delay: float, cooperative: bool = False):
+        self.delay = delay
+        self.cooperative = cooperative
+        self.calls = 0
+
+    def gather(self, context):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.cooperative:
+            context.budget.check()
+        return {"partial": True}
+
+
+class FastIntegration(Integration):
+    NAME = "fast"
+
+    def gather(self, context):
+        return {"fast": True}
+
+
+def test_budget_parent_deadline():
+    parent = Budget(0.01)
+    child = Budget(60, parent=parent)
+    assert child.deadline == parent.deadline
+    assert Budget(None).remaining() is None
+
+    time.sleep(0.02)
+    assert child.expired()
+    assert child.remaining() == 0
+
+
+def test_integration_timeout(in_memory):
+    slow = SlowIntegration(0.02)
+    lc = loccer.Loccer(
+        output_handlers=(in_memory,),
+        integrations=(slow, FastIntegration()),
+        suppress_exception=True,
+        budget=CaptureBudget(integration_timeout=0.01, total_timeout=None, max_timeouts=2)
+    )
+
+    for _ in range(3):
+        with lc:
+            raise RuntimeError("timeout")
+
+    first, second, third = (x["integrations"] for x in in_memory.logs)
+    # Data returned late is kept and the overrun is recorded
+    assert first["slow"] == {"partial": True}
+    assert first[loccer.BUDGET_MARKER]["slow"]["timeout"] is True
+    assert first[loccer.BUDGET_MARKER]["slow"]["disabled"] is False
+    assert "fast" not in first[loccer.BUDGET_MARKER]
+    assert first["fast"] == {"fast": True}
+
+    assert second[loccer.BUDGET_MARKER]["slow"]["disabled"] is True
+    assert third["slow"].startswith("DISABLED:")
+    assert loccer.BUDGET_MARKER not in third
+    assert slow.calls == 2
+
+    lc.budget.enable("slow")
+    assert not lc.budget.is_disabled("slow")
+
+
+def test_cooperative_timeout_and_total_budget(in_memory):
+    lc = loccer.Loccer(
+        output_handlers=(in_memory,),
+        integrations=(SlowIntegration(0.02, cooperative=True), FastIntegration()),
+        suppress_exception=True,
+        budget=CaptureBudget(integration_timeout=None, total_timeout=0.01, max_timeouts=None)
+    )
+
+    with lc:
+        raise RuntimeError("timeout")
+
+    data = in_memory.logs[0]["integrations"]
+    assert data["slow"].startswith("TIMEOUT: integration exceeded")
+    assert data["fast"].startswith("TIMEOUT: total capture time budget")
+    assert data[loccer.BUDGET_MARKER]["fast"]["skipped"] is True
+
+
+def test_asyncio_dump_coros_budget():
+    async def main():
+        tasks = [asyncio.create_task(asyncio.sleep(1)) for _ in range(10)]
+        try:
+            budget = Budget(0)
+            return AsyncioContextIntegration.dump_coros(budget=budget)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    data = asyncio.run(main())
+    assert data == {"...": "truncated after exceeding the time budget, 11 more tasks"}
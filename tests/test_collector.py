@@ -0,0 +1,127 @@
+import glob
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import pytest
+
+from loccer.bases import MetadataLog
+from loccer.collector import Collector
+from loccer.outputs.file_stream import wait_for_rotation
+from loccer.outputs.socket_output import SocketOutput
+
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="Unix domain sockets are not available")
+
+
+@pytest.fixture
+def short_tmp():
+    # Unix socket paths are limited to ~100 characters, pytest `tmp_path` can be longer
+    path = tempfile.mkdtemp(prefix="loccer-")
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path)
+
+
+def _start(collector):
+    thread = threading.Thread(target=collector.serve_forever, daemon=True)
+    thread.start()
+    assert collector.ready.wait(5)
+    return thread
+
+
+def _stop(collector, thread):
+    collector.shutdown()
+    thread.join(5)
+    assert not thread.is_alive()
+    wait_for_rotation()
+
+
+def _read_lines(fname):
+    with open(fname) as fd:
+        return [json.loads(x) for x in fd]
+
+
+def test_collector(short_tmp):
+    fname = os.path.join(short_tmp, "errors.log")
+    sock_path = os.path.join(short_tmp, "loccer.sock")
+    collector = Collector(fname, socket_path=sock_path, max_size=0, flush_interval=0.05)
+    thread = _start(collector)
+
+    out = SocketOutput(sock_path)
+    for idx in range(500):
+        out.output(MetadataLog({"idx": idx}))
+    # Large log does not fit into the socket buffer and is sent in parts
+    out.output(MetadataLog({"idx": "large", "payload": "x" * 2**20}))
+    assert out.flush(timeout=5)
+    out.close()
+
+    _stop(collector, thread)
+    assert not os.path.exists(sock_path)
+
+    lines = _read_lines(fname)
+    assert [x["data"]["idx"] for x in lines] == list(range(500)) + ["large"]
+    assert len(lines[-1]["data"]["payload"]) == 2**20
+    assert collector.received == 501
+    assert out.sent == 501
+    assert out.dropped == 0
+
+
+def test_socket_output_spill(short_tmp):
+    fname = os.path.join(short_tmp, "errors.log")
+    sock_path = os.path.join(short_tmp, "loccer.sock")
+
+    out = SocketOutput(sock_path, spill_max_events=3)
+    for idx in range(5):
+        out.output(MetadataLog({"idx": idx}))
+
+    assert out.spilled == 3
+    assert out.dropped == 2
+    assert out.flush(timeout=0) is False
+
+    collector = Collector(fname, socket_path=sock_path, max_size=2**10, max_files=100, flush_interval=0.01)
+    thread = _start(collector)
+
+    assert out.flush(timeout=5)
+    for idx in range(3, 50):
+        out.output(MetadataLog({"idx": idx, "padding": "x" * 100}))
+    assert out.flush(timeout=5)
+    out.close()
+    _stop(collector, thread)
+
+    assert collector.received == 50
+    assert glob.glob(fname + ".*.gz")
+    records = _read_lines(fname)
+    for backup in glob.glob(fname + ".*.gz"):
+        with gzip.open(backup, "rt") as fd:
+            records.extend(json.loads(x) for x in fd)
+    assert sorted(x["data"]["idx"] for x in records) == list(range(50))
+
+
+def test_collector_already_running(short_tmp):
+    fname = os.path.join(short_tmp, "errors.log")
+    sock_path = os.path.join(short_tmp, "loccer.sock")
+    collector = Collector(fname, socket_path=sock_path)
+    thread = _start(collector)
+
+    with pytest.raises(RuntimeError):
+        Collector(fname, socket_path=sock_path).serve_forever()
+
+    _stop(collector, thread)
+
+
+def test_collector_refuses_non_socket_path(short_tmp):
+    fname = os.path.join(short_tmp, "errors.log")
+    with open(fname, "w") as fd:
+        fd.write("existing log\n")
+
+    # Socket path pointing to a regular file by mistake must not delete the file
+    with pytest.raises(RuntimeError):
+        Collector(fname, socket_path=fname).serve_forever()
+
+    with open(fname) as fd:
+        assert fd.read() == "existing log\n"
@@ -1,7 +1,18 @@
+import sys
+import threading
+import time
+import traceback
 import uuid
 from unittest.mock import patch
 
+import pytest
+
 import loccer
+from loccer import bases
+from loccer.budget import CaptureBudget
+from loccer.dedup import Deduplicator
+from loccer.outputs.queued import QueuedOutput
+from loccer.stats import PipelineStats
 
 
 def test_capture_exception_call(in_memory):
@@ -87,3 +98,368 @@ def test_log_metadata(in_memory):
     assert log["loccer_type"] == "metadata_log"
     assert log["data"] == log_data
     assert isinstance(log["integrations"], dict)
+
+
+def _raise_from_same_place(msg):
+    raise RuntimeError(msg)
+
+
+def test_fingerprint(in_memory):
+    for msg in ("first", "second"):
+        with loccer.capture_exception:
+            _raise_from_same_place(msg)
+
+    with loccer.capture_exception:
+        raise RuntimeError("other place")
+
+    fingerprints = [x["fingerprint"] for x in in_memory.logs]
+    assert fingerprints[0] == fingerprints[1]
+    assert fingerprints[0] != fingerprints[2]
+
+
+def test_dedup(in_memory):
+    lc = loccer.Loccer(
+        output_handlers=(in_memory,),
+        integrations=(),
+        suppress_exception=True,
+        dedup=Deduplicator(window=60)
+    )
+
+    with patch.object(bases.ExceptionData, "capture_frames") as capture_locals:
+        for x in range(5):
+            with lc:
+                _raise_from_same_place(str(x))
+
+        assert capture_locals.call_count == 1
+
+    assert len(in_memory.logs) == 1
+    assert in_memory.logs[0]["msg"] == "0"
+
+    lc.flush()
+    assert len(in_memory.logs) == 2
+    summary = in_memory.logs[1]
+    assert summary["loccer_type"] == "metadata_log"
+    assert summary["data"]["suppressed"] == 4
+    assert summary["data"]["fingerprint"] == in_memory.logs[0]["fingerprint"]
+
+    # Window has been closed by the flush, next occurrence is emitted in full again
+    with lc:
+        _raise_from_same_place("again")
+
+    assert in_memory.logs[-1]["msg"] == "again"
+
+
+def test_dedup_flush_at_exit(in_memory):
+    with patch("atexit.register") as register:
+        lc = loccer.Loccer(output_handlers=(in_memory,), integrations=(), suppress_exception=True, dedup=Deduplicator())
+
+    register.assert_called_once_with(lc.flush)
+    for x in range(2):
+        with lc:
+            _raise_from_same_place(str(x))
+
+    register.call_args[0][0]()
+    assert in_memory.logs[-1]["data"]["suppressed"] == 1
+
+
+class FailingIntegration(bases.Integration):
+    NAME = "failing"
+
+    def gather(self, context):
+        if isinstance(context, bases.ExceptionData):
+            raise RuntimeError("integration failure")
+        return {}
+
+
+def test_stats(in_memory, integration):
+    lc = loccer.Loccer(
+        output_handlers=(in_memory,),
+        integrations=(integration, FailingIntegration()),
+        suppress_exception=True,
+        stats=PipelineStats(emit_interval=3600)
+    )
+
+    for x in range(3):
+        with lc:
+            _raise_from_same_place(str(x))
+    lc.log_metadata({"key": "value"})
+
+    stats = lc.stats()
+    assert stats["counters"]["events"] == 3
+    assert stats["counters"]["metadata_events"] == 1
+    assert stats["counters"]["integration_errors"] == 3
+    assert stats["stages"]["capture"]["count"] == 3
+    assert stats["stages"]["integration:pytest"]["count"] == 4
+    assert stats["stages"]["integration:failing"]["count"] == 4
+    assert stats["stages"]["serialize"]["count"] == 4
+    assert stats["stages"]["output:InMemoryOutput"]["count"] == 4
+    assert "filter" not in stats["stages"]
+
+    # Interval has not elapsed yet, stats are emitted only by the flush
+    assert len(in_memory.logs) == 4
+    lc.flush()
+    assert in_memory.logs[-1]["data"]["loccer_stats"]["counters"]["events"] == 3
+
+    assert loccer.Loccer(output_handlers=(in_memory,), integrations=()).stats() is None
+
+
+
+def test_stats_serialization_deferred():
+    class _SerializingOutput(bases.OutputBase):
+        def __init__(self):
+            self.serialized_by = []
+
+        def output(self, exc):
+            # JSON has not been built by the raising thread
+            assert exc._json_cache is None
+            exc.cached_json()
+            self.serialized_by.append(threading.current_thread())
+
+    handler = _SerializingOutput()
+    queued = QueuedOutput(handler)
+    lc = loccer.Loccer(output_handlers=(queued,), integrations=(), suppress_exception=True, stats=PipelineStats())
+
+    with lc:
+        raise ValueError("deferred")
+    queued.flush()
+    queued.close()
+
+    assert queued.errors == 0
+    assert handler.serialized_by and handler.serialized_by[0] is not threading.current_thread()
+    assert lc.stats()["stages"]["serialize"]["count"] == 1
+
+REFERENCED_GLOBAL = {"referenced": True}
+UNREFERENCED_GLOBAL = "unreferenced"
+
+
+def _use_referenced_global():
+    return REFERENCED_GLOBAL["missing"]
+
+
+@pytest.mark.parametrize("mode", ("referenced", "none"))
+def test_globals_capture_mode(in_memory, mode):
+    lc = loccer.Loccer(output_handlers=(in_memory,), integrations=(), suppress_exception=True, globals_capture=mode)
+
+    for _ in range(2):
+        with lc:
+            _use_referenced_global()
+
+    for log in in_memory.logs:
+        if mode == "none":
+            assert "globals" not in log
+        else:
+            # Functions and modules such as `_use_referenced_global` or `loccer` are skipped
+            assert log["globals"] == {"REFERENCED_GLOBAL": "{'referenced': True}"}
+
+
+def _use_late_global():
+    return LATE_GLOBAL["missing"]
+
+
+def test_globals_capture_late_binding(in_memory):
+    lc = loccer.Loccer(output_handlers=(in_memory,), integrations=(), suppress_exception=True, globals_capture="referenced")
+
+    with lc:
+        _use_late_global()
+    assert in_memory.logs[-1]["globals"] == {}
+
+    # Global bound after the first capture is resolved on the next one
+    globals()["LATE_GLOBAL"] = {"late": True}
+    try:
+        with lc:
+            _use_late_global()
+    finally:
+        del globals()["LATE_GLOBAL"]
+    assert in_memory.logs[-1]["globals"] == {"LATE_GLOBAL": "{'late': True}"}
+
+
+def test_globals_capture_invalid_mode():
+    with pytest.raises(ValueError):
+        loccer.Loccer(output_handlers=(), integrations=(), globals_capture="referencd")
+
+
+def _recurse(depth):
+    if depth:
+        return _recurse(depth - 1)
+    raise RecursionError("deep recursion")
+
+
+def test_recursion_collapse(in_memory):
+    with loccer.capture_exception:
+        _recurse(500)
+
+    frames = in_memory.logs[0]["frames"]
+    recursive = [x for x in frames if x["name"] == "_recurse"]
+    assert len(recursive) == 2
+    assert recursive[0]["repeated"] == 499
+    assert recursive[0]["locals"] == {"depth": "500"}
+    assert recursive[1]["line"] == 'raise RecursionError("deep recursion")'
+    assert "repeated" not in recursive[1]
+
+
+
+def test_recursion_collapse_formatted():
+    try:
+        _recurse(500)
+    except RecursionError as exc:
+        exc_data = bases.ExceptionData.from_exception(exc)
+        expected = "".join(traceback.TracebackException.from_exception(exc).format())
+
+    assert len(exc_data.frames) == 3
+    assert len(exc_data.stack) == 502
+    formatted = "".join(exc_data.format())
+    assert "[Previous line repeated 497 more times]" in formatted
+    assert _formatted_frames(formatted) == _formatted_frames(expected)
+
+
+def test_frame_as_json_compatibility():
+    summary = traceback.FrameSummary("module.py", 10, "func", line="x = 1", locals={"x": 1})
+    summary.locals = {"x": "1"}
+    assert bases.frame_as_json(summary) == {
+        "filename": "module.py", "lineno": 10, "name": "func", "line": "x = 1", "locals": {"x": "1"}
+    }
+
+    record = bases.FrameRecord("module.py", 10, "func", line="x = 1", repeated=2)
+    assert bases.frame_as_json(record) == record.as_json()
+
+def test_exception_data_traceback_compatibility():
+    try:
+        try:
+            _recurse(3)
+        except RecursionError as exc:
+            raise ValueError("chained") from exc
+    except ValueError as exc:
+        exc_data = bases.ExceptionData.from_exception(exc, capture_locals=True, collapse_recursion=False)
+
+    assert len(exc_data.frames) == 1
+    assert isinstance(exc_data.frames[0], bases.FrameRecord)
+    assert exc_data.stack[0].name == "test_exception_data_traceback_compatibility"
+
+    formatted = "".join(exc_data.format())
+    assert 'raise ValueError("chained") from exc' in formatted
+    assert "RecursionError: deep recursion" in formatted
+    assert formatted.rstrip().endswith("ValueError: chained")
+
+
+def test_exception_data_chained_frames():
+    try:
+        try:
+            _recurse(3)
+        except RecursionError as exc:
+            raise ValueError("chained") from exc
+    except ValueError as exc:
+        captured = exc
+
+    exc_data = bases.ExceptionData.from_exception(captured, collapse_recursion=False)
+    formatted = "".join(exc_data.format())
+    expected = "".join(traceback.TracebackException.from_exception(captured).format())
+
+    assert _formatted_frames(formatted) == _formatted_frames(expected)
+    assert formatted.count('raise RecursionError("deep recursion")') == 1
+
+
+@pytest.mark.skipif(sys.version_info < (3, 11), reason="Exception groups require python 3.11")
+def test_exception_data_group_frames():
+    def _raise_group():
+        try:
+            _recurse(2)
+        except RecursionError as exc:
+            raise ExceptionGroup("group", [exc, KeyError("member")])
+
+    try:
+        _raise_group()
+    except Exception as exc:
+        captured = exc
+
+    exc_data = bases.ExceptionData.from_exception(captured, collapse_recursion=False)
+    expected = "".join(traceback.TracebackException.from_exception(captured).format())
+
+    assert _formatted_frames("".join(exc_data.format())) == _formatted_frames(expected)
+    assert len(exc_data.exceptions[0].stack) == 4
+
+
+def test_exception_data_deferred_chained_frames():
+    try:
+        try:
+            _recurse(3)
+        except RecursionError:
+            raise ValueError("context")
+    except ValueError as exc:
+        exc_data = bases.ExceptionData.from_exception(exc, defer_capture=True, collapse_recursion=False)
+        expected = "".join(traceback.TracebackException.from_exception(exc).format())
+
+    assert exc_data.__context__.stack == []
+    exc_data.capture_deferred()
+    assert len(exc_data.__context__.stack) == 5
+    assert _formatted_frames("".join(exc_data.format())) == _formatted_frames(expected)
+
+
+def _formatted_frames(formatted):
+    # Column ranges (`^^^` markers) are not captured by loccer, compare only the frame locations
+    return [x.strip() for x in formatted.splitlines() if x.strip().startswith("File ")]
+
+
+class ThreadIntegration(bases.Integration):
+    THREAD_SAFE = True
+
+    def __init__(self, name, barrier=None, release=None):
+        self.NAME = name
+        self.barrier = barrier
+        self.release = release
+
+    def gather(self, context):
+        if self.barrier is not None:
+            # Passes only if the integrations sharing the barrier run at the same time
+            self.barrier.wait()
+        if self.release is not None:
+            self.release.wait(5)
+        return {"thread": threading.current_thread().name}
+
+
+def test_concurrent_integrations(in_memory, integration):
+    barrier = threading.Barrier(2, timeout=5)
+    lc = loccer.Loccer(
+        output_handlers=(in_memory,),
+        integrations=(ThreadIntegration("slow", barrier), integration, ThreadIntegration("fast", barrier)),
+        suppress_exception=True,
+        concurrent_integrations=True
+    )
+
+    with lc:
+        raise RuntimeError("concurrent")
+
+    log = in_memory.logs[0]
+    assert list(log["integrations"].keys()) == ["slow", "pytest", "fast"]
+    assert log["integrations"]["slow"]["thread"].startswith("loccer-integration")
+    assert log["integrations"]["pytest"] == {}
+    assert log["frames"][-1]["name"] == "test_concurrent_integrations"
+    assert log["integrations"]["fast"]["thread"].startswith("loccer-integration")
+
+
+def test_hung_integration_skipped(in_memory):
+    release = threading.Event()
+    hung = ThreadIntegration("hung", release=release)
+    lc = loccer.Loccer(
+        output_handlers=(in_memory,),
+        integrations=(hung,),
+        suppress_exception=True,
+        concurrent_integrations=True,
+        budget=CaptureBudget(integration_timeout=0.01)
+    )
+
+    try:
+        for _ in range(2):
+            with lc:
+                raise RuntimeError("hung")
+
+        assert in_memory.logs[0]["integrations"]["hung"].startswith("TIMEOUT")
+        # Previous call still occupies a worker of the pool, the integration is not submitted again
+        assert in_memory.logs[1]["integrations"]["hung"].startswith("SKIPPED")
+    finally:
+        release.set()
+
+    for _ in range(100):
+        if hung not in loccer._HUNG_INTEGRATIONS:
+            break
+        time.sleep(0.01)
+    assert hung not in loccer._HUNG_INTEGRATIONS
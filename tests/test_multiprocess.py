@@ -0,0 +1,116 @@
+import glob
+import gzip
+import json
+import os
+
+import pytest
+
+from loccer.__main__ import main
+from loccer.bases import MetadataLog
+from loccer.outputs.multiprocess import MultiProcessFileOutput, merge_segments, segment_name
+
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="fork is not available")
+
+
+def _fork_writers(out, processes, records):
+    pids = []
+    for proc in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for idx in range(records):
+                    out.output(MetadataLog({"proc": proc, "idx": idx, "padding": "x" * 200}))
+            finally:
+                os._exit(0)
+        pids.append(pid)
+
+    for pid in pids:
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+
+    return pids
+
+
+def _read_records(fname):
+    records = []
+    for path in glob.glob(fname + "*"):
+        if path.endswith(".gz"):
+            with gzip.open(path, "rt") as fd:
+                content = fd.read()
+        elif path == fname:
+            with open(path) as fd:
+                content = fd.read()
+        else:
+            continue
+
+        records.extend(json.loads(x) for x in content.splitlines())
+    return records
+
+
+def test_shared_file_output(tmp_path):
+    fname = str(tmp_path / "errors.log")
+    out = MultiProcessFileOutput(fname, max_size=2**14, max_files=100)
+
+    _fork_writers(out, processes=4, records=100)
+
+    records = _read_records(fname)
+    assert len(records) == 400
+    assert {(x["data"]["proc"], x["data"]["idx"]) for x in records} == {(p, i) for p in range(4) for i in range(100)}
+    assert glob.glob(fname + ".*.gz")
+    assert not glob.glob(fname + "*.rotating")
+
+
+def test_segments_output(tmp_path):
+    fname = str(tmp_path / "errors.log")
+    out = MultiProcessFileOutput(fname, max_size=0, segments=True)
+
+    pids = _fork_writers(out, processes=3, records=20)
+    for pid in pids:
+        assert os.path.exists(segment_name(fname, pid))
+    assert not os.path.exists(fname)
+
+    assert main(["merge", fname]) == 0
+    assert not glob.glob(fname + ".*.segment*")
+
+    with open(fname) as fd:
+        records = [json.loads(x) for x in fd]
+    assert len(records) == 60
+    timestamps = [x["timestamp"] for x in records]
+    assert timestamps == sorted(timestamps)
+
+    # Process keeps writing into a fresh segment after its segment has been merged
+    out.output(MetadataLog({"after": "merge"}))
+    out.output(MetadataLog({"after": "merge"}))
+    assert merge_segments(fname, pids=(os.getpid(),)) == 2
+    out.close()
+
+
+def test_segments_indented_output(tmp_path):
+    fname = str(tmp_path / "errors.log")
+    out = MultiProcessFileOutput(fname, max_size=0, compressed=False, segments=True)
+
+    _fork_writers(out, processes=2, records=5)
+    out.output(MetadataLog({"after": "fork"}))
+    out.close()
+
+    # Indented records span many lines, merge counts and orders the whole records
+    assert merge_segments(fname) == 11
+
+    with open(fname) as fd:
+        content = fd.read()
+    decoder = json.JSONDecoder()
+    records, pos = [], 0
+    while content[pos:].strip():
+        pos += len(content[pos:]) - len(content[pos:].lstrip())
+        record, pos = decoder.raw_decode(content, pos)
+        records.append(record)
+
+    assert len(records) == 11
+    timestamps = [x["timestamp"] for x in records]
+    assert timestamps == sorted(timestamps)
+
+
+def test_invalid_multiprocess_output(tmp_path):
+    with pytest.raises(ValueError):
+        MultiProcessFileOutput(str(tmp_path / "errors.log"), max_size=-1)
@@ -1,8 +1,24 @@
+import datetime
+import gc
 import gzip
+import io
+import json
+import os
+import threading
+import time
+import weakref
+from unittest.mock import patch
 
 import pytest
 
-from loccer.outputs.file_stream import rotate, JSONFileOutput
+from loccer.bases import ExceptionData, MetadataLog
+from loccer.outputs import file_stream
+from loccer.outputs.file_stream import (
+    rotate, wait_for_rotation, encode_line, JSONFileOutput, JSONStreamOutput, COMPRESSED_DUMP_KWARGS
+)
+from loccer.outputs.misc import InMemoryOutput, NullOutput, RingBufferOutput
+from loccer.outputs import queued
+from loccer.outputs.queued import QueuedOutput
 
 
 def test_file_rotation(tmp_path):
@@ -53,9 +69,374 @@ def test_file_rotation(tmp_path):
     assert not (tmp_path/f"{fname}.2.gz").exists()
 
 
+@pytest.mark.parametrize("max_files", (0, 1, 3))
+def test_background_file_rotation(tmp_path, max_files):
+    fpath = tmp_path / "test_file.log"
+
+    for x in range(5):
+        fpath.write_text(f"content {x}")
+        assert rotate(str(fpath), 5, max_files=max_files, background=True) is True
+        # Logging continues into a fresh file while the segment is compressed
+        assert fpath.exists()
+        assert fpath.read_text() == ""
+        wait_for_rotation(str(fpath))
+
+    wait_for_rotation(str(fpath))
+    backups = sorted(x.name for x in tmp_path.iterdir() if x.name != fpath.name)
+    assert backups == [f"test_file.log.{x}.gz" for x in range(max_files)]
+
+    for x in range(max_files):
+        payload = gzip.decompress((tmp_path / f"test_file.log.{x}.gz").read_bytes()).decode()
+        assert payload == f"content {4-x}"
+
+
+def test_background_rotation_does_not_block(tmp_path):
+    fpath = tmp_path / "test_file.log"
+    release = threading.Event()
+    original = file_stream._shift_backups
+
+    def _slow_shift(*args):
+        release.wait(5)
+        original(*args)
+
+    with patch.object(file_stream, "_shift_backups", _slow_shift):
+        fpath.write_text("first")
+        assert rotate(str(fpath), 1, background=True) is True
+        # Previous segment is still being compressed, rotation is skipped instead of waiting for it
+        fpath.write_text("second")
+        assert rotate(str(fpath), 1, background=True) is False
+        release.set()
+        wait_for_rotation(str(fpath))
+
+    assert rotate(str(fpath), 1, background=True) is True
+    wait_for_rotation(str(fpath))
+    assert gzip.decompress((tmp_path / "test_file.log.0.gz").read_bytes()) == b"second"
+
+
+def test_failed_rotation_is_not_pending(tmp_path):
+    fpath = tmp_path / "test_file.log"
+    fpath.write_text("content")
+
+    with patch.object(file_stream, "_shift_backups", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            rotate(str(fpath), 1)
+
+    assert str(fpath) not in file_stream._PENDING_ROTATIONS
+    # Leftover segment is compressed by the next rotation
+    fpath.write_text("next")
+    assert rotate(str(fpath), 1) is True
+    assert gzip.decompress((tmp_path / "test_file.log.1.gz").read_bytes()) == b"content"
+
+
 def test_invalid_json_file_output():
     with pytest.raises(ValueError):
         JSONFileOutput("ratata", max_size=-1)
 
     with pytest.raises(ValueError):
         JSONFileOutput("ratata", max_files=-1)
+
+
+class BlockingOutput(InMemoryOutput):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def output(self, exc) -> None:
+        self.release.wait(5)
+        super().output(exc)
+
+
+@pytest.mark.parametrize("overflow, expected", (
+    ("drop_newest", ["0", "1"]),
+    ("drop_oldest", ["0", "3"]),
+))
+def test_queued_output_overflow(overflow, expected):
+    inner = BlockingOutput()
+    out = QueuedOutput(inner, max_size=1, overflow=overflow)
+
+    try:
+        out.output(MetadataLog("0"))
+        # Wait for the writer thread to pick up the first log, it would block inside the inner handler
+        for _ in range(100):
+            if out.queued == 0:
+                break
+            time.sleep(0.01)
+
+        for x in range(1, 4):
+            out.output(MetadataLog(str(x)))
+
+        assert out.dropped == 2
+        inner.release.set()
+        assert out.flush(timeout=5) is True
+        assert [x["data"] for x in inner.logs] == expected
+    finally:
+        inner.release.set()
+        out.close()
+
+
+def test_queued_output_close():
+    inner = InMemoryOutput()
+    out = QueuedOutput(inner, overflow="block")
+    for x in range(50):
+        out.output(MetadataLog(x))
+
+    out.close()
+    assert len(inner.logs) == 50
+    assert out.dropped == 0
+    assert out.processed == 50
+
+    # Outputs after closing are processed synchronously
+    out.output(MetadataLog("late"))
+    assert inner.logs[-1]["data"] == "late"
+
+
+def test_queued_output_released(monkeypatch):
+    monkeypatch.setattr(queued, "WRITER_IDLE_TIMEOUT", 0.01)
+    inner = InMemoryOutput()
+    out = QueuedOutput(inner)
+    out.output(MetadataLog("0"))
+    assert out.flush(timeout=5) is True
+
+    thread = out._thread
+    thread.join(5)
+    assert not thread.is_alive()
+
+    # Unused output is not kept alive by the exit handler nor by the idle writer thread
+    ref = weakref.ref(out)
+    del out
+    gc.collect()
+    assert ref() is None
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork is not available")
+def test_queued_output_after_fork():
+    inner = BlockingOutput()
+    out = QueuedOutput(inner)
+    try:
+        # Writer thread of the parent is stuck in the handler while holding a queued log
+        out.output(MetadataLog("parent"))
+        out.output(MetadataLog("parent"))
+
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                inner.release.set()
+                out.output(MetadataLog("child"))
+                if out.flush(timeout=5) and [x["data"] for x in inner.logs] == ["child"]:
+                    code = 0
+            finally:
+                os._exit(code)
+
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+    finally:
+        inner.release.set()
+        out.close()
+
+    assert [x["data"] for x in inner.logs] == ["parent", "parent"]
+
+
+def test_invalid_queued_output():
+    with pytest.raises(ValueError):
+        QueuedOutput(NullOutput(), max_size=0)
+
+    with pytest.raises(ValueError):
+        QueuedOutput(NullOutput(), overflow="ratata")
+
+
+def test_persistent_json_file_output(tmp_path):
+    fpath = tmp_path / "persistent.log"
+    out = JSONFileOutput(str(fpath), max_size=0, persistent=True, flush_interval=None, flush_bytes=2**20, reopen_interval=0)
+
+    try:
+        out.output(MetadataLog("first"))
+        assert not fpath.exists() or fpath.read_text() == ""
+
+        out.flush()
+        assert [json.loads(x)["data"] for x in fpath.read_text().splitlines()] == ["first"]
+
+        # Simulate external logrotate moving the file away
+        fpath.rename(tmp_path / "persistent.log.moved")
+        out.output(MetadataLog("second"))
+        out.flush()
+        assert [json.loads(x)["data"] for x in fpath.read_text().splitlines()] == ["second"]
+    finally:
+        out.close()
+
+
+def test_persistent_json_file_output_reopen_interval(tmp_path):
+    fpath = tmp_path / "persistent.log"
+    out = JSONFileOutput(str(fpath), max_size=0, persistent=True, flush_interval=0, reopen_interval=3600)
+
+    try:
+        with patch("os.stat", wraps=os.stat) as stat:
+            for x in range(50):
+                out.output(MetadataLog(x))
+
+        # Logrotate check is done at most once per interval instead of once per event
+        assert stat.call_count <= 1
+        assert len(fpath.read_text().splitlines()) == 50
+    finally:
+        out.close()
+
+
+def test_persistent_json_file_output_rotation(tmp_path):
+    fpath = tmp_path / "persistent.log"
+    out = JSONFileOutput(str(fpath), max_size=100, max_files=2, persistent=True, flush_interval=0)
+
+    try:
+        for x in range(10):
+            out.output(MetadataLog("x" * 20))
+
+        wait_for_rotation(str(fpath))
+        assert (tmp_path / "persistent.log.0.gz").exists()
+        # Rotation is skipped while the previous segment is compressed, the live file can temporarily exceed max size
+        assert len(fpath.read_text().splitlines()) < 10
+    finally:
+        out.close()
+
+
+def test_persistent_json_file_output_interval(tmp_path):
+    fpath = tmp_path / "persistent.log"
+    out = JSONFileOutput(str(fpath), max_size=0, persistent=True, flush_interval=0.01)
+
+    try:
+        out.output(MetadataLog("interval"))
+        for _ in range(100):
+            if fpath.exists() and fpath.read_text():
+                break
+            time.sleep(0.01)
+
+        assert json.loads(fpath.read_text())["data"] == "interval"
+    finally:
+        out.close()
+
+
+def test_serialize_once_fan_out(tmp_path):
+    as_json_calls = 0
+
+    class CountingLog(MetadataLog):
+        def as_json(self):
+            nonlocal as_json_calls
+            as_json_calls += 1
+            return super().as_json()
+
+    streams = [io.StringIO() for _ in range(3)]
+    handlers = [JSONStreamOutput(fd=x) for x in streams] + [
+        InMemoryOutput(),
+        JSONFileOutput(str(tmp_path / "fan_out.log"), persistent=True, flush_interval=0),
+    ]
+
+    log = CountingLog({"a": "b"})
+    with patch("loccer.outputs.file_stream.json.dumps", wraps=json.dumps) as dumps:
+        for handler in handlers:
+            handler.output(log)
+
+    handlers[-1].close()
+    assert as_json_calls == 1
+    assert dumps.call_count == 1
+    assert len({x.getvalue() for x in streams}) == 1
+    assert (tmp_path / "fan_out.log").read_text() == streams[0].getvalue()
+
+
+@pytest.mark.parametrize("dump_kwargs", (COMPRESSED_DUMP_KWARGS, {**COMPRESSED_DUMP_KWARGS, "ensure_ascii": False}))
+def test_exception_frames_streamed(dump_kwargs):
+    def _recurse(depth, text):
+        if depth:
+            return _recurse(depth - 1, text)
+        raise ValueError(text)
+
+    def _capture():
+        try:
+            _recurse(10, "žluťoučký \"kůň\"")
+        except ValueError as exc:
+            return ExceptionData.from_exception(exc, capture_locals=True, globals_capture="referenced")
+
+    streamed = _capture()
+    line = encode_line(streamed, dump_kwargs)
+    # Frames are encoded directly from the records, the JSON representation is not built
+    assert streamed._json_cache is None
+
+    materialized = _capture()
+    materialized.ts = streamed.ts
+    materialized.cached_json()
+    assert encode_line(materialized, dump_kwargs) == line
+    assert json.loads(line)["frames"][1]["repeated"] == 9
+
+
+def test_in_memory_output_isolated_from_shared_cache():
+    log = MetadataLog({"a": "b"})
+    first, second = InMemoryOutput(), InMemoryOutput()
+    first.output(log)
+    second.output(log)
+
+    first.logs[0]["data"]["a"] = "mutated"
+    assert second.logs[0]["data"] == {"a": "b"}
+    assert log.cached_json()["data"] == {"a": "b"}
+
+
+def test_in_memory_output_uncopyable_values():
+    lock = threading.Lock()
+    log = MetadataLog({"lock": lock, "nested": {"a": "b"}})
+    out = InMemoryOutput()
+    out.output(log)
+
+    assert out.logs[0]["data"]["lock"] is lock
+    out.logs[0]["data"]["nested"]["a"] = "mutated"
+    assert log.cached_json()["data"]["nested"] == {"a": "b"}
+
+
+def test_log_subclass_without_base_init():
+    class CustomLog(MetadataLog):
+        def __init__(self, data):
+            # Does not call `super().__init__`
+            self.data = data
+            self.ts = datetime.datetime.utcnow()
+            self.integrations_data = {}
+
+    log = CustomLog("custom")
+    assert log.budget is None
+    out = InMemoryOutput()
+    out.output(log)
+    assert out.logs[0]["data"] == "custom"
+    assert encode_line(log, COMPRESSED_DUMP_KWARGS) == encode_line(log, COMPRESSED_DUMP_KWARGS)
+    log.invalidate_cache()
+
+
+def test_ring_buffer_output_events():
+    out = RingBufferOutput(max_events=3)
+    for x in range(10):
+        out.output(MetadataLog(x))
+
+    assert len(out) == 3
+    assert out.evicted == 7
+    assert [x["data"] for x in out.snapshot()] == [7, 8, 9]
+    assert out.logs == out.snapshot()
+
+    out.clear()
+    assert out.snapshot() == []
+    assert out.size == 0
+
+
+def test_ring_buffer_output_bytes():
+    log_size = len(MetadataLog("x" * 100).cached_json()["data"])
+    out = RingBufferOutput(max_events=None, max_bytes=log_size * 5)
+
+    for x in range(20):
+        out.output(MetadataLog(str(x) * 100))
+
+    assert 0 < len(out) < 5
+    assert out.size <= log_size * 5
+    assert out.snapshot()[-1]["data"] == "19" * 100
+
+    out.output(MetadataLog("x" * log_size * 10))
+    assert out.dropped == 1
+
+
+def test_invalid_ring_buffer_output():
+    with pytest.raises(ValueError):
+        RingBufferOutput(max_events=None, max_bytes=None)
+
+    with pytest.raises(ValueError):
+        RingBufferOutput(max_events=0)
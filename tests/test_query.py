@@ -0,0 +1,114 @@
+import datetime
+import json
+import os
+
+import loccer
+from loccer.__main__ import main
+from loccer.bases import MetadataLog
+from loccer.outputs.file_stream import JSONFileOutput, wait_for_rotation
+from loccer.query import LogIndex, log_files, query
+
+
+def _write_logs(fpath, count, **kwargs):
+    out = JSONFileOutput(str(fpath), **kwargs)
+    lc = loccer.Loccer(output_handlers=(out,), integrations=(), suppress_exception=True)
+
+    for x in range(count):
+        with lc:
+            if x % 2:
+                raise ValueError(f"value {x}")
+            else:
+                raise KeyError(f"key {x}")
+
+        lc.log_metadata({"idx": x})
+
+    wait_for_rotation(str(fpath))
+
+
+def test_incremental_index(tmp_path):
+    fpath = tmp_path / "errors.log"
+    _write_logs(fpath, 4, max_size=0)
+
+    index = LogIndex(str(fpath))
+    assert index.update() == 8
+    assert index.update() == 0
+
+    _write_logs(fpath, 2, max_size=0)
+    index = LogIndex(str(fpath))
+    assert index.update() == 4
+    assert len(index.entries) == 12
+
+    # Log file replaced, index must be rebuilt
+    fpath.unlink()
+    _write_logs(fpath, 1, max_size=0)
+    assert LogIndex(str(fpath)).update() == 2
+
+
+def test_query_with_backups(tmp_path):
+    fpath = tmp_path / "errors.log"
+    _write_logs(fpath, 40, max_size=20000, max_files=5)
+    assert len(log_files(str(fpath))) > 1
+
+    all_logs = list(query(str(fpath)))
+    assert len(all_logs) == 80
+    timestamps = [x["timestamp"] for x in all_logs]
+    assert timestamps == sorted(timestamps)
+
+    errors = list(query(str(fpath), exc_type="ValueError"))
+    assert len(errors) == 20
+    assert all(x["exc_type"] == "ValueError" for x in errors)
+
+    metadata = list(query(str(fpath), loccer_type="metadata_log", since=timestamps[10], until=timestamps[19]))
+    assert [x["data"]["idx"] for x in metadata] == [5, 6, 7, 8, 9]
+
+    fingerprint = errors[0]["fingerprint"]
+    assert len(list(query(str(fpath), fingerprint=fingerprint))) == 20
+
+
+def test_backup_indexes_renamed_on_rotation(tmp_path):
+    fpath = tmp_path / "errors.log"
+    _write_logs(fpath, 20, max_size=5000, max_files=20)
+    list(query(str(fpath)))
+    indexed = len(log_files(str(fpath))) - 1
+
+    _write_logs(fpath, 10, max_size=5000, max_files=20)
+    backups = log_files(str(fpath))[:-1]
+    assert len(backups) > indexed
+    # Indexes of the shifted backups are still valid, only the new backups are indexed
+    valid = [x for x in backups if os.path.exists(x + ".idx") and LogIndex(x)._load(LogIndex(x)._identity())]
+    assert len(valid) == indexed
+
+    assert len(list(query(str(fpath)))) == 60
+
+
+def test_indented_logs(tmp_path):
+    fpath = tmp_path / "errors.log"
+    _write_logs(fpath, 3, max_size=0, compressed=False)
+
+    index = LogIndex(str(fpath))
+    assert index.update() == 6
+    assert [x["exc_type"] for x in query(str(fpath), loccer_type="exception")] == ["KeyError", "ValueError", "KeyError"]
+
+
+def test_timestamp_filters(tmp_path):
+    fpath = tmp_path / "errors.log"
+    _write_logs(fpath, 2, max_size=0)
+    logs = list(query(str(fpath)))
+
+    first = datetime.datetime.fromisoformat(logs[0]["timestamp"])
+    # Timezone aware datetimes and strings in other ISO formats are normalized
+    aware = first.replace(tzinfo=datetime.timezone.utc)
+    assert len(list(query(str(fpath), since=aware))) == 4
+    assert len(list(query(str(fpath), until=(first - datetime.timedelta(seconds=1)).isoformat(sep=" ")))) == 0
+    assert len(list(query(str(fpath), since=(first + datetime.timedelta(days=1)).date().isoformat()))) == 0
+
+
+def test_query_cli(tmp_path, capsys):
+    fpath = tmp_path / "errors.log"
+    out = JSONFileOutput(str(fpath), max_size=0)
+    out.output(MetadataLog({"cli": True}))
+
+    assert main(["query", str(fpath), "--type", "metadata_log", "--limit", "1"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["data"] == {"cli": True}
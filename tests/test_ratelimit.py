@@ -0,0 +1,68 @@
+from unittest.mock import patch
+
+import pytest
+
+import loccer
+from loccer import bases
+from loccer.ratelimit import RateLimiter, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1, burst=2, now=0)
+    assert bucket.consume(now=0) is True
+    assert bucket.consume(now=0) is True
+    assert bucket.consume(now=0) is False
+    assert bucket.consume(now=0.5) is False
+    assert bucket.consume(now=1.5) is True
+
+
+def test_per_fingerprint_limit():
+    limiter = RateLimiter(rate=1000, burst=1000, per_fingerprint_rate=0.001, per_fingerprint_burst=2)
+
+    assert [limiter.allow("a", "ValueError") for _ in range(3)] == [True, True, False]
+    # Other fingerprints are not affected and the circuit breaker is not tripped
+    assert limiter.allow("b", "ValueError") is True
+    assert limiter.is_open is False
+
+    summary, = limiter.pop_summaries(force=True)
+    assert summary["suppressed"] == 1
+    assert summary["exc_types"] == {"ValueError": 1}
+
+
+def test_global_reject_refunds_fingerprint_token():
+    limiter = RateLimiter(rate=0.001, burst=1, per_fingerprint_rate=0.001, per_fingerprint_burst=1, cooldown=0)
+
+    assert limiter.allow("a", "ValueError") is True
+    # Rejected by the global bucket only, fingerprint "b" keeps its token
+    assert limiter.allow("b", "ValueError") is False
+    limiter._bucket.tokens = 1
+    assert limiter.allow("b", "ValueError") is True
+
+
+def test_circuit_breaker(in_memory):
+    limiter = RateLimiter(rate=0.001, burst=2, cooldown=60, summary_interval=3600)
+    lc = loccer.Loccer(output_handlers=(in_memory,), integrations=(), suppress_exception=True, rate_limiter=limiter)
+
+    with patch.object(bases.ExceptionData, "capture_frames") as capture_locals:
+        for x in range(10):
+            with lc:
+                raise ValueError(f"rate limit {x}")
+
+    assert capture_locals.call_count == 2
+    assert [x["msg"] for x in in_memory.logs] == ["rate limit 0", "rate limit 1"]
+    assert limiter.is_open is True
+    assert limiter.suppressed_total == 8
+
+    lc.flush()
+    summary = in_memory.logs[-1]
+    assert summary["loccer_type"] == "metadata_log"
+    assert summary["data"]["suppressed"] == 8
+    assert summary["data"]["circuit_open"] is True
+
+
+def test_invalid_rate_limiter():
+    with pytest.raises(ValueError):
+        RateLimiter(rate=0)
+
+    with pytest.raises(ValueError):
+        RateLimiter(burst=0)
@@ -0,0 +1,104 @@
+import collections
+import io
+import json
+
+import pytest
+
+import loccer
+from loccer.outputs.binary import BinaryEncoder, BinaryReader, MAGIC
+from loccer.outputs.file_stream import LoccerJSONEncoder
+from loccer.safe_repr import SafeRepr, safe_repr
+
+
+@pytest.mark.parametrize("obj", (
+    None, True, 1.5, 42, "text", b"bytes", [], (), {}, set(), (1,), [1, "a"], {"a": [1, 2]}, frozenset(),
+))
+def test_same_as_repr(obj):
+    assert safe_repr(obj) == repr(obj)
+
+
+class ListSubclass(list):
+    pass
+
+
+class SetSubclass(set):
+    pass
+
+
+@pytest.mark.parametrize("obj", (
+    collections.OrderedDict(a=1, b=[2]), collections.OrderedDict(), collections.defaultdict(list, a=1),
+    collections.Counter("aab"), collections.Counter(), collections.deque([1, 2], maxlen=3),
+    ListSubclass([1, 2]), SetSubclass([1]), SetSubclass(), frozenset([1]),
+))
+def test_builtin_subclasses_same_as_repr(obj):
+    assert safe_repr(obj) == repr(obj)
+
+
+def test_limits_subclasses():
+    class Mapping(collections.UserDict):
+        def __repr__(self):
+            raise AssertionError("Full repr must not be built")
+
+    engine = SafeRepr(max_items=3)
+    big = range(10**6)
+
+    assert engine.repr(collections.OrderedDict.fromkeys(big)).endswith("...(+999997)])")
+    assert engine.repr(collections.defaultdict(int, dict.fromkeys(big, 0))) == \
+        "defaultdict(<class 'int'>, {0: 0, 1: 0, 2: 0, ...(+999997)})"
+    assert engine.repr(ListSubclass(big)) == "[0, 1, 2, ...(+999997)]"
+    assert engine.repr(Mapping(dict.fromkeys(big, 0))) == "Mapping({0: 0, 1: 0, 2: 0, ...(+999997)})"
+
+
+def test_limits():
+    engine = SafeRepr(max_length=100, max_string=10, max_depth=2, max_items=3, max_int_bits=64)
+
+    assert engine.repr(list(range(10**6))) == "[0, 1, 2, ...(+999997)]"
+    assert engine.repr({x: x for x in range(5)}) == "{0: 0, 1: 1, 2: 2, ...(+2)}"
+    assert engine.repr("x" * 20) == repr("x" * 10) + "...(+10)"
+    assert engine.repr([[[1]]]) == "[[[...]]]"
+    assert engine.repr(2**100) == "<int with 101 bits>"
+
+    out = engine.repr(["x" * 10] * 3 + [object()] * 10)
+    assert len(out) <= 100 + len("...(+000)")
+
+
+def test_cycles():
+    data = [1]
+    data.append(data)
+    assert safe_repr(data).startswith("[1, <recursion on list")
+
+    # Shared references that are not cycles are formatted normally
+    shared = [1]
+    assert safe_repr([shared, shared]) == "[[1], [1]]"
+
+
+def test_repr_error():
+    class A:
+        def __repr__(self):
+            raise RuntimeError("repr", 42)
+
+    assert safe_repr(A()) == "Error getting repr of the object: `RuntimeError: repr; 42`"
+    assert safe_repr([A()]) == "[Error getting repr of the object: `RuntimeError: repr; 42`]"
+
+
+def test_bounded_locals_capture(in_memory):
+    with loccer.capture_exception:
+        huge = list(range(10**6))
+        raise RuntimeError("huge locals")
+
+    frame = in_memory.logs[0]["frames"][-1]
+    assert len(frame["locals"]["huge"]) < 200
+
+
+def test_bounded_integration_payload_encoding():
+    class Hostile:
+        def __repr__(self):
+            raise RuntimeError("hostile")
+
+    payload = {"huge": range(10**6), "set": set(range(10**5)), "hostile": Hostile()}
+    encoded = json.dumps(payload, cls=LoccerJSONEncoder)
+    assert len(encoded) < 1000
+    assert "Error getting repr of the object" in json.loads(encoded)["hostile"]
+
+    decoded = BinaryReader(io.BytesIO(MAGIC + BinaryEncoder().encode(payload)))
+    assert list(decoded) == [json.loads(encoded)]
@@ -0,0 +1,103 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+import loccer
+from loccer.bases import ExceptionData
+from loccer.source import SourceCache
+
+
+def test_source_cache(tmp_path):
+    fpath = tmp_path / "module.py"
+    fpath.write_text("first = 1\n    second = 2\n")
+    cache = SourceCache(max_lines=1)
+
+    assert cache.getline(str(fpath), 2) == "second = 2"
+    assert cache.getline(str(fpath), 3) == ""
+    assert cache.getline(str(tmp_path / "missing.py"), 1) == ""
+
+    # Only requested lines are cached, not whole files
+    fpath.write_text("changed\nchanged\n")
+    assert cache.getline(str(tmp_path / "missing.py"), 1) == ""
+    assert cache.getline(str(fpath), 2) == "changed"
+
+
+def test_source_cache_modified_file(tmp_path):
+    fpath = tmp_path / "module.py"
+    fpath.write_text("original = 1\n")
+    cache = SourceCache(check_interval=0)
+    assert cache.prewarm([str(fpath)]) == 1
+    assert cache.getline(str(fpath), 1) == "original = 1"
+
+    # Edited source file of a long running process
+    fpath.write_text("edited = 2\n")
+    stat = os.stat(fpath)
+    os.utime(fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.getline(str(fpath), 1) == "edited = 2"
+
+    # Modification time is not checked again within the check interval
+    cache.check_interval = 3600
+    fpath.write_text("edited = 3\n")
+    os.utime(fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    assert cache.getline(str(fpath), 1) == "edited = 2"
+
+    with pytest.raises(ValueError):
+        SourceCache(check_interval=-1)
+
+
+def test_prewarm(tmp_path):
+    fpath = tmp_path / "module.py"
+    fpath.write_text("prewarmed = True\n")
+    cache = SourceCache()
+    assert cache.prewarm([str(fpath), str(tmp_path / "missing.py")]) == 1
+
+    fpath.unlink()
+    assert cache.getline(str(fpath), 1) == "prewarmed = True"
+
+    assert cache.prewarm_modules(["loccer"]) > 1
+
+
+def test_lazy_source_lines():
+    with patch("loccer.bases.DEFAULT_SOURCE_CACHE") as source_cache:
+        source_cache.getline.return_value = "resolved line"
+
+        try:
+            raise RuntimeError("lazy lines")
+        except RuntimeError as exc:
+            exc_data = ExceptionData.from_exception(exc)
+
+        source_cache.getline.assert_not_called()
+        # Lines are resolved only when the log is serialized
+        data = exc_data.cached_json()
+        assert source_cache.getline.call_count == 1
+
+    assert data["frames"][-1]["line"] == "resolved line"
+
+
+def test_lazy_chained_source_lines():
+    with patch("loccer.bases.DEFAULT_SOURCE_CACHE") as source_cache:
+        source_cache.getline.return_value = "resolved line"
+
+        try:
+            try:
+                raise KeyError("cause")
+            except KeyError as exc:
+                raise RuntimeError("chained lazy lines") from exc
+        except RuntimeError as exc:
+            exc_data = ExceptionData.from_exception(exc)
+
+        source_cache.getline.assert_not_called()
+        assert exc_data.__cause__.stack[-1].line == "resolved line"
+        assert source_cache.getline.call_count == 1
+
+
+def test_drop_source_lines(in_memory):
+    lc = loccer.Loccer(output_handlers=(in_memory,), integrations=(), suppress_exception=True, source_lines=False)
+
+    with patch("loccer.bases.DEFAULT_SOURCE_CACHE") as source_cache:
+        with lc:
+            raise RuntimeError("no lines")
+
+    source_cache.getline.assert_not_called()
+    assert all(x["line"] is None for x in in_memory.logs[0]["frames"])
@@ -0,0 +1,176 @@
+import datetime
+
+import pytest
+
+import loccer
+from loccer.bases import MetadataLog
+from loccer.outputs.misc import InMemoryOutput
+from loccer.outputs.sqlite import SQLiteOutput, connect, query, _build_query
+
+
+def _raise_type_error(idx):
+    raise TypeError(f"type error {idx}")
+
+
+def _raise_value_error(idx):
+    raise ValueError(f"value error {idx}" + "x" * 2000)
+
+
+@pytest.fixture
+def sqlite_out(tmp_path):
+    out = SQLiteOutput(str(tmp_path / "errors.db"), batch_size=1000)
+    yield out
+    out.close()
+
+
+def test_sqlite_inserts(sqlite_out):
+    lc = loccer.Loccer(output_handlers=(sqlite_out,), integrations=(), suppress_exception=True)
+
+    # Capture a couple of exceptions and fan them out, the capture cost is not part of the insert rate
+    for idx in range(5):
+        with lc:
+            _raise_type_error(idx)
+        with lc:
+            _raise_value_error(idx)
+
+    mem = InMemoryOutput()
+    lc.output_handlers = (sqlite_out, mem)
+    with lc:
+        _raise_type_error("marker")
+
+    for idx in range(5000):
+        sqlite_out.output(MetadataLog({"idx": idx}))
+    assert sqlite_out.flush(timeout=30)
+
+    assert sqlite_out.inserted == 5011
+    assert sqlite_out.errors == 0
+
+    type_errors = sqlite_out.query(exc_type="TypeError")
+    assert len(type_errors) == 6
+    assert type_errors[-1]["msg"] == "type error marker"
+    assert type_errors[-1]["frames"] == mem.logs[0]["frames"]
+
+    value_errors = sqlite_out.query(exc_type="ValueError", limit=2)
+    assert [x["msg"][:13] for x in value_errors] == ["value error 0", "value error 1"]
+
+    fingerprint = type_errors[0]["fingerprint"]
+    # Marker exception is raised from a different place so it has its own fingerprint
+    assert len(sqlite_out.query(fingerprint=fingerprint)) == 5
+    assert len(sqlite_out.query(frame_name="_raise_value_error")) == 5
+    assert len(sqlite_out.query(loccer_type="metadata_log")) == 5000
+
+    conn = connect(sqlite_out.filename)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM exc_types").fetchone()[0] == 2
+        assert conn.execute("SELECT count FROM fingerprints WHERE fingerprint = ?", (fingerprint,)).fetchone()[0] == 5
+        # Large payloads are compressed, small metadata logs are stored as they are
+        assert conn.execute("SELECT COUNT(*) FROM events WHERE compressed = 1").fetchone()[0] == 11
+        assert conn.execute("SELECT COUNT(*) FROM events WHERE compressed = 0").fetchone()[0] == 5000
+    finally:
+        conn.close()
+
+
+def test_sqlite_time_range(sqlite_out):
+    for idx in range(10):
+        log = MetadataLog({"idx": idx})
+        log.ts = datetime.datetime(2023, 9, 1, 12, idx)
+        sqlite_out.output(log)
+    sqlite_out.flush()
+
+    results = sqlite_out.query(since=datetime.datetime(2023, 9, 1, 12, 3), until="2023-09-01T12:05:00")
+    assert [x["data"]["idx"] for x in results] == [3, 4, 5]
+
+
+@pytest.mark.parametrize("kwargs", (
+    {"since": "2023-09-01"},
+    {"exc_type": "TypeError"},
+    {"fingerprint": "abc"},
+))
+def test_sqlite_query_uses_index(sqlite_out, kwargs):
+    params = {"since": None, "until": None, "exc_type": None, "fingerprint": None, "loccer_type": None, "frame_name": None, "limit": None}
+    params.update(kwargs)
+    sql, args = _build_query(**params)
+
+    conn = connect(sqlite_out.filename)
+    try:
+        plan = " ".join(str(x) for x in conn.execute("EXPLAIN QUERY PLAN " + sql, args).fetchall())
+    finally:
+        conn.close()
+
+    assert "USING INDEX events_" in plan
+
+
+def test_sqlite_pruning(tmp_path):
+    out = SQLiteOutput(str(tmp_path / "errors.db"), max_events=100, prune_interval=0)
+    for idx in range(150):
+        out.output(MetadataLog({"idx": idx}))
+    out.flush()
+    out.prune()
+
+    results = list(query(out.filename))
+    assert len(results) == 100
+    assert results[0]["data"]["idx"] == 50
+
+    old = MetadataLog({"old": True})
+    old.ts = datetime.datetime(2000, 1, 1)
+    out.output(old)
+    out.flush()
+    out.max_events = None
+    out.max_age = 3600
+    assert out.prune() == 1
+    assert out.pruned >= 51
+    out.close()
+
+
+def test_sqlite_malformed_log_in_batch(sqlite_out):
+    malformed = MetadataLog({"idx": "malformed"})
+    malformed.cached_json()["frames"] = [{"name": "missing filename"}]
+
+    with sqlite_out._cond:
+        # Queue the logs while holding the lock so they are inserted as a single batch
+        for idx in range(3):
+            sqlite_out.output(MetadataLog({"idx": idx}))
+        sqlite_out.output(malformed)
+        sqlite_out.output(MetadataLog({"idx": 3}))
+    assert sqlite_out.flush(timeout=30)
+
+    assert sqlite_out.errors == 1
+    assert isinstance(sqlite_out.last_error, KeyError)
+    assert sqlite_out.inserted == 4
+    assert [x["data"]["idx"] for x in sqlite_out.query()] == [0, 1, 2, 3]
+
+
+def test_sqlite_output_after_close(sqlite_out):
+    sqlite_out.close()
+    sqlite_out.output(MetadataLog({}))
+    assert sqlite_out.dropped == 1
+
+
+def test_sqlite_pruning_removes_orphans(tmp_path):
+    out = SQLiteOutput(str(tmp_path / "errors.db"), max_events=3)
+    lc = loccer.Loccer(output_handlers=(out,), integrations=(), suppress_exception=True)
+
+    with lc:
+        _raise_value_error(0)
+    for idx in range(3):
+        with lc:
+            _raise_type_error(idx)
+    out.flush()
+    out.prune()
+    assert out.pruned == 1
+
+    conn = connect(out.filename)
+    try:
+        assert conn.execute("SELECT count FROM fingerprints").fetchall() == [(3,)]
+        assert conn.execute("SELECT COUNT(*) FROM frames WHERE name = '_raise_value_error'").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+    # Writer does not reuse the cached ids of the removed rows
+    with lc:
+        _raise_value_error(1)
+    out.flush()
+    assert out.errors == 0
+    assert len(out.query(frame_name="_raise_value_error")) == 1
+    assert len(out.query(fingerprint=out.query(exc_type="ValueError")[0]["fingerprint"])) == 1
+    out.close()